@@ -1,6 +1,10 @@
 import java.io.*;
 import java.net.*;
 import java.nio.file.*;
+import java.security.MessageDigest;
+import java.security.NoSuchAlgorithmException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
 
 import jp.vstone.RobotLib.CPlayWave;
 import jp.vstone.RobotLib.CRobotUtil;
@@ -18,6 +22,15 @@ public class AudioAckServer {
     // 再生は同時に走らせない（ファイル上書き＆音が混ざるのを防ぐ）
     private static final Object playLock = new Object();
 
+    // SESSION モードで一定時間コマンドもハートビートも来なければ切断する
+    private static final int SESSION_IDLE_TIMEOUT_MS = 30_000;
+
+    // BUNDLE 1回あたりの最大件数
+    private static final int MAX_BUNDLE_ITEMS = 1000;
+
+    // PLAYSEQ 1回あたりの最大件数（BATCH と同じ）
+    private static final int MAX_SEQ_ITEMS = 200;
+
     // BufferedReaderを使わずに、バイトで1行読む（\nまで）
     private static String readLineAscii(InputStream in, int maxLen) throws IOException {
         ByteArrayOutputStream bos = new ByteArrayOutputStream();
@@ -52,6 +65,285 @@ public class AudioAckServer {
         CRobotUtil.wait((int) Math.min(Integer.MAX_VALUE, waitMs));
     }
 
+    private static boolean validSizes(int durationMs, int n) {
+        return !(n <= 0 || n > 50_000_000 || durationMs < 0 || durationMs > 600_000);
+    }
+
+    // BUNDLE : count 件の (key行, durationMs, size, wav) を受信しながら順にキャッシュへ書き出す
+    // （全件をメモリに溜めない）。成功なら true、サイズ不正なら false（ストリームは継続できない）
+    private static boolean receiveBundle(InputStream rawIn, DataInputStream din) throws IOException {
+        ensureCacheDir();
+        int count = din.readInt();
+        if (count <= 0 || count > MAX_BUNDLE_ITEMS) return false;
+
+        byte[] buf = new byte[64 * 1024];
+        for (int i = 0; i < count; i++) {
+            String key = readLineAscii(rawIn, 256);
+            int durationMs = din.readInt();
+            int n = din.readInt();
+            if (key == null || !validSizes(durationMs, n)) return false;
+
+            try (FileOutputStream fos = new FileOutputStream(safeKeyToPath(key.trim()))) {
+                int remaining = n;
+                while (remaining > 0) {
+                    int r = din.read(buf, 0, Math.min(buf.length, remaining));
+                    if (r < 0) throw new EOFException("bundle truncated");
+                    fos.write(buf, 0, r);
+                    remaining -= r;
+                }
+            }
+        }
+        return true;
+    }
+
+    // 保存済みwavの内容ハッシュ（クライアント側の転送用wavと照合して再送を省く）
+    private static String sha256Hex(Path p) throws IOException {
+        try {
+            MessageDigest md = MessageDigest.getInstance("SHA-256");
+            try (InputStream in = Files.newInputStream(p)) {
+                byte[] buf = new byte[64 * 1024];
+                int r;
+                while ((r = in.read(buf)) > 0) md.update(buf, 0, r);
+            }
+            StringBuilder sb = new StringBuilder();
+            for (byte b : md.digest()) sb.append(String.format("%02x", b));
+            return sb.toString();
+        } catch (NoSuchAlgorithmException e) {
+            throw new IOException(e);
+        }
+    }
+
+    // HAS : 保存済みで、ハッシュ指定があれば内容も一致するか
+    private static boolean hasKey(String key, String sha256) throws IOException {
+        Path p = Paths.get(safeKeyToPath(key));
+        if (!Files.exists(p)) return false;
+        return sha256 == null || sha256.equalsIgnoreCase(sha256Hex(p));
+    }
+
+    // DEL : 保存済みwavを削除（なければ false）
+    private static boolean deleteKey(String key) throws IOException {
+        return Files.deleteIfExists(Paths.get(safeKeyToPath(key)));
+    }
+
+    // PLAYSEQ : count 件の (key行, durationMs) を読む。件数不正なら null
+    private static String[] readSeq(InputStream rawIn, DataInputStream din, int[] durations) throws IOException {
+        int count = din.readInt();
+        if (count <= 0 || count > MAX_SEQ_ITEMS) return null;
+        String[] keys = new String[count];
+        for (int i = 0; i < count; i++) {
+            String key = readLineAscii(rawIn, 256);
+            durations[i] = din.readInt();
+            if (key == null || durations[i] < 0 || durations[i] > 600_000) return null;
+            keys[i] = key.trim();
+        }
+        return keys;
+    }
+
+    // 保存済みwavを順に再生し、各項目の開始・終了を `STARTED [id] <index> <robot_ms>` / `FINISHED ...` で通知する。
+    // 全て終われば `ACK [id]`、未保存のキーがあれば `NOFILE [id] <index>`、再生に失敗すれば `ERR [id] <index>`（そこで中断）
+    private static void playSeq(String[] keys, int[] durations, OutputStream out, Object writeLock, String idPart)
+            throws IOException {
+        synchronized (playLock) {
+            for (int i = 0; i < keys.length; i++) {
+                Path p = Paths.get(safeKeyToPath(keys[i]));
+                if (!Files.exists(p)) {
+                    writeLine(out, writeLock, "NOFILE" + idPart + " " + i);
+                    return;
+                }
+                try {
+                    byte[] wav = Files.readAllBytes(p);
+                    writeLine(out, writeLock, "STARTED" + idPart + " " + i + " " + System.currentTimeMillis());
+                    playBytes(wav, durations[i]);
+                } catch (Exception e) {
+                    e.printStackTrace();
+                    writeLine(out, writeLock, "ERR" + idPart + " " + i);
+                    return;
+                }
+                writeLine(out, writeLock, "FINISHED" + idPart + " " + i + " " + System.currentTimeMillis());
+            }
+        }
+        writeLine(out, writeLock, "ACK" + idPart);
+    }
+
+    private static void writeLine(OutputStream out, Object writeLock, String line) throws IOException {
+        synchronized (writeLock) {
+            out.write((line + "\n").getBytes("UTF-8"));
+            out.flush();
+        }
+    }
+
+    // 再生スレッドでの失敗を ERR で返す（応答がないとホスト側はタイムアウトまで待ち続ける）
+    private static void replyError(OutputStream out, Object writeLock, String line, Exception e) {
+        e.printStackTrace();
+        try {
+            writeLine(out, writeLock, line);
+        } catch (IOException ignore) {}
+    }
+
+    // SESSION : 1接続で複数コマンドを処理する（各コマンドにリクエストIDを付け、応答にも同じIDを返す）
+    // 再生は専用スレッドで順番に行い、その間もPUT/PINGの読み取りは続ける
+    private static void handleSession(Socket s, InputStream rawIn, OutputStream out) throws IOException {
+        final Object writeLock = new Object();
+        ExecutorService player = Executors.newSingleThreadExecutor();
+        DataInputStream din = new DataInputStream(rawIn);
+        s.setSoTimeout(SESSION_IDLE_TIMEOUT_MS);
+        writeLine(out, writeLock, "SESSION OK");
+
+        try {
+            while (true) {
+                String line = readLineAscii(rawIn, 256);
+                if (line == null) break;
+
+                String[] parts = line.trim().split("\\s+");
+                String cmd = parts[0];
+                if ("BYE".equals(cmd)) break;
+                if (parts.length < 2) {
+                    writeLine(out, writeLock, "ERR");
+                    continue;
+                }
+                final String id = parts[1];
+                if (("PUT".equals(cmd) || "PLAYKEY".equals(cmd)) && parts.length < 3) {
+                    writeLine(out, writeLock, "ERR " + id);
+                    break; // キーがないとペイロードを読まずに次のコマンドへ進めない
+                }
+
+                if ("PING".equals(cmd)) {
+                    writeLine(out, writeLock, "PONG " + id);
+
+                } else if ("PUT".equals(cmd) && parts.length >= 3) {
+                    ensureCacheDir();
+                    int durationMs = din.readInt();
+                    int n = din.readInt();
+                    if (!validSizes(durationMs, n)) {
+                        writeLine(out, writeLock, "ERR " + id);
+                        break; // ペイロード長が信用できないのでストリームを継続できない
+                    }
+                    byte[] wav = new byte[n];
+                    din.readFully(wav);
+                    try (FileOutputStream fos = new FileOutputStream(safeKeyToPath(parts[2]))) {
+                        fos.write(wav);
+                    }
+                    writeLine(out, writeLock, "OK " + id);
+
+                } else if ("BUNDLE".equals(cmd)) {
+                    if (!receiveBundle(rawIn, din)) {
+                        writeLine(out, writeLock, "ERR " + id);
+                        break;
+                    }
+                    writeLine(out, writeLock, "OK " + id);
+
+                } else if ("HAS".equals(cmd) && parts.length >= 3) {
+                    boolean ok = hasKey(parts[2], parts.length >= 4 ? parts[3] : null);
+                    writeLine(out, writeLock, (ok ? "YES " : "NO ") + id);
+
+                } else if ("DEL".equals(cmd) && parts.length >= 3) {
+                    writeLine(out, writeLock, (deleteKey(parts[2]) ? "OK " : "NOFILE ") + id);
+
+                } else if ("PLAYKEY".equals(cmd) && parts.length >= 3) {
+                    final int durationMs = din.readInt();
+                    final String path = safeKeyToPath(parts[2]);
+                    player.submit(() -> {
+                        try {
+                            if (!Files.exists(Paths.get(path))) {
+                                writeLine(out, writeLock, "NOFILE " + id);
+                                return;
+                            }
+                            byte[] wav = Files.readAllBytes(Paths.get(path));
+                            synchronized (playLock) {
+                                playBytes(wav, durationMs);
+                            }
+                            writeLine(out, writeLock, "ACK " + id);
+                        } catch (Exception e) {
+                            replyError(out, writeLock, "ERR " + id, e);
+                        }
+                    });
+
+                } else if ("PLAYSEQ".equals(cmd)) {
+                    final int[] durations = new int[MAX_SEQ_ITEMS];
+                    final String[] keys = readSeq(rawIn, din, durations);
+                    if (keys == null) {
+                        writeLine(out, writeLock, "ERR " + id);
+                        break;
+                    }
+                    player.submit(() -> {
+                        try {
+                            playSeq(keys, durations, out, writeLock, " " + id);
+                        } catch (Exception e) {
+                            replyError(out, writeLock, "ERR " + id, e);
+                        }
+                    });
+
+                } else if ("PLAY".equals(cmd)) {
+                    final int durationMs = din.readInt();
+                    int n = din.readInt();
+                    if (!validSizes(durationMs, n)) {
+                        writeLine(out, writeLock, "ERR " + id);
+                        break;
+                    }
+                    final byte[] wav = new byte[n];
+                    din.readFully(wav);
+                    player.submit(() -> {
+                        try {
+                            synchronized (playLock) {
+                                playBytes(wav, durationMs);
+                            }
+                            writeLine(out, writeLock, "ACK " + id);
+                        } catch (Exception e) {
+                            replyError(out, writeLock, "ERR " + id, e);
+                        }
+                    });
+
+                } else if ("BATCH".equals(cmd)) {
+                    int count = din.readInt();
+                    if (count <= 0 || count > 200) {
+                        writeLine(out, writeLock, "ERR " + id);
+                        break;
+                    }
+                    final int[] durations = new int[count];
+                    final byte[][] wavs = new byte[count][];
+                    boolean ok = true;
+                    for (int i = 0; i < count; i++) {
+                        durations[i] = din.readInt();
+                        int n = din.readInt();
+                        if (!validSizes(durations[i], n)) {
+                            ok = false;
+                            break;
+                        }
+                        wavs[i] = new byte[n];
+                        din.readFully(wavs[i]);
+                    }
+                    if (!ok) {
+                        writeLine(out, writeLock, "ERR " + id);
+                        break;
+                    }
+                    player.submit(() -> {
+                        try {
+                            synchronized (playLock) {
+                                for (int i = 0; i < wavs.length; i++) {
+                                    playBytes(wavs[i], durations[i]);
+                                }
+                            }
+                            writeLine(out, writeLock, "ACK " + id);
+                        } catch (Exception e) {
+                            replyError(out, writeLock, "ERR " + id, e);
+                        }
+                    });
+
+                } else {
+                    writeLine(out, writeLock, "ERR " + id);
+                }
+            }
+        } catch (SocketTimeoutException e) {
+            System.out.println("session idle timeout, closing");
+        } finally {
+            // 受け付け済みの再生は最後まで行ってから切断する
+            player.shutdown();
+            try {
+                player.awaitTermination(10, java.util.concurrent.TimeUnit.MINUTES);
+            } catch (InterruptedException ignore) {}
+        }
+    }
+
     private static void handleClient(Socket s) {
         try {
             s.setTcpNoDelay(true);
@@ -68,6 +360,12 @@ public class AudioAckServer {
 
             DataInputStream din = new DataInputStream(rawIn);
 
+            // SESSION : 常時接続モード（コマンドループ）
+            if ("SESSION".equals(cmd)) {
+                handleSession(s, rawIn, out);
+                return;
+            }
+
             // PUT key : wavをキャッシュに保存（再生しない）
             if ("PUT".equals(cmd)) {
                 if (parts.length < 2) {
@@ -100,6 +398,63 @@ public class AudioAckServer {
                 return;
             }
 
+            // BUNDLE : 複数wavを1回の転送でキャッシュに保存（再生しない）
+            if ("BUNDLE".equals(cmd)) {
+                out.write((receiveBundle(rawIn, din) ? "OK\n" : "ERR\n").getBytes("UTF-8"));
+                out.flush();
+                return;
+            }
+
+            // HAS key [sha256] : 保存済みか（内容ハッシュも一致するか）
+            if ("HAS".equals(cmd)) {
+                boolean ok = parts.length >= 2 && hasKey(parts[1], parts.length >= 3 ? parts[2] : null);
+                out.write((ok ? "YES\n" : "NO\n").getBytes("UTF-8"));
+                out.flush();
+                return;
+            }
+
+            // DEL key : 保存済みwavを削除
+            if ("DEL".equals(cmd)) {
+                if (parts.length < 2) {
+                    out.write("ERR\n".getBytes("UTF-8"));
+                } else {
+                    out.write((deleteKey(parts[1]) ? "OK\n" : "NOFILE\n").getBytes("UTF-8"));
+                }
+                out.flush();
+                return;
+            }
+
+            // LIST : 保存済みwavの一覧。`<件数>\n` に続けて1件1行 `<key> <size> <sha256>\n`
+            if ("LIST".equals(cmd)) {
+                ensureCacheDir();
+                StringBuilder sb = new StringBuilder();
+                int n = 0;
+                try (DirectoryStream<Path> ds = Files.newDirectoryStream(Paths.get(CACHE_DIR), "*.wav")) {
+                    for (Path p : ds) {
+                        String name = p.getFileName().toString();
+                        String key = name.substring(0, name.length() - ".wav".length());
+                        sb.append(key).append(' ').append(Files.size(p)).append(' ').append(sha256Hex(p)).append('\n');
+                        n++;
+                    }
+                }
+                out.write((n + "\n" + sb).getBytes("UTF-8"));
+                out.flush();
+                return;
+            }
+
+            // PLAYSEQ : キャッシュ済みwavを順に再生し、項目ごとの開始・終了を通知
+            if ("PLAYSEQ".equals(cmd)) {
+                int[] durations = new int[MAX_SEQ_ITEMS];
+                String[] keys = readSeq(rawIn, din, durations);
+                if (keys == null) {
+                    out.write("ERR\n".getBytes("UTF-8"));
+                    out.flush();
+                    return;
+                }
+                playSeq(keys, durations, out, new Object(), "");
+                return;
+            }
+
             // PLAYKEY key : キャッシュ済みwavを再生
             if ("PLAYKEY".equals(cmd)) {
                 if (parts.length < 2) {
@@ -1,8 +1,10 @@
 # app3.py
 from flask import Flask, request, render_template, jsonify
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
+from collections import OrderedDict
 import os
 import json
+import time
 
 # ==============================================================================
 # 1. 絵本データ定義 (Flask用) ★★★ 追加箇所 ★★★
@@ -72,21 +74,75 @@ BOOK_DEFINITIONS_FOR_FLASK = {
     }
 }
 # ★★★ 現在使用する絵本IDを指定 ★★★ (他のスクリプトと同期させてください)
+# （セッションごとに絵本を指定しない場合の既定値）
 CURRENT_FLASK_BOOK_ID = "suhu" 
 # ==============================================================================
 
+# ==============================================================================
+# 2. 読み聞かせセッション（ロボット1台 + ブラウザ（タブレット）の組）
+# ==============================================================================
+# 1台のPCで複数の組を同時に動かせるよう、指示はセッションごとの部屋にだけ送る。
+#   ブラウザ  : /session/<session_id> を開く（/ は既定のセッション）
+#   読み上げ側: SocketIO の auth={'role': 'reader', 'session': ..., 'book': ...}、HTTP なら JSON の session_id
+DEFAULT_SESSION_ID = 'default'
+SESSIONS = {}   # session_id -> {'book_id': ...}
+CLIENTS = {}    # SocketIO の接続（request.sid） -> session_id
+BROWSERS = {}   # そのうちブラウザの接続（request.sid） -> session_id
+
+def session_book_id(session_id):
+    return SESSIONS.get(session_id, {}).get('book_id', CURRENT_FLASK_BOOK_ID)
+
+def set_session_book(session_id, book_id):
+    """セッションの絵本を切り替え、表示中のブラウザに読み込み直させる。"""
+    if book_id not in BOOK_DEFINITIONS_FOR_FLASK:
+        raise ValueError(f"unknown book_id: {book_id}")
+    changed = session_book_id(session_id) != book_id
+    SESSIONS.setdefault(session_id, {})['book_id'] = book_id
+    if not changed:
+        return
+    socketio.emit('session_book_changed', {'book_id': book_id}, to=browser_room(session_id))
+    print(f"📚 セッション {session_id} の絵本を {book_id} にしました。")
+
+def browser_room(session_id):
+    return f'browser:{session_id}'
+
+def reader_room(session_id):
+    return f'reader:{session_id}'
+
+def browser_count(session_id):
+    """セッションの部屋に接続しているブラウザの数（0 なら読み上げ側はめくり完了を待たない）。"""
+    return sum(1 for s in BROWSERS.values() if s == session_id)
+
+def request_session_id(data=None):
+    """HTTP の通知（JSON の session_id）または SocketIO の接続から、セッションIDを決める。"""
+    if data and data.get('session_id'):
+        return str(data['session_id'])
+    return CLIENTS.get(getattr(request, 'sid', None), DEFAULT_SESSION_ID)
+
 
 app = Flask(__name__)
 # 本番環境ではより複雑なものに変更してください
 app.config['SECRET_KEY'] = 'your_very_secret_key_for_socketio' 
 socketio = SocketIO(app)
 
+def send_turn_command(session_id, flip_duration, turn_id=None):
+    """セッションのブラウザに 'turn_page_command' を送信する。"""
+    if turn_id is not None:
+        TURNED_ACKS.pop(str(turn_id), None)
+    socketio.emit('turn_page_command', {
+        'status': 'page_turned', 
+        'message': 'Sota finished reading. Turning page...',
+        'flip_duration': flip_duration, # ここでめくり速度を送信
+        'turn_id': turn_id
+    }, to=browser_room(session_id))
+
 # Sotaの読み上げ完了を通知するエンドポイント
 @app.route('/sota_reading_finished', methods=['POST'])
 def sota_reading_finished():
     """
     SotaのPythonスクリプトから、読み上げ完了の通知を受け取るエンドポイント。
     受け取った通知をコンソールに出力し、WebSocketでページめくり指示を送信する。
+    （常時接続する場合は SocketIO の 'reader_flip' を使う）
     """
     if request.method == 'POST':
         data = request.get_json() 
@@ -95,29 +151,156 @@ def sota_reading_finished():
         print(f"Sotaから読み上げ完了通知を受信しました！")
         print(f"受信しためくり速度: {flip_duration}ms")
         
-        # WebSocketを通じて、接続している全てのクライアントに'turn_page_command'を送信
-        socketio.emit('turn_page_command', {
-            'status': 'page_turned', 
-            'message': 'Sota finished reading. Turning page...',
-            'flip_duration': flip_duration # ここでめくり速度を送信
-        })
+        # めくり完了通知（page_turned）と対応づけるID（読み上げ側が付ける。なければ完了通知なし）
+        session_id = request_session_id(data)
+        send_turn_command(session_id, flip_duration, data.get('turn_id') if data else None)
         print("ウェブブラウザにページめくりコマンドを送信しました。")
         
-        return "Notification Received", 200 
+        return jsonify({'ok': True, 'browsers': browser_count(session_id)}), 200
     return "Method Not Allowed", 405
 
+@socketio.on('connect')
+def on_connect(auth=None):
+    # 読み上げ側は auth={'role': 'reader', 'session': ...}、ブラウザは auth={'role': 'browser', 'session': ...} で接続する
+    auth = auth or {}
+    session_id = str(auth.get('session') or DEFAULT_SESSION_ID)
+    CLIENTS[request.sid] = session_id
+    if auth.get('role') == 'reader':
+        if auth.get('book'):
+            try:
+                set_session_book(session_id, auth['book'])
+            except ValueError as e:
+                print(f"⚠️ {e}")
+        join_room(reader_room(session_id))
+        print(f"🔌 読み上げ側が接続しました（セッション {session_id}）。")
+    else:
+        BROWSERS[request.sid] = session_id
+        join_room(browser_room(session_id))
+
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    CLIENTS.pop(request.sid, None)
+    BROWSERS.pop(request.sid, None)
+
+@socketio.on('reader_flip')
+def on_reader_flip(data):
+    """読み上げ側からのめくり指示（常時接続）。ブラウザへ送ってから受付（届いたブラウザの数）を返す（ログは送信後）。"""
+    data = data or {}
+    flip_duration = data.get('flip_duration', 600)
+    session_id = request_session_id()
+    send_turn_command(session_id, flip_duration, data.get('turn_id'))
+    print(f"ページめくりコマンドを送信しました（めくり速度: {flip_duration}ms）。")
+    return {'ok': True, 'browsers': browser_count(session_id)}
+
+def send_seek_command(session_id, page):
+    """途中から再開するとき、ブラウザの絵本を指定ページへ直接移す（めくりを繰り返さない）。"""
+    socketio.emit('seek_page_command', {'page': page}, to=browser_room(session_id))
+    print(f"⏩ ブラウザをページ {page} へ移動します（セッション {session_id}）。")
+
+def parse_page(value):
+    """ページ番号（1以上の整数）に変換する。不正な値なら None。"""
+    if isinstance(value, bool):
+        return None
+    try:
+        page = int(value)
+    except (TypeError, ValueError):
+        return None
+    return page if page >= 1 else None
+
+# 読み上げ側から再開ページを受け取るエンドポイント（HttpNotifier 用）
+@app.route('/seek_page', methods=['POST'])
+def seek_page():
+    data = request.get_json(silent=True) or {}
+    page = parse_page(data.get('page', 1))
+    if page is None:
+        return jsonify({'status': 'error', 'error': f"invalid page: {data.get('page')!r}"}), 400
+    send_seek_command(request_session_id(data), page)
+    return jsonify({'status': 'success'}), 200
+
+@socketio.on('reader_seek')
+def on_reader_seek(data):
+    page = parse_page((data or {}).get('page', 1))
+    if page is None:
+        return False
+    send_seek_command(request_session_id(), page)
+    return True
+
+@socketio.on('reader_finished')
+def on_reader_finished(data):
+    survey_url = (data or {}).get('survey_url', '')
+    socketio.emit('show_survey_qr', {'survey_url': survey_url}, to=browser_room(request_session_id()))
+    print("📩 読み聞かせ終了通知を受信しました。アンケートQRを表示します。")
+    return True
+
+# ブラウザのめくり完了通知（turn.js の 'turned'）を読み上げ側へ中継する
+# 受け取った通知は turn_id ごとに保存し、読み上げ側は /page_turned/<turn_id> で完了を待つ
+TURNED_ACKS = OrderedDict()
+MAX_TURNED_ACKS = 100          # 取りに来られなかった通知を溜め込まない
+MAX_TURNED_WAIT_SEC = 30.0
+
+@socketio.on('page_turned')
+def on_page_turned(data):
+    turn_id = (data or {}).get('turn_id')
+    if turn_id is None:
+        return
+    TURNED_ACKS[str(turn_id)] = {
+        'page': data.get('page'),
+        'skipped': bool(data.get('skipped', False)),
+        'browser_time': data.get('browser_time'),
+        'server_time': time.time(),
+    }
+    while len(TURNED_ACKS) > MAX_TURNED_ACKS:
+        TURNED_ACKS.popitem(last=False)
+    # 同じセッションの読み上げ側（常時接続）へはそのまま中継する
+    socketio.emit('page_turned', dict(turn_id=turn_id, **TURNED_ACKS[str(turn_id)]),
+                  to=reader_room(request_session_id()))
+
+@app.route('/page_turned/<turn_id>', methods=['GET'])
+def wait_page_turned(turn_id):
+    """めくり完了通知が届くまで（最大 timeout 秒）待って返す。届かなければ 504。"""
+    try:
+        timeout = min(float(request.args.get('timeout', 5.0)), MAX_TURNED_WAIT_SEC)
+    except ValueError:
+        timeout = 5.0
+    deadline = time.monotonic() + timeout
+    # socketio.sleep は eventlet / gevent / threading のどのモードでも他の処理を止めない
+    while turn_id not in TURNED_ACKS and time.monotonic() < deadline:
+        socketio.sleep(0.01)
+    ack = TURNED_ACKS.pop(turn_id, None)
+    if ack is None:
+        return jsonify({'ok': False, 'turn_id': turn_id}), 504
+    return jsonify(dict(ok=True, turn_id=turn_id, **ack)), 200
+
 # ウェブページを表示するルート
 @app.route('/')
-def index():
+@app.route('/session/<session_id>')
+def index(session_id=DEFAULT_SESSION_ID):
+    # ?book=<絵本ID> でこのセッションの絵本を指定できる（省略時は読み上げ側が指定した絵本、なければ既定）
+    if request.args.get('book') in BOOK_DEFINITIONS_FOR_FLASK:
+        set_session_book(session_id, request.args['book'])
     # ★★★ 修正箇所: IDから設定をロードし、テンプレートに渡す ★★★
-    book_config = BOOK_DEFINITIONS_FOR_FLASK.get(CURRENT_FLASK_BOOK_ID, BOOK_DEFINITIONS_FOR_FLASK["ookinakabu"])
+    book_config = BOOK_DEFINITIONS_FOR_FLASK.get(session_book_id(session_id), BOOK_DEFINITIONS_FOR_FLASK["ookinakabu"])
 
     return render_template('index.html',
+                           session_id=session_id,
                            book_image_dir=book_config["image_dir"],
                            content_pages=book_config["content_pages"],
                            last_page_image=book_config["last_page_image"])
     # ★★★ 修正ここまで ★★★
 
+# セッションの絵本を指定・確認するエンドポイント（HttpNotifier で読み上げるとき・実験の準備用）
+@app.route('/sessions/<session_id>', methods=['GET', 'POST'])
+def session_config(session_id):
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            set_session_book(session_id, data.get('book_id'))
+        except ValueError as e:
+            return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify({'ok': True, 'session_id': session_id, 'book_id': session_book_id(session_id),
+                    'clients': sum(1 for s in CLIENTS.values() if s == session_id),
+                    'browsers': browser_count(session_id)}), 200
+
 # 読み聞かせ終了（アンケート表示）を通知するエンドポイント
 @app.route('/reading_finished', methods=['POST'])
 def reading_finished():
@@ -125,7 +308,7 @@ def reading_finished():
     survey_url = data.get('survey_url', '')
 
     print("📩 読み聞かせ終了通知を受信しました。アンケートQRを表示します。")
-    socketio.emit('show_survey_qr', {'survey_url': survey_url})
+    socketio.emit('show_survey_qr', {'survey_url': survey_url}, to=browser_room(request_session_id(data)))
     return jsonify({'ok': True}), 200
 
 
@@ -0,0 +1,348 @@
+# audio_post.py: 合成済み音声の後処理（無音トリミング・ギャップ正規化・転送用フォーマット変換・話速変換）
+import os
+import sys
+import typing
+import wave
+
+import numpy as np
+
+# ==============================================================================
+# 1. 既定値
+# ==============================================================================
+DEFAULT_HEAD_MS = 30          # 先頭に残す無音 [ms]
+DEFAULT_TAIL_MS = 30          # 末尾に残す無音 [ms]
+DEFAULT_THRESHOLD_DB = -45.0  # これ以下のフレームを無音とみなす [dBFS]
+DEFAULT_FRAME_MS = 10.0       # エネルギー解析のフレーム長 [ms]
+TRANSFER_RATE = 16000         # Sotaへ送る転送用フォーマットのサンプリング周波数 [Hz]
+BASE_SPEED = 100              # 話速変換の元になる基準レンダリングの speed
+
+# サンプル幅(byte) → NumPy dtype（8bit WAV は符号なし）
+_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+# ==============================================================================
+# 2. WAV 入出力
+# ==============================================================================
+def read_wav(path: str) -> typing.Tuple[np.ndarray, dict]:
+    """WAVを読み込み、(frames x channels) の配列とフォーマット情報を返す。"""
+    with wave.open(path, "rb") as wf:
+        params = dict(
+            nchannels=wf.getnchannels(),
+            sampwidth=wf.getsampwidth(),
+            framerate=wf.getframerate(),
+            comptype=wf.getcomptype(),
+            compname=wf.getcompname(),
+        )
+        raw = wf.readframes(wf.getnframes())
+
+    dtype = _DTYPES.get(params["sampwidth"])
+    if dtype is None:
+        raise ValueError(f"未対応のサンプル幅です: {params['sampwidth']} byte ({path})")
+    samples = np.frombuffer(raw, dtype=dtype).reshape(-1, params["nchannels"])
+    return samples, params
+
+
+def write_wav(path: str, samples: np.ndarray, params: dict) -> None:
+    """read_wav と同じ形式の配列を WAV として書き出す。"""
+    dtype = _DTYPES[params["sampwidth"]]
+    with wave.open(path, "wb") as wout:
+        wout.setnchannels(params["nchannels"])
+        wout.setsampwidth(params["sampwidth"])
+        wout.setframerate(params["framerate"])
+        wout.setcomptype(params["comptype"], params["compname"])
+        wout.writeframes(np.ascontiguousarray(samples, dtype=dtype).tobytes())
+
+
+def extract_wav_file(src_path: str, dst_path: str, start: int, nframes: int) -> None:
+    """src_path の [start, start + nframes) フレームを同じフォーマットの WAV として dst_path に保存する。"""
+    samples, params = read_wav(src_path)
+    if start < 0 or start + nframes > len(samples):
+        raise ValueError(f"範囲がファイルの長さを超えています: {start}+{nframes} > {len(samples)} ({src_path})")
+    write_wav(dst_path, samples[start: start + nframes], params)
+
+
+def duration_ms(samples: np.ndarray, framerate: int) -> int:
+    return int(len(samples) * 1000 / framerate) if framerate > 0 else 0
+
+
+def to_float_mono(samples: np.ndarray, sampwidth: int) -> np.ndarray:
+    """整数PCMを -1〜+1 の float モノラルに変換する（解析用）。"""
+    x = samples.astype(np.float64)
+    if sampwidth == 1:
+        x = (x - 128.0) / 128.0
+    else:
+        x = x / float(2 ** (8 * sampwidth - 1))
+    return x.mean(axis=1) if x.ndim == 2 else x
+
+
+# ==============================================================================
+# 3. 無音検出（ベクトル化したフレームエネルギー解析）
+# ==============================================================================
+def frame_db(mono: np.ndarray, framerate: int, frame_ms: float = DEFAULT_FRAME_MS) -> typing.Tuple[np.ndarray, int]:
+    """フレームごとの RMS を dBFS で返す。戻り値: (dB配列, フレーム長[サンプル])"""
+    hop = max(1, int(framerate * frame_ms / 1000.0))
+    n = len(mono) // hop
+    if n == 0:
+        return np.empty(0), hop
+    frames = mono[: n * hop].reshape(n, hop)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10)), hop
+
+
+def voiced_bounds(samples: np.ndarray, params: dict,
+                  threshold_db: float = DEFAULT_THRESHOLD_DB,
+                  frame_ms: float = DEFAULT_FRAME_MS) -> typing.Optional[typing.Tuple[int, int]]:
+    """有音区間の [開始, 終了) サンプル位置を返す。全て無音なら None。"""
+    mono = to_float_mono(samples, params["sampwidth"])
+    db, hop = frame_db(mono, params["framerate"], frame_ms)
+    voiced = np.flatnonzero(db > threshold_db)
+    if voiced.size == 0:
+        return None
+    start = int(voiced[0]) * hop
+    end = min(len(samples), (int(voiced[-1]) + 1) * hop)
+    return start, end
+
+
+def measure_dead_time(samples: np.ndarray, params: dict,
+                      threshold_db: float = DEFAULT_THRESHOLD_DB) -> typing.Tuple[int, int]:
+    """先頭・末尾の無音長 [ms] を返す。"""
+    fr = params["framerate"]
+    bounds = voiced_bounds(samples, params, threshold_db)
+    if bounds is None:
+        total = duration_ms(samples, fr)
+        return total, 0
+    start, end = bounds
+    return int(start * 1000 / fr), int((len(samples) - end) * 1000 / fr)
+
+
+# ==============================================================================
+# 4. トリミング / ギャップ正規化
+# ==============================================================================
+def trim_silence(samples: np.ndarray, params: dict,
+                 head_ms: int = DEFAULT_HEAD_MS, tail_ms: int = DEFAULT_TAIL_MS,
+                 threshold_db: float = DEFAULT_THRESHOLD_DB) -> np.ndarray:
+    """
+    先頭・末尾の無音を head_ms / tail_ms まで詰める。
+    元の無音が目標より短い場合はそのまま残す（無音の追加はしない）。
+    """
+    bounds = voiced_bounds(samples, params, threshold_db)
+    if bounds is None:
+        return samples
+    fr = params["framerate"]
+    start, end = bounds
+    new_start = max(0, start - int(fr * head_ms / 1000.0))
+    new_end = min(len(samples), end + int(fr * tail_ms / 1000.0))
+    return samples[new_start:new_end]
+
+
+def compress_gaps(samples: np.ndarray, params: dict, max_gap_ms: int,
+                  threshold_db: float = DEFAULT_THRESHOLD_DB,
+                  frame_ms: float = DEFAULT_FRAME_MS) -> np.ndarray:
+    """
+    有音区間に挟まれた無音のうち max_gap_ms を超えるものを max_gap_ms に縮める。
+    （統合wavのチャンク間ギャップ 120ms 固定などを後から揃える用途）
+    無音の前半・後半を残し、中央部分を削除する。
+    """
+    mono = to_float_mono(samples, params["sampwidth"])
+    db, hop = frame_db(mono, params["framerate"], frame_ms)
+    voiced = np.flatnonzero(db > threshold_db)
+    if voiced.size < 2:
+        return samples
+
+    max_gap_frames = max(0, int(round(max_gap_ms / frame_ms)))
+    gaps = np.diff(voiced) - 1  # 連続する有音フレーム間の無音フレーム数
+    long_gaps = np.flatnonzero(gaps > max_gap_frames)
+    if long_gaps.size == 0:
+        return samples
+
+    keep = np.ones(len(db), dtype=bool)
+    keep_head = max_gap_frames // 2
+    keep_tail = max_gap_frames - keep_head
+    for g in long_gaps:
+        gap_start = int(voiced[g]) + 1
+        gap_end = int(voiced[g + 1])
+        keep[gap_start + keep_head: gap_end - keep_tail] = False
+
+    mask = np.ones(len(samples), dtype=bool)
+    mask[: len(db) * hop] = np.repeat(keep, hop)
+    return samples[mask]
+
+
+def postprocess_wav_file(path: str, out_path: typing.Optional[str] = None,
+                         head_ms: int = DEFAULT_HEAD_MS, tail_ms: int = DEFAULT_TAIL_MS,
+                         max_gap_ms: typing.Optional[int] = None,
+                         threshold_db: float = DEFAULT_THRESHOLD_DB) -> dict:
+    """
+    WAVファイルに無音トリミング（と必要ならギャップ正規化）を適用して保存する。
+    out_path 省略時は上書き。
+    返り値: {"before_ms", "after_ms", "dead_before_ms", "dead_after_ms"}
+    """
+    samples, params = read_wav(path)
+    fr = params["framerate"]
+    before_ms = duration_ms(samples, fr)
+    dead_before = sum(measure_dead_time(samples, params, threshold_db))
+
+    out = trim_silence(samples, params, head_ms, tail_ms, threshold_db)
+    if max_gap_ms is not None:
+        out = compress_gaps(out, params, max_gap_ms, threshold_db)
+
+    dead_after = sum(measure_dead_time(out, params, threshold_db))
+    if out_path is not None or len(out) != len(samples):
+        write_wav(out_path or path, out, params)
+
+    return {
+        "before_ms": before_ms,
+        "after_ms": duration_ms(out, fr),
+        "dead_before_ms": dead_before,
+        "dead_after_ms": dead_after,
+    }
+
+
+# ==============================================================================
+# 5. 転送用フォーマット変換（ダウンサンプリング / モノラル化 / 16bit化）
+# ==============================================================================
+def resample(mono: np.ndarray, src_rate: int, dst_rate: int, taps: int = 63) -> np.ndarray:
+    """
+    float モノラル信号を dst_rate に変換する。
+    ダウンサンプリング時は窓付きsinc FIR でローパスしてから線形補間する（エイリアシング防止）。
+    """
+    if src_rate == dst_rate or len(mono) == 0:
+        return mono
+    if dst_rate < src_rate:
+        cutoff = 0.45 * dst_rate / src_rate  # [cycles/sample] ナイキストより少し手前で落とす
+        n = np.arange(taps) - (taps - 1) / 2.0
+        h = 2.0 * cutoff * np.sinc(2.0 * cutoff * n) * np.hamming(taps)
+        mono = np.convolve(mono, h / h.sum(), mode="same")
+    n_out = int(round(len(mono) * dst_rate / src_rate))
+    t = np.arange(n_out) * (src_rate / dst_rate)
+    return np.interp(t, np.arange(len(mono)), mono)
+
+
+def from_float_mono(mono: np.ndarray, sampwidth: int = 2) -> np.ndarray:
+    """-1〜+1 の float モノラルを整数PCM (frames x 1) に戻す。"""
+    scale = float(2 ** (8 * sampwidth - 1))
+    if sampwidth == 1:
+        x = np.clip(np.round(mono * 128.0 + 128.0), 0, 255)
+    else:
+        x = np.clip(np.round(mono * scale), -scale, scale - 1)
+    return x.astype(_DTYPES[sampwidth]).reshape(-1, 1)
+
+
+def transcode_wav_file(src_path: str, dst_path: str, rate: int = TRANSFER_RATE, sampwidth: int = 2) -> int:
+    """
+    src_path を「rate Hz / モノラル / sampwidth byte」の WAV に変換して dst_path に保存する。
+    返り値: 変換後ファイルのバイト数
+    """
+    samples, params = read_wav(src_path)
+    mono = to_float_mono(samples, params["sampwidth"])
+    out = from_float_mono(resample(mono, params["framerate"], rate), sampwidth)
+    out_params = dict(nchannels=1, sampwidth=sampwidth, framerate=rate,
+                      comptype="NONE", compname="not compressed")
+    write_wav(dst_path, out, out_params)
+    return os.path.getsize(dst_path)
+
+
+def needs_transcode(path: str, rate: int = TRANSFER_RATE, sampwidth: int = 2) -> bool:
+    """既に転送用フォーマット以下（rate以下・モノラル・sampwidth以下）なら False。"""
+    with wave.open(path, "rb") as wf:
+        return not (wf.getframerate() <= rate and wf.getnchannels() == 1 and wf.getsampwidth() <= sampwidth)
+
+
+# ==============================================================================
+# 6. 話速変換（WSOLA: ピッチを保ったままタイムストレッチ）
+# ==============================================================================
+def wsola_positions(mono: np.ndarray, framerate: int, tempo: float,
+                    win: int, tol: int, analysis_rate: int = 8000) -> np.ndarray:
+    """
+    WSOLA の各出力フレームに対応する入力位置を求める。
+    mono は末尾に win+tol 以上のゼロ詰めがされている前提。
+    相関計算は analysis_rate 程度に間引いた信号で行う（探索を軽くするため）。
+    """
+    hop = win // 2
+    n_out = int(len(mono) / tempo)
+    n_frames = n_out // hop + 1
+    step = max(1, framerate // analysis_rate)
+    limit = len(mono) - win
+
+    positions = np.empty(n_frames, dtype=np.int64)
+    prev = 0
+    for k in range(n_frames):
+        nominal = min(limit, int(round(k * hop * tempo)))
+        if k == 0:
+            pos = nominal
+        else:
+            # 直前フレームの「自然な続き」に最も似た位置を nominal±tol から探す
+            natural = min(limit, prev + hop)
+            template = mono[natural: natural + win: step]
+            lo = max(0, nominal - tol)
+            hi = min(limit, nominal + tol)
+            region = mono[lo: hi + win: step]
+            corr = np.correlate(region, template, mode="valid")
+            pos = lo + int(np.argmax(corr)) * step if corr.size else nominal
+        positions[k] = pos
+        prev = pos
+    return positions
+
+
+def time_stretch(samples: np.ndarray, params: dict, tempo: float,
+                 win_ms: float = 40.0, tol_ms: float = 10.0) -> np.ndarray:
+    """
+    tempo 倍速にタイムストレッチする（tempo>1 で短く、<1 で長く）。ピッチは変わらない。
+    samples: read_wav と同じ (frames x channels) の整数PCM
+    """
+    if abs(tempo - 1.0) < 1e-6 or len(samples) == 0:
+        return samples
+
+    fr = params["framerate"]
+    win = max(2, int(fr * win_ms / 1000.0)) // 2 * 2
+    hop = win // 2
+    tol = int(fr * tol_ms / 1000.0)
+
+    x = samples.astype(np.float64)
+    x = np.concatenate([x, np.zeros((win + tol + hop, x.shape[1]))])
+    mono = x.mean(axis=1)
+
+    positions = wsola_positions(mono, fr, tempo, win, tol)
+
+    # 50%オーバーラップの Hann 窓で重ね合わせ（前半/後半に分けてベクトル化）
+    window = np.hanning(win)[:, None]
+    idx = positions[:, None] + np.arange(win)[None, :]
+    frames = x[idx] * window[None, :, :]                     # (n_frames, win, ch)
+    n_frames = len(positions)
+    blocks = np.zeros((n_frames + 1, hop, x.shape[1]))
+    norm = np.zeros((n_frames + 1, hop, 1))
+    blocks[:-1] += frames[:, :hop]
+    blocks[1:] += frames[:, hop:]
+    norm[:-1] += window[:hop]
+    norm[1:] += window[hop:]
+    out = (blocks / np.maximum(norm, 1e-3)).reshape(-1, x.shape[1])
+
+    n_out = int(round(len(samples) / tempo))
+    out = out[:n_out]
+    if params["sampwidth"] == 1:
+        return np.clip(np.round(out), 0, 255).astype(np.uint8)
+    lim = float(2 ** (8 * params["sampwidth"] - 1))
+    return np.clip(np.round(out), -lim, lim - 1).astype(_DTYPES[params["sampwidth"]])
+
+
+def stretch_wav_file(src_path: str, dst_path: str, speed: int, base_speed: int = BASE_SPEED) -> int:
+    """
+    base_speed で合成された src_path を speed 相当の長さに変換して dst_path に保存する。
+    返り値: 変換後の再生時間 [ms]
+    """
+    samples, params = read_wav(src_path)
+    out = time_stretch(samples, params, tempo=float(speed) / float(base_speed))
+    write_wav(dst_path, out, params)
+    return duration_ms(out, params["framerate"])
+
+
+if __name__ == "__main__":
+    # 使い方: python audio_post.py <cache_dir> [book_id]
+    # 既存キャッシュを再合成せずにトリミングする
+    from robottools3 import RobotTools
+
+    if len(sys.argv) < 2:
+        print("使い方: python audio_post.py <cache_dir> [book_id]")
+        sys.exit(1)
+    rt = RobotTools('0.0.0.0', 0)
+    rt.postprocess_cached_speech(cache_dir=sys.argv[1], book_id=sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,252 @@
+# audio_protocol.py: AudioAckServer プロトコル（PLAY / PUT / PLAYKEY / PLAYSEQ / BATCH / BUNDLE / HAS / LIST / DEL）のエンコード・送受信
+#
+# - 送信: コマンド行・長さヘッダ・wav 本体を1つのバッファ列にまとめ、sendmsg（scatter-gather）で送る
+#         → コマンドごとの sendall 呼び出し（数回〜数百回）が1〜数回のシステムコールになる
+# - 受信: recv(1) を繰り返さず、まとめて受け取ったバッファから行を切り出す
+# - キャッシュ済み wav は FileBody として渡すと、読み込まずに socket.sendfile でカーネルから直接送る
+import hashlib
+import os
+import socket
+import struct
+import typing
+
+Buffer = typing.Union[bytes, bytearray, memoryview]
+
+# Sota 側の再生待ち（AudioAckServer.playBytes）: max(MIN_WAIT_MS, duration_ms + SAFETY_MS) だけ待ってから次へ進む
+MIN_WAIT_MS = 300   # durationMs が 0 でも即 ACK しない保険
+SAFETY_MS = 0       # AudioAckServer.SAFETY_MS と同じ値にすること
+
+# file_sha256 の結果（(path, size, mtime_ns) が変わらない限り再計算しない）
+_digest_cache: typing.Dict[typing.Tuple[str, int, int], str] = {}
+
+
+def play_wait_ms(duration_ms: int, min_wait_ms: int = MIN_WAIT_MS, safety_ms: int = SAFETY_MS) -> int:
+    """duration_ms の wav を1つ再生したときに Sota が実際に待つ時間 [ms]。"""
+    return max(min_wait_ms, int(duration_ms) + safety_ms)
+
+
+def file_sha256(path: str) -> str:
+    """ファイル内容の SHA-256（16進）。Sota 上の保存内容と照合するのに使う。"""
+    st = os.stat(path)
+    cache_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _digest_cache.get(cache_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        digest = _digest_cache[cache_key] = h.hexdigest()
+    return digest
+
+
+class FileBody(object):
+    """送信する wav ファイル。中身はメモリに読み込まず、長さはファイルサイズから取る。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def sha256(self) -> str:
+        return file_sha256(self.path)
+
+    def __repr__(self) -> str:
+        return f"FileBody({self.path!r}, {self.size} bytes)"
+
+
+Body = typing.Union[Buffer, FileBody]
+
+_INT_PAIR = struct.Struct(">iI")   # duration_ms（符号付き）, size
+_INT = struct.Struct(">i")
+_UINT = struct.Struct(">I")
+
+# 1回の sendmsg に渡すバッファ数の上限（IOV_MAX は通常 1024）
+_MAX_IOV = 512
+MAX_LINE = 256
+MAX_BUNDLE_ITEMS = 1000   # BUNDLE 1回あたりの最大件数（AudioAckServer 側と一致させる）
+MAX_SEQ_ITEMS = 200       # PLAYSEQ 1回あたりの最大件数
+
+# PLAYSEQ の途中経過（最終応答ではない行）
+EVENT_STATUSES = ("STARTED", "FINISHED")
+
+
+# ==============================================================================
+# 1. エンコード（送信するバッファ列を作る）
+# ==============================================================================
+def _command_line(cmd: str, req_id: typing.Optional[str], *args: str) -> bytes:
+    """`CMD [id] args...\n`。req_id は SESSION モードのときだけ付ける。"""
+    words = [cmd] + ([req_id] if req_id is not None else []) + list(args)
+    return (" ".join(words) + "\n").encode("utf-8")
+
+
+def encode_play(data: Body, duration_ms: int, req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """PLAY: 行 + duration_ms + size + wav"""
+    return [_command_line("PLAY", req_id) + _INT_PAIR.pack(int(duration_ms), len(data)), data]
+
+
+def encode_put(key: str, data: Body, duration_ms: int, req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """PUT <key>: 行 + duration_ms + size + wav"""
+    return [_command_line("PUT", req_id, key) + _INT_PAIR.pack(int(duration_ms), len(data)), data]
+
+
+def encode_playkey(key: str, duration_ms: int, req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """PLAYKEY <key>: 行 + duration_ms"""
+    return [_command_line("PLAYKEY", req_id, key) + _INT.pack(int(duration_ms))]
+
+
+def encode_batch(items: typing.Sequence[typing.Tuple[int, Body]],
+                 req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """BATCH: 行 + count + (duration_ms + size + wav) * count"""
+    parts: typing.List[Body] = [_command_line("BATCH", req_id) + _UINT.pack(len(items))]
+    for duration_ms, data in items:
+        parts.append(_INT_PAIR.pack(int(duration_ms), len(data)))
+        parts.append(data)
+    return parts
+
+
+def encode_bundle(items: typing.Sequence[typing.Tuple[str, int, Body]],
+                  req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """BUNDLE: 行 + count + (`<key>\n` + duration_ms + size + wav) * count。サーバは受信しながら順に保存する。"""
+    parts: typing.List[Body] = [_command_line("BUNDLE", req_id) + _UINT.pack(len(items))]
+    for key, duration_ms, data in items:
+        parts.append((key + "\n").encode("utf-8") + _INT_PAIR.pack(int(duration_ms), len(data)))
+        parts.append(data)
+    return parts
+
+
+def encode_playseq(items: typing.Sequence[typing.Tuple[str, int]],
+                   req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """
+    PLAYSEQ: 行 + count + (`<key>\n` + duration_ms) * count
+    server -> 項目ごとに `STARTED [id] <index> <robot_ms>` と `FINISHED [id] <index> <robot_ms>`、最後に `ACK [id]`
+              （未保存のキーがあれば `NOFILE [id] <index>`、再生に失敗すれば `ERR [id] <index>` で中断）
+    """
+    parts = [_command_line("PLAYSEQ", req_id) + _UINT.pack(len(items))]
+    for key, duration_ms in items:
+        parts.append((key + "\n").encode("utf-8") + _INT.pack(int(duration_ms)))
+    return [b"".join(parts)]
+
+
+def parse_event(words: typing.Sequence[str]) -> typing.Tuple[int, int]:
+    """STARTED / FINISHED 行の残り（`<index> <robot_ms>`）を (index, robot_ms) にする。"""
+    return int(words[0]), int(words[1])
+
+
+def encode_has(key: str, sha256: typing.Optional[str] = None, req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """HAS <key> [sha256]: 保存済みで内容が一致すれば YES、なければ NO"""
+    return [_command_line("HAS", req_id, key, *([sha256] if sha256 else []))]
+
+
+def encode_del(key: str, req_id: typing.Optional[str] = None) -> typing.List[Body]:
+    """DEL <key>: 削除できれば OK、なければ NOFILE"""
+    return [_command_line("DEL", req_id, key)]
+
+
+def encode_line(cmd: str, req_id: typing.Optional[str] = None, *args: str) -> typing.List[Body]:
+    """本体を持たないコマンド（PING / BYE / SESSION など）"""
+    return [_command_line(cmd, req_id, *args)]
+
+
+# ==============================================================================
+# 2. 送信（scatter-gather）
+# ==============================================================================
+def send_frames(sock: socket.socket, parts: typing.Sequence[Body]) -> int:
+    """
+    バッファ列をコピーせずにまとめて送る。FileBody は socket.sendfile で送る。
+    連続するバッファは1回の sendmsg にまとめる。
+    返り値: 送信バイト数
+    """
+    total = 0
+    bufs: typing.List[Buffer] = []
+    for part in parts:
+        if isinstance(part, FileBody):
+            total += _send_buffers(sock, bufs)
+            bufs = []
+            total += _send_file(sock, part)
+        elif len(part):
+            bufs.append(part)
+    return total + _send_buffers(sock, bufs)
+
+
+def _send_file(sock: socket.socket, body: FileBody) -> int:
+    with open(body.path, "rb") as f:
+        sent = sock.sendfile(f, 0, body.size)
+    # 送信中にファイルが短くなった場合はフレームが壊れるので中断する
+    if sent != body.size:
+        raise RuntimeError(f"file changed while sending: {body.path} ({sent}/{body.size} bytes)")
+    return sent
+
+
+def _send_buffers(sock: socket.socket, parts: typing.List[Buffer]) -> int:
+    """部分送信に対応した sendmsg。sendmsg が使えない環境（Windows など）では各バッファを sendall する。"""
+    bufs = [memoryview(p).cast("B") for p in parts]
+    total = sum(len(b) for b in bufs)
+    if not hasattr(sock, "sendmsg"):
+        for b in bufs:
+            sock.sendall(b)
+        return total
+
+    i = 0
+    while i < len(bufs):
+        sent = sock.sendmsg(bufs[i:i + _MAX_IOV])
+        # 送り切ったバッファを進め、途中まで送れたバッファは残りだけにする
+        while sent > 0:
+            if sent >= len(bufs[i]):
+                sent -= len(bufs[i])
+                i += 1
+            else:
+                bufs[i] = bufs[i][sent:]
+                sent = 0
+    return total
+
+
+# ==============================================================================
+# 3. 受信（バッファ付き行読み取り）
+# ==============================================================================
+class FrameReader(object):
+    """ソケットからまとめて受信し、行単位・バイト数単位で切り出す。"""
+
+    def __init__(self, sock: socket.socket, bufsize: int = 4096):
+        self._sock = sock
+        self._bufsize = bufsize
+        self._buf = bytearray()
+
+    def _fill(self) -> None:
+        chunk = self._sock.recv(self._bufsize)
+        if not chunk:
+            raise ConnectionError("connection closed by peer")
+        self._buf += chunk
+
+    def readline(self, max_len: int = MAX_LINE) -> bytes:
+        """`\n` までの1行を返す（`\n` と `\r` は除く）。"""
+        start = 0
+        while True:
+            pos = self._buf.find(b"\n", start)
+            if pos >= 0:
+                line = bytes(self._buf[:pos])
+                del self._buf[:pos + 1]
+                return line.rstrip(b"\r")
+            if len(self._buf) > max_len:
+                raise RuntimeError(f"response line too long: {bytes(self._buf[:32])!r}...")
+            start = len(self._buf)
+            self._fill()
+
+    def read_exact(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            self._fill()
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+
+def expect_line(reader: FrameReader, expected: bytes, closed_msg: str) -> bytes:
+    """応答行を1行読み、expected でなければ RuntimeError。"""
+    try:
+        line = reader.readline()
+    except ConnectionError:
+        raise RuntimeError(closed_msg)
+    if line.strip() != expected:
+        raise RuntimeError(f"unexpected response: {line!r}")
+    return line
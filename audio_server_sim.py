@@ -0,0 +1,572 @@
+# audio_server_sim.py: AudioAckServer.java の Python (asyncio) 版スタンドイン
+#
+# Sota（jp.vstone.RobotLib）なしで RobotTools の音声経路（PLAY / PUT / PLAYKEY / PLAYSEQ / BATCH / BUNDLE / HAS / LIST / DEL / SESSION）を
+# 動かし、転送方式やスケジューリングの変更を手元の Linux で計測するためのサーバ。
+# - プロトコル・バリデーション・キー→パス変換（safeKeyToPath）は AudioAckServer.java と同じ
+# - 再生は行わず、duration_ms（最低 300ms）だけ待つ。待ち時間は SimClock で縮められる
+# - 帯域（bytes/s）と片道遅延を指定して、Wi-Fi 越しの転送を模擬できる
+#
+# 使い方:
+#   python audio_server_sim.py --port 30001 --bandwidth-mbps 20 --latency-ms 5
+#   python audio_server_sim.py --port 30001 --time-scale 0.01   # 再生待ちを 1/100 に縮める
+import argparse
+import asyncio
+import hashlib
+import heapq
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import typing
+
+from audio_protocol import MIN_WAIT_MS, SAFETY_MS, play_wait_ms
+
+PORT = 30001
+MAX_LINE = 256
+SESSION_IDLE_TIMEOUT_SEC = 30.0
+MAX_BUNDLE_ITEMS = 1000
+MAX_SEQ_ITEMS = 200
+DEFAULT_CACHE_DIR = "/dev/shm/tts_cache"
+
+_INT = struct.Struct(">i")
+_READ_CHUNK = 64 * 1024
+
+
+def safe_key_to_path(cache_dir: str, key: str) -> str:
+    """パス注入防止：英数と _ - . 以外は _ に置き換える（AudioAckServer.safeKeyToPath と同じ）。"""
+    safe = re.sub(r"[^A-Za-z0-9_\-.]", "_", key)
+    return os.path.join(cache_dir, safe + ".wav")
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def valid_sizes(duration_ms: int, n: int) -> bool:
+    return not (n <= 0 or n > 50_000_000 or duration_ms < 0 or duration_ms > 600_000)
+
+
+class SimClock(object):
+    """
+    再生待ちに使う時計。
+    scale=1.0: 実時間どおりに待つ
+    0<scale<1: 実際には duration * scale だけ待ち、now() は仮想時刻（実経過 / scale）を返す
+    scale=0  : 実際には待たない。待ちごとに締め切り（仮想時刻）を持ち、イベントループが1周するたびに
+               最も早い締め切りまで仮想時刻を進めてその待ちを起こす（同時に待てば待ち時間は重なる）
+    """
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+        self._t0 = time.monotonic()
+        self._virtual = 0.0
+        self._waiters: typing.List[typing.Tuple[float, int, asyncio.Future]] = []   # (締め切り, 順番, future)
+        self._seq = 0
+        self._advancing = False
+
+    def now(self) -> float:
+        if self.scale <= 0:
+            return self._virtual
+        return (time.monotonic() - self._t0) / self.scale
+
+    async def sleep(self, sec: float) -> None:
+        if sec <= 0:
+            return
+        if self.scale > 0:
+            await asyncio.sleep(sec * self.scale)
+            return
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (self._virtual + sec, self._seq, fut))
+        if not self._advancing:
+            self._advancing = True
+            loop.call_soon(self._advance, loop)
+        await fut
+
+    def _advance(self, loop: asyncio.AbstractEventLoop) -> None:
+        """最も早い締め切りまで仮想時刻を進め、その締め切りの待ちをすべて起こす（キャンセル済みは捨てる）。"""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if not self._waiters:
+            self._advancing = False
+            return
+        deadline = self._waiters[0][0]
+        self._virtual = max(self._virtual, deadline)
+        while self._waiters and self._waiters[0][0] <= deadline:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+        # 起こした側が次の待ちを登録できるよう、次の前進は1周後に行う
+        loop.call_soon(self._advance, loop)
+
+
+class AudioAckServerSim(object):
+    """AudioAckServer の asyncio 実装。events に (仮想時刻, 種類, 内容) を記録する。"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = PORT, cache_dir: typing.Optional[str] = None,
+                 clock: typing.Optional[SimClock] = None, bandwidth_bps: typing.Optional[float] = None,
+                 latency_ms: float = 0.0, safety_ms: int = SAFETY_MS, min_wait_ms: int = MIN_WAIT_MS):
+        """
+        bandwidth_bps: 受信帯域 [bytes/s]（None で無制限）
+        latency_ms: 応答を返すまでの片道遅延 [ms]
+        cache_dir: PUT の保存先（省略時は /dev/shm/tts_cache、/dev/shm がなければ一時ディレクトリ）
+        """
+        self.host = host
+        self.port = port
+        if cache_dir is None:
+            cache_dir = DEFAULT_CACHE_DIR if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "tts_cache")
+        self.cache_dir = cache_dir
+        self.clock = clock if clock is not None else SimClock()
+        self.bandwidth_bps = bandwidth_bps
+        self.latency_ms = latency_ms
+        self.safety_ms = safety_ms
+        self.min_wait_ms = min_wait_ms
+        self.events: typing.List[typing.Tuple[float, str, str]] = []
+
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+        self._clients: typing.Set[asyncio.Task] = set()
+        self._play_lock: typing.Optional[asyncio.Lock] = None
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._thread: typing.Optional[threading.Thread] = None
+
+    # --- 起動・停止 ---
+    async def start(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._play_lock = asyncio.Lock()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        # port=0 のときは OS が割り当てたポートを使う
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"AudioAckServerSim listening on {self.host}:{self.port} (cache={self.cache_dir})")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # 接続中のクライアントを切る（受け付け済みの再生は待たない）
+        for task in list(self._clients):
+            task.cancel()
+        if self._clients:
+            await asyncio.gather(*self._clients, return_exceptions=True)
+
+    def start_in_thread(self) -> "AudioAckServerSim":
+        """専用スレッドでイベントループを回す（同期コードの RobotTools から使う場合）。"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="audio-server-sim", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    # --- 入出力 ---
+    def _log(self, kind: str, detail: str = "") -> None:
+        self.events.append((self.clock.now(), kind, detail))
+
+    @staticmethod
+    async def _read_line_ascii(reader: asyncio.StreamReader, max_len: int = MAX_LINE) -> typing.Optional[str]:
+        """\\n まで（最大 max_len バイト）を1行として読む。空行・EOF は None（Java 版と同じ）。"""
+        buf = bytearray()
+        for _ in range(max_len):
+            b = await reader.read(1)
+            if not b or b == b"\n":
+                break
+            if b != b"\r":
+                buf += b
+        if not buf:
+            return None
+        return buf.decode("utf-8", "replace")
+
+    @staticmethod
+    async def _read_int(reader: asyncio.StreamReader) -> int:
+        return _INT.unpack(await reader.readexactly(4))[0]
+
+    async def _read_payload(self, reader: asyncio.StreamReader, n: int) -> bytes:
+        """n バイト読む。帯域指定があれば受信ペースを落とす（送信側にも TCP の背圧がかかる）。"""
+        if not self.bandwidth_bps:
+            return await reader.readexactly(n)
+        chunks = []
+        remaining = n
+        while remaining > 0:
+            chunk = await reader.readexactly(min(_READ_CHUNK, remaining))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            await self.clock.sleep(len(chunk) / self.bandwidth_bps)
+        return b"".join(chunks)
+
+    async def _write_line(self, writer: asyncio.StreamWriter, line: str) -> None:
+        if self.latency_ms > 0:
+            await self.clock.sleep(self.latency_ms / 1000.0)
+        writer.write((line + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def _play(self, wav: bytes, duration_ms: int, label: str) -> None:
+        """再生の代わりに duration_ms（最低 min_wait_ms）だけ待つ。呼び出し側で _play_lock を持つこと。"""
+        self._log("play_start", f"{label} {len(wav)}B {duration_ms}ms")
+        wait_ms = play_wait_ms(duration_ms, self.min_wait_ms, self.safety_ms)
+        await self.clock.sleep(wait_ms / 1000.0)
+        self._log("play_end", label)
+
+    def _store(self, key: str, wav: bytes) -> None:
+        with open(safe_key_to_path(self.cache_dir, key), "wb") as f:
+            f.write(wav)
+        self._log("put", f"{key} {len(wav)}B")
+
+    async def _receive_bundle(self, reader: asyncio.StreamReader) -> bool:
+        """BUNDLE の本体を受信しながら1件ずつ保存する。サイズ不正なら False（ストリームは継続できない）。"""
+        count = await self._read_int(reader)
+        if count <= 0 or count > MAX_BUNDLE_ITEMS:
+            return False
+        for _ in range(count):
+            key = await self._read_line_ascii(reader)
+            duration_ms = await self._read_int(reader)
+            n = await self._read_int(reader)
+            if key is None or not valid_sizes(duration_ms, n):
+                return False
+            self._store(key.strip(), await self._read_payload(reader, n))
+        return True
+
+    async def _read_seq(self, reader: asyncio.StreamReader) -> typing.Optional[typing.List[typing.Tuple[str, int]]]:
+        """PLAYSEQ の (key, duration_ms) 列を読む。件数・長さが不正なら None。"""
+        count = await self._read_int(reader)
+        if count <= 0 or count > MAX_SEQ_ITEMS:
+            return None
+        items = []
+        for _ in range(count):
+            key = await self._read_line_ascii(reader)
+            duration_ms = await self._read_int(reader)
+            if key is None or duration_ms < 0 or duration_ms > 600_000:
+                return None
+            items.append((key.strip(), duration_ms))
+        return items
+
+    async def _play_seq(self, writer: asyncio.StreamWriter, items: typing.List[typing.Tuple[str, int]],
+                        id_part: str = "") -> None:
+        """保存済み wav を順に再生し、STARTED / FINISHED（仮想時刻 ms）を通知する。最後に ACK（失敗時は ERR <index>）。"""
+        async with self._play_lock:
+            for i, (key, duration_ms) in enumerate(items):
+                path = safe_key_to_path(self.cache_dir, key)
+                if not os.path.exists(path):
+                    await self._write_line(writer, f"NOFILE{id_part} {i}")
+                    return
+                try:
+                    with open(path, "rb") as f:
+                        wav = f.read()
+                    await self._write_line(writer, f"STARTED{id_part} {i} {int(self.clock.now() * 1000)}")
+                    await self._play(wav, duration_ms, key)
+                except OSError as e:
+                    print(f"AudioAckServerSim: playback error: {e}")
+                    await self._write_line(writer, f"ERR{id_part} {i}")
+                    return
+                await self._write_line(writer, f"FINISHED{id_part} {i} {int(self.clock.now() * 1000)}")
+        await self._write_line(writer, f"ACK{id_part}")
+
+    def _has_key(self, key: str, sha256: typing.Optional[str]) -> bool:
+        path = safe_key_to_path(self.cache_dir, key)
+        if not os.path.exists(path):
+            return False
+        return sha256 is None or sha256.lower() == file_sha256(path)
+
+    def _delete_key(self, key: str) -> bool:
+        path = safe_key_to_path(self.cache_dir, key)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        self._log("del", key)
+        return True
+
+    # --- 1コマンド1接続 ---
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            line = await self._read_line_ascii(reader)
+            if line is None:
+                return
+            parts = line.strip().split()
+            cmd = parts[0]
+
+            if cmd == "SESSION":
+                await self._handle_session(reader, writer)
+                return
+
+            if cmd == "PUT":
+                if len(parts) < 2:
+                    await self._write_line(writer, "ERR")
+                    return
+                duration_ms = await self._read_int(reader)
+                n = await self._read_int(reader)
+                if not valid_sizes(duration_ms, n):
+                    await self._write_line(writer, "ERR")
+                    return
+                self._store(parts[1], await self._read_payload(reader, n))
+                await self._write_line(writer, "OK")
+                return
+
+            if cmd == "BUNDLE":
+                await self._write_line(writer, "OK" if await self._receive_bundle(reader) else "ERR")
+                return
+
+            if cmd == "HAS":
+                ok = len(parts) >= 2 and self._has_key(parts[1], parts[2] if len(parts) >= 3 else None)
+                await self._write_line(writer, "YES" if ok else "NO")
+                return
+
+            if cmd == "DEL":
+                if len(parts) < 2:
+                    await self._write_line(writer, "ERR")
+                else:
+                    await self._write_line(writer, "OK" if self._delete_key(parts[1]) else "NOFILE")
+                return
+
+            if cmd == "LIST":
+                lines = []
+                for name in sorted(os.listdir(self.cache_dir)):
+                    if name.endswith(".wav"):
+                        path = os.path.join(self.cache_dir, name)
+                        lines.append(f"{name[:-len('.wav')]} {os.path.getsize(path)} {file_sha256(path)}")
+                await self._write_line(writer, "\n".join([str(len(lines))] + lines))
+                return
+
+            if cmd == "PLAYSEQ":
+                items = await self._read_seq(reader)
+                if items is None:
+                    await self._write_line(writer, "ERR")
+                    return
+                await self._play_seq(writer, items)
+                return
+
+            if cmd == "PLAYKEY":
+                if len(parts) < 2:
+                    await self._write_line(writer, "ERR")
+                    return
+                duration_ms = await self._read_int(reader)
+                path = safe_key_to_path(self.cache_dir, parts[1])
+                if not os.path.exists(path):
+                    await self._write_line(writer, "NOFILE")
+                    return
+                with open(path, "rb") as f:
+                    wav = f.read()
+                async with self._play_lock:
+                    await self._play(wav, duration_ms, parts[1])
+                await self._write_line(writer, "ACK")
+                return
+
+            if cmd == "PLAY":
+                duration_ms = await self._read_int(reader)
+                n = await self._read_int(reader)
+                if not valid_sizes(duration_ms, n):
+                    await self._write_line(writer, "ERR")
+                    return
+                wav = await self._read_payload(reader, n)
+                async with self._play_lock:
+                    await self._play(wav, duration_ms, "PLAY")
+                await self._write_line(writer, "ACK")
+                return
+
+            if cmd == "BATCH":
+                count = await self._read_int(reader)
+                if count <= 0 or count > 200:
+                    await self._write_line(writer, "ERR")
+                    return
+                # Java 版と同じく、1件読むごとに再生する（再生中は次の wav を受信しない）
+                async with self._play_lock:
+                    for i in range(count):
+                        duration_ms = await self._read_int(reader)
+                        n = await self._read_int(reader)
+                        if not valid_sizes(duration_ms, n):
+                            await self._write_line(writer, "ERR")
+                            return
+                        wav = await self._read_payload(reader, n)
+                        await self._play(wav, duration_ms, f"BATCH[{i}]")
+                await self._write_line(writer, "ACK")
+                return
+
+            await self._write_line(writer, "ERR")
+
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"AudioAckServerSim: connection error: {e}")
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    # --- SESSION（常時接続） ---
+    async def _handle_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def player() -> None:
+            # 受け付けた再生を順番に行う（その間も PUT / PING の読み取りは続く）。失敗したら ERR <id> を返す
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                req_id, job = entry
+                try:
+                    await job()
+                except Exception as e:
+                    print(f"AudioAckServerSim: playback error: {e}")
+                    try:
+                        await self._write_line(writer, f"ERR {req_id}")
+                    except ConnectionError:
+                        pass
+
+        player_task = asyncio.ensure_future(player())
+        await self._write_line(writer, "SESSION OK")
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(self._read_line_ascii(reader), SESSION_IDLE_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    print("session idle timeout, closing")
+                    break
+                if line is None:
+                    break
+                parts = line.strip().split()
+                cmd = parts[0]
+                if cmd == "BYE":
+                    break
+                if len(parts) < 2:
+                    await self._write_line(writer, "ERR")
+                    continue
+                req_id = parts[1]
+                if cmd in ("PUT", "PLAYKEY") and len(parts) < 3:
+                    await self._write_line(writer, f"ERR {req_id}")
+                    break   # キーがないとペイロードを読まずに次のコマンドへ進めない
+
+                if cmd == "PING":
+                    await self._write_line(writer, f"PONG {req_id}")
+
+                elif cmd == "PUT" and len(parts) >= 3:
+                    duration_ms = await self._read_int(reader)
+                    n = await self._read_int(reader)
+                    if not valid_sizes(duration_ms, n):
+                        await self._write_line(writer, f"ERR {req_id}")
+                        break   # ペイロード長が信用できないのでストリームを継続できない
+                    self._store(parts[2], await self._read_payload(reader, n))
+                    await self._write_line(writer, f"OK {req_id}")
+
+                elif cmd == "BUNDLE":
+                    if not await self._receive_bundle(reader):
+                        await self._write_line(writer, f"ERR {req_id}")
+                        break
+                    await self._write_line(writer, f"OK {req_id}")
+
+                elif cmd == "HAS" and len(parts) >= 3:
+                    ok = self._has_key(parts[2], parts[3] if len(parts) >= 4 else None)
+                    await self._write_line(writer, f"{'YES' if ok else 'NO'} {req_id}")
+
+                elif cmd == "DEL" and len(parts) >= 3:
+                    await self._write_line(writer, f"{'OK' if self._delete_key(parts[2]) else 'NOFILE'} {req_id}")
+
+                elif cmd == "PLAYKEY" and len(parts) >= 3:
+                    duration_ms = await self._read_int(reader)
+                    queue.put_nowait((req_id, self._session_playkey(writer, req_id, parts[2], duration_ms)))
+
+                elif cmd == "PLAYSEQ":
+                    items = await self._read_seq(reader)
+                    if items is None:
+                        await self._write_line(writer, f"ERR {req_id}")
+                        break
+                    queue.put_nowait((req_id, lambda items=items, req_id=req_id: self._play_seq(writer, items, f" {req_id}")))
+
+                elif cmd == "PLAY":
+                    duration_ms = await self._read_int(reader)
+                    n = await self._read_int(reader)
+                    if not valid_sizes(duration_ms, n):
+                        await self._write_line(writer, f"ERR {req_id}")
+                        break
+                    wav = await self._read_payload(reader, n)
+                    queue.put_nowait((req_id, self._session_play(writer, req_id, [(duration_ms, wav)], "PLAY")))
+
+                elif cmd == "BATCH":
+                    count = await self._read_int(reader)
+                    if count <= 0 or count > 200:
+                        await self._write_line(writer, f"ERR {req_id}")
+                        break
+                    items = []
+                    for _ in range(count):
+                        duration_ms = await self._read_int(reader)
+                        n = await self._read_int(reader)
+                        if not valid_sizes(duration_ms, n):
+                            items = None
+                            break
+                        items.append((duration_ms, await self._read_payload(reader, n)))
+                    if items is None:
+                        await self._write_line(writer, f"ERR {req_id}")
+                        break
+                    queue.put_nowait((req_id, self._session_play(writer, req_id, items, "BATCH")))
+
+                else:
+                    await self._write_line(writer, f"ERR {req_id}")
+        finally:
+            # 受け付け済みの再生は最後まで行ってから切断する
+            queue.put_nowait(None)
+            try:
+                await player_task
+            except asyncio.CancelledError:
+                player_task.cancel()
+                raise
+
+    def _session_playkey(self, writer: asyncio.StreamWriter, req_id: str, key: str,
+                         duration_ms: int) -> typing.Callable[[], typing.Awaitable[None]]:
+        async def job() -> None:
+            path = safe_key_to_path(self.cache_dir, key)
+            if not os.path.exists(path):
+                await self._write_line(writer, f"NOFILE {req_id}")
+                return
+            with open(path, "rb") as f:
+                wav = f.read()
+            async with self._play_lock:
+                await self._play(wav, duration_ms, key)
+            await self._write_line(writer, f"ACK {req_id}")
+        return job
+
+    def _session_play(self, writer: asyncio.StreamWriter, req_id: str,
+                      items: typing.List[typing.Tuple[int, bytes]], label: str) -> typing.Callable[[], typing.Awaitable[None]]:
+        async def job() -> None:
+            async with self._play_lock:
+                for i, (duration_ms, wav) in enumerate(items):
+                    await self._play(wav, duration_ms, f"{label}[{i}]")
+            await self._write_line(writer, f"ACK {req_id}")
+        return job
+
+
+async def _serve_forever(server: AudioAckServerSim) -> None:
+    await server.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AudioAckServer の Python スタンドイン（再生は待ち時間で模擬）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--cache-dir", default=None, help="PUT の保存先 (既定: /dev/shm/tts_cache)")
+    parser.add_argument("--bandwidth-mbps", type=float, default=None, help="受信帯域 [Mbit/s]（省略で無制限）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="応答の片道遅延 [ms]")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="待ち時間の倍率（0 で待たない）")
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth_mbps * 1e6 / 8 if args.bandwidth_mbps else None
+    sim = AudioAckServerSim(args.host, args.port, cache_dir=args.cache_dir, clock=SimClock(args.time_scale),
+                            bandwidth_bps=bandwidth, latency_ms=args.latency_ms)
+    try:
+        asyncio.run(_serve_forever(sim))
+    except KeyboardInterrupt:
+        pass
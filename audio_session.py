@@ -0,0 +1,204 @@
+# audio_session.py: AudioAckServer との常時接続セッション（リクエストID付きパイプライン + ハートビート）
+#
+# プロトコル（1接続で複数コマンド）:
+#   client -> `SESSION\n`                     server -> `SESSION OK\n`
+#   client -> `PUT <id> <key>\n` + 4byte duration_ms + 4byte size + wav    server -> `OK <id>\n`
+#   client -> `PLAYKEY <id> <key>\n` + 4byte duration_ms                   server -> `ACK <id>\n`（再生完了後）/ `NOFILE <id>\n`
+#   client -> `PLAY <id>\n` + 4byte duration_ms + 4byte size + wav         server -> `ACK <id>\n`（再生完了後）
+#   client -> `BATCH <id>\n` + 4byte count + (duration_ms, size, wav) * count  server -> `ACK <id>\n`（全て再生完了後）
+#   client -> `BUNDLE <id>\n` + 4byte count + (`<key>\n`, duration_ms, size, wav) * count  server -> `OK <id>\n`（全て保存後）
+#   client -> `PLAYSEQ <id>\n` + 4byte count + (`<key>\n`, duration_ms) * count
+#             server -> `STARTED <id> <index> <robot_ms>\n` / `FINISHED <id> <index> <robot_ms>\n`（項目ごと）、最後に `ACK <id>\n`
+#   client -> `HAS <id> <key> [sha256]\n`   server -> `YES <id>\n` / `NO <id>\n`
+#   client -> `DEL <id> <key>\n`            server -> `OK <id>\n` / `NOFILE <id>\n`
+#   （LIST は複数行の応答になるため SESSION では使わず、1コマンド1接続で送る）
+#   client -> `PING <id>\n`                   server -> `PONG <id>\n`
+#   client -> `BYE\n`                         （切断）
+# 再生はサーバ側の再生スレッドで順番に行われるため、再生中でも PUT/PING は即座に処理される。
+import concurrent.futures
+import itertools
+import socket
+import threading
+import time
+import typing
+
+import audio_protocol
+
+
+class AudioSession(object):
+    """AudioAckServer への長寿命接続。各コマンドは Future を返し、応答を待たずに次を送れる。"""
+
+    def __init__(self, ip: str, port: int, heartbeat_sec: float = 5.0, connect_timeout: float = 5.0):
+        self.ip = ip
+        self.port = port
+        self.heartbeat_sec = heartbeat_sec
+
+        self._sock = socket.create_connection((ip, port), timeout=connect_timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._frames = audio_protocol.FrameReader(self._sock)
+
+        self._send_lock = threading.Lock()
+        self._pending: typing.Dict[str, concurrent.futures.Future] = {}
+        self._event_handlers: typing.Dict[str, typing.Callable[[str, int, int], None]] = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = threading.Event()
+        self.last_rx = time.monotonic()
+
+        # ハンドシェイク
+        try:
+            audio_protocol.send_frames(self._sock, audio_protocol.encode_line("SESSION"))
+            audio_protocol.expect_line(self._frames, b"SESSION OK", "connection closed before SESSION OK")
+        except (RuntimeError, OSError) as e:
+            self._sock.close()
+            raise RuntimeError(f"session handshake failed: {e}")
+        self._sock.settimeout(None)
+
+        self._reader = threading.Thread(target=self._read_loop, name="audio-session-reader", daemon=True)
+        self._reader.start()
+        self._heartbeat = None
+        if heartbeat_sec and heartbeat_sec > 0:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="audio-session-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    # --- 状態 ---
+    @property
+    def alive(self) -> bool:
+        return not self._closed.is_set()
+
+    # --- コマンド ---
+    def put(self, key: str, data: audio_protocol.Body, duration_ms: int) -> concurrent.futures.Future:
+        """PUT: wav を Sota 上に保存する。結果は "OK"。"""
+        return self._request(lambda req_id: audio_protocol.encode_put(key, data, duration_ms, req_id))
+
+    def play_key(self, key: str, duration_ms: int) -> concurrent.futures.Future:
+        """PLAYKEY: 保存済み wav を再生する。結果は再生完了後の "ACK"（未保存なら "NOFILE"）。"""
+        return self._request(lambda req_id: audio_protocol.encode_playkey(key, duration_ms, req_id))
+
+    def play(self, data: audio_protocol.Body, duration_ms: int) -> concurrent.futures.Future:
+        """PLAY: wav を送ってその場で再生する。結果は再生完了後の "ACK"。"""
+        return self._request(lambda req_id: audio_protocol.encode_play(data, duration_ms, req_id))
+
+    def batch(self, items: typing.List[typing.Tuple[int, audio_protocol.Body]]) -> concurrent.futures.Future:
+        """BATCH: 複数 wav を連続再生する。結果は全再生完了後の "ACK"。"""
+        return self._request(lambda req_id: audio_protocol.encode_batch(items, req_id))
+
+    def bundle(self, items: typing.List[typing.Tuple[str, int, audio_protocol.Body]]) -> concurrent.futures.Future:
+        """BUNDLE: 複数 wav を1回の転送でキーごとに保存する。結果は全保存後の "OK"。"""
+        return self._request(lambda req_id: audio_protocol.encode_bundle(items, req_id))
+
+    def play_seq(self, items: typing.List[typing.Tuple[str, int]],
+                 on_event: typing.Optional[typing.Callable[[str, int, int], None]] = None) -> concurrent.futures.Future:
+        """
+        PLAYSEQ: 保存済み wav を順に再生する。項目ごとに on_event(status, index, robot_ms) を
+        読み取りスレッドから呼ぶ（status は "STARTED" / "FINISHED"）。結果は全再生完了後の "ACK"。
+        """
+        return self._request(lambda req_id: audio_protocol.encode_playseq(items, req_id), on_event)
+
+    def has(self, key: str, sha256: typing.Optional[str] = None) -> concurrent.futures.Future:
+        """HAS: 保存済み（sha256 を渡した場合は内容も一致）なら "YES"、そうでなければ "NO"。"""
+        return self._request(lambda req_id: audio_protocol.encode_has(key, sha256, req_id))
+
+    def delete(self, key: str) -> concurrent.futures.Future:
+        """DEL: 保存済み wav を削除する。結果は "OK"（なければ "NOFILE"）。"""
+        return self._request(lambda req_id: audio_protocol.encode_del(key, req_id))
+
+    def ping(self) -> concurrent.futures.Future:
+        return self._request(lambda req_id: audio_protocol.encode_line("PING", req_id))
+
+    def close(self) -> None:
+        """BYE を送って切断する。未完了のコマンドはエラーで終わる。"""
+        if self._closed.is_set():
+            return
+        try:
+            with self._send_lock:
+                audio_protocol.send_frames(self._sock, audio_protocol.encode_line("BYE"))
+        except OSError:
+            pass
+        self._fail(RuntimeError("audio session closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- 内部処理 ---
+    def _request(self, encode: typing.Callable[[str], typing.List[audio_protocol.Body]],
+                 on_event: typing.Optional[typing.Callable[[str, int, int], None]] = None) -> concurrent.futures.Future:
+        """encode(req_id) で作ったバッファ列を送り、応答用の Future（と途中経過のハンドラ）を登録する。"""
+        if self._closed.is_set():
+            raise RuntimeError("audio session is closed")
+        req_id = str(next(self._ids))
+        fut: concurrent.futures.Future = concurrent.futures.Future()
+        with self._pending_lock:
+            self._pending[req_id] = fut
+            if on_event is not None:
+                self._event_handlers[req_id] = on_event
+
+        parts = encode(req_id)
+        try:
+            with self._send_lock:
+                audio_protocol.send_frames(self._sock, parts)
+        except OSError as e:
+            self._fail(RuntimeError(f"audio session send failed: {e}"))
+        return fut
+
+    def _read_loop(self) -> None:
+        try:
+            while not self._closed.is_set():
+                try:
+                    line = self._frames.readline()
+                except ConnectionError:
+                    raise RuntimeError("audio session closed by server")
+                self.last_rx = time.monotonic()
+                parts = line.decode("utf-8", "replace").split()
+                if len(parts) < 2:
+                    continue
+                status, req_id = parts[0], parts[1]
+                if status in audio_protocol.EVENT_STATUSES:
+                    with self._pending_lock:
+                        handler = self._event_handlers.get(req_id)
+                    if handler is not None:
+                        try:
+                            handler(status, *audio_protocol.parse_event(parts[2:]))
+                        except Exception as e:
+                            print(f"⚠️ [SESSION] イベント処理でエラー: {e}")
+                    continue
+                with self._pending_lock:
+                    fut = self._pending.pop(req_id, None)
+                    self._event_handlers.pop(req_id, None)
+                if fut is None or fut.done():
+                    continue
+                if status == "ERR" and len(parts) >= 3:
+                    # PLAYSEQ の途中で再生に失敗した（`ERR <id> <index>`）。未対応の ERR とは区別する
+                    fut.set_exception(RuntimeError(f"playback failed at index {parts[2]}"))
+                else:
+                    fut.set_result(status)
+        except Exception as e:
+            self._fail(e if isinstance(e, RuntimeError) else RuntimeError(f"audio session read failed: {e}"))
+
+    def _heartbeat_loop(self) -> None:
+        while not self._closed.wait(self.heartbeat_sec):
+            try:
+                status = self.ping().result(timeout=self.heartbeat_sec * 2)
+                if status != "PONG":
+                    raise RuntimeError(f"unexpected heartbeat response: {status}")
+            except Exception as e:
+                print(f"⚠️ [SESSION] ハートビートに失敗したためセッションを閉じます: {e}")
+                self._fail(RuntimeError(f"audio session heartbeat failed: {e}"))
+                return
+
+    def _fail(self, exc: Exception) -> None:
+        self._closed.set()
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._event_handlers.clear()
+        for fut in pending:
+            if not fut.done():
+                fut.set_exception(exc)
+        try:
+            self._sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,129 @@
+# cache_gc.py: 音声キャッシュの整理（不要ファイル削除・破損チェック・容量上限での LRU 退避）
+#
+# 使い方:
+#   python cache_gc.py --books suhu inu --variants normal emo --conditions 1 2 --budget-mb 500 --dry-run
+#   python cache_gc.py --books suhu --variants normal --conditions 1 --budget-mb 300
+import argparse
+import os
+import typing
+
+from robottools3 import RobotTools
+from speech_cache import SpeechCacheManifest, validate_wav
+import synth_planner
+
+# 退避の優先度（小さいほど先に消す）: 作り直しのコストが低い順
+TIER_TRANSFER = 0   # _tx<rate>/ の転送用wav（変換し直すだけ）
+TIER_PAGE = 1       # ページ用wav（_base があればタイムストレッチで作り直せる）
+TIER_BASE = 2       # _base/ の speed=100 レンダリング（作り直すには VOICEPEAK が必要）
+
+
+def _tier(cache_dir: str, path: str) -> int:
+    sub = os.path.relpath(os.path.dirname(path), cache_dir)
+    if sub.startswith("_tx"):
+        return TIER_TRANSFER
+    if sub == "_base":
+        return TIER_BASE
+    return TIER_PAGE
+
+
+def scan_cache_dir(cache_dir: str) -> typing.List[str]:
+    """cache_dir 直下とサブディレクトリ（_base, _tx*）の wav をすべて列挙する。"""
+    paths = []
+    for root, _, files in os.walk(cache_dir):
+        for filename in files:
+            if filename.endswith(".wav"):
+                paths.append(os.path.join(root, filename))
+    return paths
+
+
+def referenced_paths(tasks: typing.List[dict]) -> typing.Set[str]:
+    """現在のストーリー（プラン）から参照されるファイル一覧（ページ用wavと合成元レンダリング）。"""
+    refs: typing.Set[str] = set()
+    for t in tasks:
+        refs.add(os.path.normpath(t["final_path"]))
+        refs.update(os.path.normpath(p) for p in t["render_paths"])
+    return refs
+
+
+def _source_of(cache_dir: str, path: str) -> str:
+    """転送用wavなら元のページ用wavのパス、それ以外はそのまま。"""
+    if _tier(cache_dir, path) == TIER_TRANSFER:
+        return os.path.normpath(os.path.join(cache_dir, os.path.basename(path)))
+    return os.path.normpath(path)
+
+
+def collect_garbage(cache_dirs: typing.List[str], refs: typing.Set[str],
+                    budget_bytes: typing.Optional[int] = None, dry_run: bool = False) -> dict:
+    """
+    1. 破損wav（ヘッダとデータ長が合わない等）を削除
+    2. どのストーリーからも参照されないwav（古い valence/speed のレンダリング、統合後に残ったチャンク等）を削除
+    3. 残りの合計が budget_bytes を超えていれば、作り直しが安いもの → 最終使用が古いもの の順に退避
+    返り値: {"corrupt": [...], "orphan": [...], "evicted": [...], "bytes_before", "bytes_after"}
+    """
+    result = dict(corrupt=[], orphan=[], evicted=[], bytes_before=0, bytes_after=0)
+    survivors: typing.List[typing.Tuple[int, float, str, int, str]] = []  # (tier, last_used, path, size, cache_dir)
+    manifests: typing.Dict[str, SpeechCacheManifest] = {}
+
+    def remove(path: str, cache_dir: str, reason: str) -> None:
+        result[reason].append(path)
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"【警告】削除に失敗しました ({path}): {e}")
+            if _tier(cache_dir, path) == TIER_PAGE:
+                manifests[cache_dir].remove(path)
+
+    for cache_dir in cache_dirs:
+        if not os.path.isdir(cache_dir):
+            continue
+        manifest = manifests[cache_dir] = SpeechCacheManifest(cache_dir)
+        for path in scan_cache_dir(cache_dir):
+            size = os.path.getsize(path)
+            result["bytes_before"] += size
+            if not validate_wav(path):
+                remove(path, cache_dir, "corrupt")
+            elif _source_of(cache_dir, path) not in refs:
+                remove(path, cache_dir, "orphan")
+            else:
+                source = _source_of(cache_dir, path)
+                survivors.append((_tier(cache_dir, path), manifest.last_used(source), path, size, cache_dir))
+
+    total = sum(item[3] for item in survivors)
+    if budget_bytes is not None and total > budget_bytes:
+        for tier, last_used, path, size, cache_dir in sorted(survivors):
+            if total <= budget_bytes:
+                break
+            remove(path, cache_dir, "evicted")
+            total -= size
+    result["bytes_after"] = total
+
+    if not dry_run:
+        for manifest in manifests.values():
+            manifest.save()
+
+    mode = "（ドライラン）" if dry_run else ""
+    print(f"🧹 キャッシュ整理{mode}: 破損 {len(result['corrupt'])}, 参照なし {len(result['orphan'])}, "
+          f"容量超過で退避 {len(result['evicted'])} files")
+    print(f"  {result['bytes_before'] / 1e6:.1f}MB → {result['bytes_after'] / 1e6:.1f}MB"
+          + (f" (上限 {budget_bytes / 1e6:.1f}MB)" if budget_bytes is not None else ""))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="音声キャッシュを整理する（参照されないwavの削除と容量上限での退避）")
+    parser.add_argument("--books", nargs="+", required=True, help="絵本ID (例: suhu inu)")
+    parser.add_argument("--variants", nargs="+", default=["normal"], choices=list(synth_planner.STORY_VARIANTS),
+                        help="ストーリー種別 (normal / emo / random)")
+    parser.add_argument("--conditions", nargs="+", default=["1"], choices=sorted(synth_planner.CONDITIONS.keys()))
+    parser.add_argument("--budget-mb", type=float, default=None, help="キャッシュ全体の容量上限 [MB]")
+    parser.add_argument("--dry-run", action="store_true", help="削除対象を表示するだけで削除しない")
+    parser.add_argument("--stretch", action="store_true", help="synth_planner.py --stretch（話速変換モード）で合成した場合に指定")
+    args = parser.parse_args()
+
+    rt = RobotTools('0.0.0.0', 0)
+    plan = synth_planner.build_plan(rt, args.books, args.variants, args.conditions,
+                                    stretch_from_base=args.stretch)
+    dirs = sorted({t["cache_dir"] for t in plan})
+    budget = int(args.budget_mb * 1e6) if args.budget_mb is not None else None
+    collect_garbage(dirs, referenced_paths(plan), budget_bytes=budget, dry_run=args.dry_run)
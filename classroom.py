@@ -0,0 +1,138 @@
+# classroom.py: 1台のPCから複数組（Sota + タブレット）の読み聞かせを同時に行う
+#
+# 組ごとに セッションID・SotaのIP・絵本・実験条件 を ROBOTS に書く。各タブレットでは
+#   http://<PCのIP>:5000/session/<セッションID>
+# を開いておく（絵本は読み上げ側が接続したときにそのセッションの絵本へ切り替わる）。
+# めくり・ページ移動・アンケートの指示は同じセッションのタブレットにだけ届く（app3.py）。
+#
+# - 同じ絵本・条件の組は同じ音声キャッシュ（<id>_<条件>_speech_cache）とプランを共有する
+#   （転送用wavの作成とマニフェストの書き込みは speech_cache.manifest_lock でキャッシュごとに直列化される）
+# - 先読みの送信は1つの PreloadWorker にまとめ、バッファの残りが最も少ないロボットから順に送る
+# - 全台の ReadingSession を1つのイベントループで同時に実行する（1台が止まっても他の台は続ける）
+#
+# 使い方（app3.py を先に起動しておく）:
+#   python classroom.py
+import asyncio
+import json
+
+from control_channel import SocketIONotifier, HttpNotifier
+from preload_scheduler import PreloadWorker
+from reading_session import ReadingSession, checkpoint_file_path, load_checkpoint, run_sessions
+from robottools3 import RobotTools
+from session_plan import compile_plan, save_plan, summarize_plan, plan_file_path, survey_url_for_cache_dir
+from synth_planner import story_file_path, cache_dir_for
+
+# ==============================================================================
+# 1. 設定
+# ==============================================================================
+# ★★★ 組ごとの設定（セッションIDはタブレットのURL /session/<ID> と合わせる） ★★★
+ROBOTS = [
+    dict(session_id="1", ip="192.168.1.147", port=22222, audio_port=30001, book_id="suhu", variant="normal", condition="1"),
+    dict(session_id="2", ip="192.168.1.148", port=22222, audio_port=30001, book_id="inu", variant="normal", condition="1"),
+]
+
+# Flaskサーバー（app3.py）
+FLASK_SERVER_URL = 'http://127.0.0.1:5000'
+FLASK_NOTIFICATION_URL = 'http://127.0.0.1:5000/sota_reading_finished'
+FLASK_FINISH_URL = 'http://127.0.0.1:5000/reading_finished'
+FLASK_TURNED_URL = 'http://127.0.0.1:5000/page_turned'
+FLASK_SEEK_URL = 'http://127.0.0.1:5000/seek_page'
+CONTROL_CHANNEL = "socketio"
+
+# 読み聞かせ終了後に表示するアンケート（sample3.py と同期させてください）
+SURVEY_URLS = {
+    "1": "https://docs.google.com/forms/d/e/1FAIpQLSfDX3h59_ZCFEYGNTfqPsHqRfY69Vvbhs5AvI-PHrpjmsIesA/viewform?usp=header",
+    "2": "https://docs.google.com/forms/d/e/1FAIpQLScJa9IvHXWeEa_lO8a_kEe0IlFt0nVLH93FTqgIKGI0opZtug/viewform?usp=header",
+    "3": "https://docs.google.com/forms/d/e/1FAIpQLSfgqHEOcm5HBwXZKY2FUmc_kDqEg7NxzO1mVO3hLmmoy13fcg/viewform?usp=header",
+}
+
+FLIP_MOTION_LEAD_MS = 300
+STARTUP_WAIT_SEC = 10.0
+PRELOAD_HORIZON_SEC = 60.0
+# 中断した回をやり直すときだけ True にする（古いチェックポイント・最初から読んだ回のものは使わない。sample3.py 参照）
+RESUME_FROM_CHECKPOINT = False
+
+
+# ==============================================================================
+# 2. 組ごとの準備
+# ==============================================================================
+def load_plans() -> dict:
+    """絵本・条件ごとにプランを1回だけ作る（同じキャッシュを使う組で共有する）。返り値: {キャッシュディレクトリ: プラン}"""
+    compiler = RobotTools('0.0.0.0', 0)   # プランの作成はキャッシュを読むだけ（Sota には接続しない）
+    plans = {}
+    for robot in ROBOTS:
+        cache_dir = cache_dir_for(robot["book_id"], robot["variant"], robot["condition"])
+        if cache_dir in plans:
+            continue
+        story_file = story_file_path(robot["book_id"], robot["variant"])
+        with open(story_file, 'r', encoding='utf-8') as f:
+            story_data = json.load(f)
+        plan = compile_plan(compiler, story_data, robot["book_id"], cache_dir,
+                            flip_lead_ms=FLIP_MOTION_LEAD_MS, startup_wait_sec=STARTUP_WAIT_SEC,
+                            survey_url=survey_url_for_cache_dir(cache_dir, robot["book_id"], SURVEY_URLS),
+                            story_file=story_file, preload_horizon_sec=PRELOAD_HORIZON_SEC)
+        save_plan(plan, plan_file_path(cache_dir, robot["book_id"]))
+        summarize_plan(plan)
+        plans[cache_dir] = plan
+    return plans
+
+
+def connect_notifier(session_id: str, book_id: str):
+    if CONTROL_CHANNEL == "socketio":
+        try:
+            return SocketIONotifier(FLASK_SERVER_URL, session_id=session_id, book_id=book_id)
+        except Exception as e:
+            print(f"⚠️ [{session_id}] Flaskサーバーに SocketIO で接続できませんでした。HTTP 通知で続行します: {e}")
+    return HttpNotifier(FLASK_NOTIFICATION_URL, FLASK_FINISH_URL, turned_url=FLASK_TURNED_URL,
+                        seek_url=FLASK_SEEK_URL, session_id=session_id)
+
+
+def build_session(robot: dict, plan: dict, worker: PreloadWorker) -> ReadingSession:
+    rt = RobotTools(robot["ip"], robot["port"], audio_port=robot["audio_port"], use_audio_ack=True)
+    try:
+        rt.open_audio_session(heartbeat_sec=5.0)
+    except Exception as e:
+        print(f"⚠️ [{robot['session_id']}] 音声セッションを開始できませんでした。1コマンド1接続方式で続行します: {e}")
+
+    checkpoint_path = checkpoint_file_path(plan["cache_dir"], plan["book_id"], robot["session_id"])
+    start_page = None
+    if RESUME_FROM_CHECKPOINT:
+        checkpoint = load_checkpoint(checkpoint_path, plan)
+        if checkpoint is not None:
+            start_page = checkpoint["next_page"]
+            print(f"⏩ [{robot['session_id']}] 前回の続きから再開します: {start_page}ページ")
+
+    return ReadingSession(rt, plan, notifier=connect_notifier(robot["session_id"], robot["book_id"]),
+                          start_page=start_page, startup_wait_sec=0 if start_page is not None else None,
+                          checkpoint_path=checkpoint_path, preload_worker=worker)
+
+
+# ==============================================================================
+# 3. 実行
+# ==============================================================================
+if __name__ == "__main__":
+    plans = load_plans()
+    worker = PreloadWorker()
+    sessions = [build_session(robot, plans[cache_dir_for(robot["book_id"], robot["variant"], robot["condition"])],
+                              worker)
+                for robot in ROBOTS]
+
+    print("全組の読み聞かせを同時に開始します。Enterを押してください。")
+    input()
+
+    try:
+        results = asyncio.run(run_sessions(sessions))
+    finally:
+        for session in sessions:
+            session.rt.stop_preload_scheduler()
+            session.rt.close_audio_session()
+        worker.stop()
+
+    print("-" * 30)
+    for robot, session, result in zip(ROBOTS, sessions, results):
+        if not isinstance(result, BaseException):
+            session.notifier.notify_finished(session.plan["survey_url"])
+        session.notifier.close()
+        print(f"🔚 [{robot['session_id']}] {robot['book_id']}: "
+              f"{'終了' if not isinstance(result, BaseException) else '中断'}")
+    print("-" * 30)
@@ -0,0 +1,227 @@
+# control_channel.py: 読み上げ側（reading_session.py）から Flask/SocketIO サーバー（app3.py）への制御チャネル
+#
+# - SocketIONotifier: SocketIO クライアントで app3.py に常時接続し、めくり・終了の指示を1メッセージで送る。
+#                     ブラウザのめくり完了通知（page_turned）も同じ接続で受け取る（推奨）
+# - HttpNotifier    : 指示ごとに HTTP POST する従来方式（SocketIO クライアントが使えない環境向け）
+#
+# どちらも同じメソッド（new_turn_id / notify_flip / wait_turned / seek_page / notify_finished / close）を持ち、
+# めくり指示の遅延を latency に記録する。
+# 複数台を同時に動かすときは、ロボットごとに session_id を変える（app3.py は同じセッションのブラウザにだけ送る）。
+#   flip_command: 指示を送ってからサーバーが受け付けるまで（ブラウザへの送信を含む）
+#   flip_turned : 指示を送ってからブラウザのめくり完了通知が届くまで
+import itertools
+import threading
+import time
+import typing
+import uuid
+
+import requests
+
+from latency_log import LatencyLog
+
+
+def _turn_id_generator() -> typing.Iterator[str]:
+    # 再起動前の指示の完了通知と取り違えないよう、実行ごとに異なる接頭辞を付ける
+    prefix = uuid.uuid4().hex[:8]
+    return (f"{prefix}-{n}" for n in itertools.count(1))
+
+
+class SocketIONotifier(object):
+    """
+    app3.py に SocketIO クライアントとして常時接続する制御チャネル。
+    接続時に role=reader とセッションIDを名乗り、サーバー側でそのセッションの読み上げ側の部屋に入る
+    （page_turned は同じセッションのブラウザからの通知だけが届く）。book_id を渡すとセッションの絵本も切り替える。
+    切断された場合は自動で再接続する。再接続までの指示は失敗扱い（reading_session はめくり時間だけ待つ）。
+    python-socketio のクライアント（pip install "python-socketio[client]"）が必要。
+    """
+
+    def __init__(self, server_url: str, session_id: typing.Optional[str] = None, book_id: typing.Optional[str] = None,
+                 timeout: float = 3.0, connect_timeout: float = 5.0):
+        import socketio  # クライアントを使うときだけ必要（HttpNotifier・LatencyLog だけなら不要）
+
+        self.server_url = server_url
+        self.session_id = session_id
+        self.timeout = timeout
+        self.latency = LatencyLog()
+        self._turn_ids = _turn_id_generator()
+        self._lock = threading.Lock()
+        self._waiting: typing.Dict[str, threading.Event] = {}
+        self._acks: typing.Dict[str, dict] = {}
+        self._sent_at: typing.Dict[str, float] = {}
+        self.browsers: typing.Optional[int] = None   # 直前のめくり指示が届いたブラウザの数（不明なら None）
+
+        self._sio = socketio.Client(reconnection=True)
+        self._sio.on('page_turned', self._on_page_turned)
+        self._sio.on('disconnect', lambda *args: print('⚠️ [CONTROL] Flaskサーバーとの接続が切れました。再接続します。'))
+        auth = {'role': 'reader'}
+        if session_id is not None:
+            auth['session'] = session_id
+        if book_id is not None:
+            auth['book'] = book_id
+        self._sio.connect(server_url, auth=auth, transports=['websocket'], wait_timeout=connect_timeout)
+        print(f"✅ [CONTROL] {server_url} に接続しました（SocketIO, セッション {session_id or '既定'}）。")
+
+    def new_turn_id(self) -> str:
+        turn_id = next(self._turn_ids)
+        # 指示を送る前に待ち受けを作っておく（完了通知が wait_turned より先に届いても取りこぼさない）
+        with self._lock:
+            self._waiting[turn_id] = threading.Event()
+        return turn_id
+
+    def notify_flip(self, flip_duration_ms: int, turn_id: typing.Optional[str] = None) -> bool:
+        t0 = time.monotonic()
+        try:
+            ok = self._sio.call('reader_flip', {'flip_duration': flip_duration_ms, 'turn_id': turn_id},
+                                timeout=self.timeout)
+        except Exception as e:
+            print(f'❌ [CONTROL] ページめくり指示の送信に失敗しました: {e}')
+            return False
+        self.latency.add('flip_command', (time.monotonic() - t0) * 1000.0)
+        if turn_id is not None:
+            self._sent_at[turn_id] = t0
+        # 受付は {'ok', 'browsers'}（古い app3.py は True だけを返す）
+        if isinstance(ok, dict):
+            self.browsers = ok.get('browsers')
+            ok = ok.get('ok')
+        return bool(ok)
+
+    def wait_turned(self, turn_id: str, timeout: float) -> typing.Optional[dict]:
+        """ブラウザのめくり完了通知を待つ。届かなければ None。"""
+        with self._lock:
+            event = self._waiting.setdefault(turn_id, threading.Event())
+        event.wait(timeout)
+        with self._lock:
+            self._waiting.pop(turn_id, None)
+            ack = self._acks.pop(turn_id, None)
+        sent_at = self._sent_at.pop(turn_id, None)
+        if ack is not None and sent_at is not None:
+            self.latency.add('flip_turned', (time.monotonic() - sent_at) * 1000.0)
+        return ack
+
+    def seek_page(self, page_number: int) -> bool:
+        """ブラウザの絵本を指定ページへ直接移す（途中から再開するとき）。"""
+        try:
+            return bool(self._sio.call('reader_seek', {'page': page_number}, timeout=self.timeout))
+        except Exception as e:
+            print(f'❌ [CONTROL] ページ移動の指示に失敗しました: {e}')
+            return False
+
+    def notify_finished(self, survey_url: str) -> bool:
+        try:
+            ok = self._sio.call('reader_finished', {'survey_url': survey_url}, timeout=self.timeout)
+        except Exception as e:
+            print(f"❌ アンケート表示通知に失敗: {e}")
+            return False
+        print("✅ アンケート表示通知を送信しました。")
+        return bool(ok)
+
+    def close(self) -> None:
+        self._sio.disconnect()
+
+    def _on_page_turned(self, data: dict) -> None:
+        turn_id = str((data or {}).get('turn_id'))
+        with self._lock:
+            event = self._waiting.get(turn_id)
+            if event is None:
+                return  # 待っていない（タイムアウト済み・他の読み上げ側の）通知
+            self._acks[turn_id] = data
+            event.set()
+
+
+class HttpNotifier(object):
+    """
+    Flask（app3.py）への HTTP 通知。接続を使い回すため requests.Session を使う。
+    turned_url を指定すると、めくり指示に turn_id を付け、ブラウザのめくり完了を wait_turned() で待てる。
+    session_id を指定すると、すべての通知に session_id を付ける（そのセッションのブラウザにだけ届く）。
+    """
+
+    def __init__(self, flip_url: str, finish_url: typing.Optional[str] = None,
+                 turned_url: typing.Optional[str] = None, seek_url: typing.Optional[str] = None,
+                 session_id: typing.Optional[str] = None, timeout: float = 3.0):
+        self.session_id = session_id
+        self.flip_url = flip_url
+        self.finish_url = finish_url
+        self.turned_url = turned_url
+        self.seek_url = seek_url
+        self.timeout = timeout
+        self.latency = LatencyLog()
+        self._http = requests.Session()
+        self._turn_ids = _turn_id_generator()
+        self._sent_at: typing.Dict[str, float] = {}
+        self.browsers: typing.Optional[int] = None   # 直前のめくり指示が届いたブラウザの数（不明なら None）
+
+    def new_turn_id(self) -> typing.Optional[str]:
+        return next(self._turn_ids) if self.turned_url else None
+
+    def notify_flip(self, flip_duration_ms: int, turn_id: typing.Optional[str] = None) -> bool:
+        payload = self._payload(flip_duration=flip_duration_ms)
+        if turn_id is not None:
+            payload['turn_id'] = turn_id
+        t0 = time.monotonic()
+        try:
+            response = self._http.post(self.flip_url, json=payload, timeout=self.timeout)
+        except requests.exceptions.ConnectionError as e:
+            print(f'❌ Flaskサーバーへの接続に失敗しました。サーバーが起動しているか、URL ({self.flip_url}) が正しいか確認してください: {e}')
+            return False
+        except Exception as e:
+            print(f'❌ ページめくり通知中に予期せぬエラー: {e}')
+            return False
+        if response.status_code != 200:
+            print(f'⚠️ Flaskサーバーへの通知に失敗しました。ステータスコード: {response.status_code}')
+            return False
+        self.latency.add('flip_command', (time.monotonic() - t0) * 1000.0)
+        if turn_id is not None:
+            self._sent_at[turn_id] = t0
+        try:
+            self.browsers = response.json().get('browsers')
+        except ValueError:
+            self.browsers = None   # 古い app3.py はテキストを返す
+        return True
+
+    def wait_turned(self, turn_id: str, timeout: float) -> typing.Optional[dict]:
+        """ブラウザのめくり完了通知を待つ（app3.py の /page_turned/<turn_id>）。届かなければ None。"""
+        try:
+            response = self._http.get(f"{self.turned_url.rstrip('/')}/{turn_id}", params={'timeout': timeout},
+                                      timeout=timeout + self.timeout)
+        except Exception as e:
+            print(f'⚠️ めくり完了通知の待機に失敗しました: {e}')
+            return None
+        sent_at = self._sent_at.pop(turn_id, None)
+        if response.status_code != 200:
+            return None
+        if sent_at is not None:
+            self.latency.add('flip_turned', (time.monotonic() - sent_at) * 1000.0)
+        return response.json()
+
+    def seek_page(self, page_number: int) -> bool:
+        """ブラウザの絵本を指定ページへ直接移す（app3.py の /seek_page）。"""
+        if not self.seek_url:
+            return False
+        try:
+            response = self._http.post(self.seek_url, json=self._payload(page=page_number), timeout=self.timeout)
+            return response.status_code == 200
+        except Exception as e:
+            print(f'❌ ページ移動の指示に失敗しました: {e}')
+            return False
+
+    def notify_finished(self, survey_url: str) -> bool:
+        if not self.finish_url:
+            return False
+        try:
+            r = self._http.post(self.finish_url, json=self._payload(survey_url=survey_url), timeout=self.timeout)
+            print(f"✅ アンケート表示通知を送信しました: {r.status_code}")
+            return r.status_code == 200
+        except Exception as e:
+            print(f"❌ アンケート表示通知に失敗: {e}")
+            return False
+
+    def close(self) -> None:
+        self._http.close()
+
+    def _payload(self, **fields) -> dict:
+        if self.session_id is not None:
+            fields['session_id'] = self.session_id
+        return fields
+
+
+Notifier = typing.Union[SocketIONotifier, HttpNotifier]
@@ -0,0 +1,258 @@
+# gap_bench.py: ページ間の待ち時間（前ページの読み上げ終了 → 次ページの読み上げ開始）のベンチマーク
+#
+# sample3.py と同じ ReadingSession を、手元のスタンドインに対して実時間で動かす。
+#   音声サーバ   : audio_server_sim.AudioAckServerSim（実ソケット。帯域・遅延を指定できる）
+#   モーションサーバ: MotionServerStub（RobotTools.play_motion の受け口。受信時刻を記録）
+#   ブラウザ     : reading_sim.SimBrowser（めくり指示 → めくり → page_turned を実時間で待つ）
+# 音声は合成した無音の wav（16kHz/mono）で、ページ数・チャンク数・長さを指定できる。
+#
+# ページごとに 音声終了 / モーション開始 / めくり指示 / めくり完了 / 次ページ音声開始 の時刻を記録し、
+# 方式（音声の転送方式 × 先読み方式）ごとに待ち時間の分布を JSON に書き出す。
+#
+# 使い方:
+#   python gap_bench.py --pages 8 --chunks 3 --chunk-ms 800 --repeat 3 -o gap_bench.json
+#   python gap_bench.py --bandwidth-mbps 2 --latency-ms 5 --strategies session+bundle conn+scheduler
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import typing
+import wave
+
+from audio_server_sim import AudioAckServerSim, SimClock
+from latency_log import LatencyLog
+from reading_session import ReadingSession
+from reading_sim import SimBrowser
+from robottools3 import RobotTools
+from session_plan import compile_plan
+
+BENCH_BOOK_ID = "bench"
+BENCH_RATE = 16000   # 転送用フォーマットと同じにして変換を省く
+
+# 方式: session = 常時接続セッション / conn = 1コマンド1接続、bundle = 開始前に一括先読み / scheduler = 読み聞かせ中に先読み
+STRATEGIES: typing.Dict[str, dict] = {
+    "session+bundle": dict(session=True, bundle=True),
+    "session+scheduler": dict(session=True, bundle=False),
+    "conn+bundle": dict(session=False, bundle=True),
+    "conn+scheduler": dict(session=False, bundle=False),
+}
+
+# ページ間の各区間（いずれも「前ページの音声終了」からの ms。gap_ms が子どもの待ち時間）
+GAP_METRICS = ("motion_start_ms", "motion_recv_ms", "flip_emit_ms", "turn_complete_ms", "gap_ms", "excess_gap_ms")
+
+
+# ==============================================================================
+# 1. スタンドイン・テストデータ
+# ==============================================================================
+class MotionServerStub(object):
+    """RobotTools の制御ポート（4byte長 + 本体 の2フレーム）を受け、play_motion を受信した時刻を記録する。"""
+
+    def __init__(self, host: str = "127.0.0.1"):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, 0))
+        self._sock.listen(8)
+        self.port = self._sock.getsockname()[1]
+        self.received: typing.List[typing.Tuple[float, str]] = []   # (time.monotonic(), コマンド)
+        self._thread = threading.Thread(target=self._serve, name="motion-stub", daemon=True)
+        self._thread.start()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    command = self._recv_frame(conn).decode("utf-8")
+                    self.received.append((time.monotonic(), command))
+                    if command == "play_motion":
+                        self._recv_frame(conn)
+                except (OSError, ConnectionError):
+                    pass
+
+    @staticmethod
+    def _recv_frame(conn: socket.socket) -> bytes:
+        def recv_exact(n: int) -> bytes:
+            buf = b""
+            while len(buf) < n:
+                chunk = conn.recv(n - len(buf))
+                if not chunk:
+                    raise ConnectionError("closed")
+                buf += chunk
+            return buf
+        (size,) = struct.unpack(">I", recv_exact(4))
+        return recv_exact(size)
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+def make_bench_book(cache_dir: str, pages: int, chunks: int, chunk_ms: int,
+                    flip_duration_ms: int = 600) -> typing.List[dict]:
+    """無音 wav のキャッシュと、それに対応するストーリーデータ（奇数ページ pages 枚 + 偶数ページ）を作る。"""
+    os.makedirs(cache_dir, exist_ok=True)
+    frames = b"\x00\x00" * (BENCH_RATE * chunk_ms // 1000)
+    story = []
+    for n in range(pages):
+        page_number = 2 * n + 1
+        for k in range(chunks):
+            path = os.path.join(cache_dir, f"{BENCH_BOOK_ID}_page{page_number:02d}_{k}__{page_number:04d}{k:04d}.wav")
+            with wave.open(path, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(BENCH_RATE)
+                wf.writeframes(frames)
+        story.append(dict(page_number=page_number, text=f"page {page_number}", flip_duration=flip_duration_ms))
+        story.append(dict(page_number=page_number + 1, text=f"page {page_number + 1}", flip_duration=flip_duration_ms))
+    return story
+
+
+# ==============================================================================
+# 2. 計測
+# ==============================================================================
+def page_gaps(session: ReadingSession, motion_received: typing.List[float],
+              one_way_latency_ms: float = 0.0) -> typing.List[dict]:
+    """
+    timeline から、めくりのあるページごとの区間を取り出す。
+    待ち時間（gap_ms）は Sota の PLAYSEQ イベント（前ページの最後のチャンクの FINISHED → 次ページの最初のチャンクの STARTED）
+    から求める。Sota の時計（robot_ms）があればその差、なければ受信時刻の差（片道遅延は両方に掛かるので打ち消し合う）。
+    他の区間の起点（音声終了）は FINISHED の受信時刻から片道遅延 one_way_latency_ms を引いた時刻。
+    """
+    at: typing.Dict[typing.Tuple[int, str], float] = {}
+    for t, page_number, event in session.timeline:
+        if page_number is not None:
+            at.setdefault((page_number, event), t)
+    # モーションサーバの受信時刻（time.monotonic()）を session 開始からの秒数に直す
+    motion_iter = iter(sorted(motion_received))
+    latency = one_way_latency_ms / 1000.0
+
+    rows = []
+    for page, nxt in zip(session.pages, session.pages[1:]):
+        n = page.page_number
+        finished = at.get((n, "play_finished"))
+        next_started = at.get((nxt.page_number, "play_started"))
+        if not page.should_flip or finished is None or next_started is None:
+            continue
+        planned_gap = (nxt.plan["audio_start_ms"] - page.plan["audio_end_ms"]) / 1000.0
+        robot_end = page.robot_ms.get("play_finished")
+        robot_start = nxt.robot_ms.get("play_started")
+        if robot_end is not None and robot_start is not None:
+            gap = (robot_start - robot_end) / 1000.0
+        else:
+            gap = next_started - finished
+        end = finished - latency
+        recv = next(motion_iter, None)
+        rows.append(dict(
+            page=n,
+            motion_start_ms=(at[(n, "motion_start")] - end) * 1000.0,
+            motion_recv_ms=(recv - session.t0 - end) * 1000.0 if recv is not None else None,
+            flip_emit_ms=(at[(n, "turn_start")] - end) * 1000.0,
+            turn_complete_ms=(at[(n, "turn_end")] - end) * 1000.0,
+            gap_ms=gap * 1000.0,
+            excess_gap_ms=(gap - planned_gap) * 1000.0,
+        ))
+    return rows
+
+
+def run_strategy(name: str, options: dict, story: typing.List[dict], cache_dir: str, args) -> typing.List[dict]:
+    """1方式を1回実行し、ページごとの区間を返す。"""
+    robot_dir = tempfile.mkdtemp(prefix="gap_bench_robot_")
+    server = AudioAckServerSim(port=0, cache_dir=robot_dir, clock=SimClock(1.0),
+                               bandwidth_bps=args.bandwidth_mbps * 1e6 if args.bandwidth_mbps else None,
+                               latency_ms=args.latency_ms).start_in_thread()
+    motion = MotionServerStub()
+    rt = RobotTools("127.0.0.1", motion.port, audio_port=server.port, use_audio_ack=True)
+    browser = SimBrowser(command_latency_ms=args.browser_latency_ms, ack_latency_ms=args.browser_latency_ms)
+    try:
+        if options["session"]:
+            rt.open_audio_session(heartbeat_sec=5.0)
+        if not options["bundle"]:
+            # 一括先読みを使わない（読み聞かせ中の先読みだけ）
+            rt.preload_book_to_sota = lambda *a, **kw: {}
+        plan = compile_plan(rt, story, BENCH_BOOK_ID, cache_dir, flip_lead_ms=args.lead_ms,
+                            startup_wait_sec=args.startup_wait)
+        session = ReadingSession(rt, plan, notifier=browser)
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(session.run())
+        return page_gaps(session, [t for t, command in motion.received if command == "play_motion"],
+                         one_way_latency_ms=args.latency_ms)
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rt.stop_preload_scheduler()
+            rt.close_audio_session()
+            server.stop_thread()
+        motion.close()
+        shutil.rmtree(robot_dir, ignore_errors=True)
+        print(f"  {name}: done")
+
+
+def summarize(rows: typing.List[dict]) -> typing.Dict[str, dict]:
+    log = LatencyLog()
+    for row in rows:
+        for metric in GAP_METRICS:
+            if row.get(metric) is not None:
+                log.add(metric, row[metric])
+    return log.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ページ間の待ち時間を方式ごとに計測する")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES.keys()), choices=list(STRATEGIES.keys()))
+    parser.add_argument("--pages", type=int, default=8, help="読み上げるページ数（奇数ページ）")
+    parser.add_argument("--chunks", type=int, default=3, help="1ページあたりのチャンク数")
+    parser.add_argument("--chunk-ms", type=int, default=800, help="チャンク1つの長さ [ms]")
+    parser.add_argument("--flip-ms", type=int, default=600, help="めくり時間 [ms]")
+    parser.add_argument("--lead-ms", type=int, default=300, help="音声の終わり何ms前にめくりモーションを始めるか")
+    parser.add_argument("--startup-wait", type=float, default=0.5, help="開始前の待ち時間 [s]")
+    parser.add_argument("--bandwidth-mbps", type=float, default=None, help="音声サーバの受信帯域 [MB/s]")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="音声サーバの応答遅延 [ms]")
+    parser.add_argument("--browser-latency-ms", type=float, default=5.0, help="めくり指示・完了通知の片道遅延 [ms]")
+    parser.add_argument("--repeat", type=int, default=1, help="方式ごとの繰り返し回数")
+    parser.add_argument("-o", "--output", default="gap_bench.json")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TTS_ENGINE", "local")   # 合成はしない（エンジンの初期化だけ軽くする）
+    book_dir = tempfile.mkdtemp(prefix="gap_bench_cache_")
+    try:
+        bench_story = make_bench_book(book_dir, args.pages, args.chunks, args.chunk_ms, args.flip_ms)
+        results = {}
+        for strategy in args.strategies:
+            all_rows = []
+            for r in range(args.repeat):
+                for row in run_strategy(strategy, STRATEGIES[strategy], bench_story, book_dir, args):
+                    row["run"] = r
+                    all_rows.append(row)
+            results[strategy] = dict(options=STRATEGIES[strategy], summary=summarize(all_rows), pages=all_rows)
+    finally:
+        shutil.rmtree(book_dir, ignore_errors=True)
+
+    report = dict(
+        created=datetime.datetime.now().isoformat(timespec="seconds"),
+        params={k: v for k, v in vars(args).items() if k not in ("output", "strategies")},
+        strategies=results,
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+
+    print("-" * 30)
+    print("📊 ページ間の待ち時間（前ページの音声終了 → 次ページの音声開始）")
+    for strategy, result in results.items():
+        s = result["summary"].get("gap_ms")
+        e = result["summary"].get("excess_gap_ms")
+        if s is None:
+            print(f"  {strategy}: 計測なし")
+            continue
+        print(f"  {strategy:18s} 中央値 {s['p50_ms']:7.1f}ms, p95 {s['p95_ms']:7.1f}ms, 最大 {s['max_ms']:7.1f}ms"
+              f"（予定より +{e['p50_ms']:.1f}ms）")
+    print(f"✅ 結果を書き出しました: {args.output}")
@@ -0,0 +1,238 @@
+# gesture_track.py: キャッシュ済み音声から、ページごとの身振り（ビートジェスチャ）のモーションを事前に作る
+#
+# 読み聞かせ中にジェスチャを1つずつ送ると、めくり指示と同じ制御ポートの通信が増える。そこで合成後に
+#   1. wav のフレームごとの音量（dB）と、その立ち上がり（オンセット）をまとめて計算し（NumPy でベクトル化）
+#   2. 立ち上がりの強い時刻を拍として選び（近すぎる拍は間引く）
+#   3. 拍ごとに肘を振る（RobotTools.__choose の BEAT_ARM_SERVO_MAP_LIST と同じ左右交互の振り）キーフレームにする
+# までを済ませ、play_motion にそのまま渡せるキーフレーム列をマニフェスト（_manifest.json）の "gesture" に保存する。
+# 振りの大きさは intensity、姿勢（腕の開き・顔の向き）は valence で変える。
+# session_plan.py がページのチャンクのジェスチャを1本につなげてプランに入れ、
+# reading_session.py は音声の再生開始と同時に1回の play_motion で送る。
+#
+# 使い方:
+#   python gesture_track.py --book suhu --variant normal --condition 1
+#   python gesture_track.py --book suhu --cache-dir suhu_1_speech_cache --force
+import argparse
+import json
+import os
+import typing
+
+import numpy as np
+
+import audio_post
+from speech_cache import SpeechCacheManifest
+
+GESTURE_VERSION = 1
+
+# ==============================================================================
+# 1. 既定値
+# ==============================================================================
+GESTURE_FRAME_MS = 20.0        # 音量解析のフレーム長 [ms]
+MIN_BEAT_INTERVAL_MS = 450     # 拍と拍の最小間隔 [ms]
+ONSET_THRESHOLD_STD = 1.0      # 立ち上がりが「平均 + この値 × 標準偏差」を超えたフレームを拍の候補にする
+STROKE_MS = 200                # 構え → 打点（拍の時刻）にかける時間 [ms]
+RETRACT_MS = 300               # 打点 → 構えに戻す時間 [ms]
+MIN_KEYFRAME_MS = 100          # キーフレーム1つの最短時間 [ms]（これより短い動きは送らない）
+BEAT_ELBOW_DEG = 20            # 最も強い拍での肘の振り幅（BEAT_ARM_SERVO_MAP_LIST の最大値）
+SETTLE_MS = 200                # めくりモーションの前に基本姿勢へ戻しておく余裕 [ms]
+
+# 基本姿勢（めくりモーション session_plan.build_flip_motion の終わりの姿勢と同じ）
+NEUTRAL_POSE = dict(BODY_Y=0, L_SHOU=-90, L_ELBO=0, R_SHOU=90, R_ELBO=0, HEAD_Y=0, HEAD_P=0, HEAD_R=0)
+
+
+# ==============================================================================
+# 2. 解析（ベクトル化したフレーム音量とオンセット）
+# ==============================================================================
+def audio_envelope(mono: np.ndarray, framerate: int, frame_ms: float = GESTURE_FRAME_MS,
+                   floor_db: float = audio_post.DEFAULT_THRESHOLD_DB) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    フレームごとの音量 [dBFS] と、その立ち上がり（増加分だけ、3フレームで平滑化）を返す。
+    無音からの立ち上がりが極端に大きくならないよう、音量は floor_db で下を切ってから差を取る。
+    """
+    db, _ = audio_post.frame_db(mono, framerate, frame_ms)
+    if len(db) == 0:
+        return db, db
+    floored = np.maximum(db, floor_db)
+    rise = np.maximum(0.0, np.diff(floored, prepend=floored[0]))
+    onset = np.convolve(rise, np.ones(3) / 3.0, mode="same")
+    return db, onset
+
+
+def pick_beats(db: np.ndarray, onset: np.ndarray, frame_ms: float = GESTURE_FRAME_MS,
+               min_interval_ms: float = MIN_BEAT_INTERVAL_MS,
+               threshold_db: float = audio_post.DEFAULT_THRESHOLD_DB) -> typing.List[typing.Tuple[int, float]]:
+    """拍の時刻 [ms] と強さ（0〜1）。有音フレームの中で、立ち上がりが極大かつ閾値を超えるものを強い順に採る。"""
+    if len(onset) < 3:
+        return []
+    voiced = db > threshold_db
+    if not voiced.any():
+        return []
+    peak = np.zeros(len(onset), dtype=bool)
+    peak[1:-1] = (onset[1:-1] > onset[:-2]) & (onset[1:-1] >= onset[2:])
+    threshold = onset[voiced].mean() + ONSET_THRESHOLD_STD * onset[voiced].std()
+    candidates = np.flatnonzero(peak & voiced & (onset > threshold))
+    if len(candidates) == 0:
+        return []
+
+    # 強い拍から順に、既に選んだ拍と min_interval_ms 以上離れているものだけ残す
+    min_gap = min_interval_ms / frame_ms
+    chosen: typing.List[int] = []
+    for idx in candidates[np.argsort(-onset[candidates], kind="stable")]:
+        if all(abs(idx - c) >= min_gap for c in chosen):
+            chosen.append(int(idx))
+    chosen.sort()
+    # 強さは選んだ拍の 90 パーセンタイルを 1 とする（1つだけ飛び抜けた拍で他が小さくならないように）
+    scale = max(float(np.percentile(onset[chosen], 90)), 1e-6)
+    return [(int(round(i * frame_ms)), round(min(1.0, float(onset[i]) / scale), 2)) for i in chosen]
+
+
+# ==============================================================================
+# 3. キーフレーム
+# ==============================================================================
+def base_pose(valence: float) -> dict:
+    """valence に応じた構えの姿勢。快なら腕を少し開いて顔を上げ、不快なら腕を閉じてうつむく。"""
+    v = float(np.clip(valence, -1.0, 1.0))
+    pose = dict(NEUTRAL_POSE)
+    pose["L_SHOU"] = int(round(NEUTRAL_POSE["L_SHOU"] + 15 * v))
+    pose["R_SHOU"] = int(round(NEUTRAL_POSE["R_SHOU"] - 15 * v))
+    pose["HEAD_P"] = int(round(-8 * v))
+    return pose
+
+
+def _keyframes_from_times(points: typing.List[typing.Tuple[int, dict]]) -> typing.List[dict]:
+    """(到達時刻 [ms], 姿勢) の列を play_motion のキーフレーム（Msec = 前のキーフレームからの時間）にする。"""
+    keyframes = []
+    t_prev = 0
+    for t, pose in points:
+        if t - t_prev < MIN_KEYFRAME_MS:
+            continue
+        keyframes.append(dict(Msec=int(t - t_prev), ServoMap=dict(pose)))
+        t_prev = t
+    return keyframes
+
+
+def gesture_keyframes(beats: typing.List[typing.Tuple[int, float]], duration_ms: int,
+                      valence: float = 0.0, intensity: float = 0.0) -> typing.List[dict]:
+    """
+    拍ごとに 構え → 打点 → 構え と動くキーフレーム列（最後は基本姿勢に戻る）。
+    打点では左右の肘を逆向きに振り（拍ごとに左右を入れ替える）、少しうなずく。
+    振り幅 = BEAT_ELBOW_DEG × 拍の強さ ×（0.5 + 0.5 × intensity）
+    """
+    if not beats:
+        return []
+    rest = base_pose(valence)
+    gain = 0.5 + 0.5 * float(np.clip(intensity, 0.0, 1.0))
+    points: typing.List[typing.Tuple[int, dict]] = []
+    for n, (t, strength) in enumerate(beats):
+        if t < STROKE_MS:
+            continue   # 構える時間がない（冒頭の拍）
+        if t + RETRACT_MS > duration_ms:
+            break
+        swing = int(round(BEAT_ELBOW_DEG * strength * gain)) * (1 if n % 2 == 0 else -1)
+        stroke = dict(rest, L_ELBO=rest["L_ELBO"] + swing, R_ELBO=rest["R_ELBO"] - swing,
+                      HEAD_P=rest["HEAD_P"] + int(round(4 * strength * gain)))
+        points.append((max(0, t - STROKE_MS), rest))
+        points.append((t, stroke))
+        points.append((t + RETRACT_MS, rest))
+    if not points:
+        return []
+    points.append((points[-1][0] + RETRACT_MS, dict(NEUTRAL_POSE)))
+    return _keyframes_from_times(points)
+
+
+def track_ms(keyframes: typing.List[dict]) -> int:
+    return sum(k["Msec"] for k in keyframes)
+
+
+def page_gesture(tracks: typing.List[typing.Tuple[int, typing.List[dict]]],
+                 until_ms: typing.Optional[int] = None) -> typing.List[dict]:
+    """
+    ページ内のチャンクごとのキーフレーム列（チャンクの開始時刻 [ms], キーフレーム）を1本につなげる。
+    until_ms（めくりモーションの開始時刻。ページの音声開始から）までに基本姿勢へ戻るよう、後ろの拍を落とす。
+    """
+    points: typing.List[typing.Tuple[int, dict]] = []
+    for offset, keyframes in tracks:
+        t = max(offset, points[-1][0] if points else 0)
+        for k in keyframes:
+            t += k["Msec"]
+            points.append((t, k["ServoMap"]))
+    if until_ms is not None:
+        limit = until_ms - SETTLE_MS - RETRACT_MS
+        points = [(t, pose) for t, pose in points if t <= limit]
+    if not points:
+        return []
+    if points[-1][1] != NEUTRAL_POSE:
+        points.append((points[-1][0] + RETRACT_MS, dict(NEUTRAL_POSE)))
+    return _keyframes_from_times(points)
+
+
+# ==============================================================================
+# 4. キャッシュへの書き込み
+# ==============================================================================
+def analyze_wav(path: str, valence: float = 0.0, intensity: float = 0.0) -> dict:
+    """wav 1つを解析し、マニフェストの "gesture" に保存する内容を返す。"""
+    samples, params = audio_post.read_wav(path)
+    mono = audio_post.to_float_mono(samples, params["sampwidth"])
+    db, onset = audio_envelope(mono, params["framerate"])
+    beats = pick_beats(db, onset)
+    return dict(
+        version=GESTURE_VERSION,
+        valence=valence,
+        intensity=intensity,
+        beats=[list(b) for b in beats],
+        keyframes=gesture_keyframes(beats, audio_post.duration_ms(samples, params["framerate"]), valence, intensity),
+    )
+
+
+def build_gesture_tracks(rt, story_data: typing.List[dict], book_id: str, cache_dir: str,
+                         force: bool = False) -> int:
+    """
+    読み上げる（奇数）ページのキャッシュ wav をすべて解析し、ジェスチャをマニフェストに保存する。
+    同じ valence / intensity で作成済みのものは飛ばす（force=True で作り直す）。返り値: 解析した wav の数
+    """
+    from session_plan import page_base_filename  # session_plan がこのモジュールを使うため、ここで読み込む
+
+    manifest = SpeechCacheManifest(cache_dir)
+    analyzed = 0
+    beats_total = 0
+    for i, item in enumerate(story_data):
+        try:
+            page_number = int(item.get('page_number', i + 1))
+        except (TypeError, ValueError):
+            continue
+        if page_number % 2 == 0:
+            continue
+        valence = item.get('valence', 0.0)
+        intensity = item.get('intensity', 0.0)
+        for path in rt._get_cached_chunk_files(page_base_filename(page_number), cache_dir, book_id or None):
+            done = manifest.get(path).get("gesture") or {}
+            if (not force and done.get("version") == GESTURE_VERSION
+                    and done.get("valence") == valence and done.get("intensity") == intensity):
+                continue
+            gesture = analyze_wav(path, valence, intensity)
+            manifest.update(path, gesture=gesture)
+            analyzed += 1
+            beats_total += len(gesture["beats"])
+    manifest.save()
+    print(f"✅ ジェスチャを作成しました: {analyzed} ファイル, {beats_total} 拍 ({cache_dir})")
+    return analyzed
+
+
+if __name__ == "__main__":
+    from robottools3 import RobotTools
+    from synth_planner import story_file_path, cache_dir_for
+
+    parser = argparse.ArgumentParser(description="キャッシュ済み音声からページごとのジェスチャを作り、マニフェストに保存する")
+    parser.add_argument("--book", required=True, help="絵本ID (例: suhu)")
+    parser.add_argument("--variant", default="normal", help="ストーリー種別 (story_<id>_<種別>.json)")
+    parser.add_argument("--condition", default="1", help="実験条件（キャッシュディレクトリ名に使う）")
+    parser.add_argument("--cache-dir", default=None, help="キャッシュディレクトリ（省略時は種別・条件から決める）")
+    parser.add_argument("--force", action="store_true", help="作成済みのジェスチャも作り直す")
+    args = parser.parse_args()
+
+    with open(story_file_path(args.book, args.variant), "r", encoding="utf-8") as f:
+        story = json.load(f)
+    cache_dir = args.cache_dir or cache_dir_for(args.book, args.variant, args.condition)
+    if not os.path.isdir(cache_dir):
+        raise RuntimeError(f"cache directory not found: {cache_dir}")
+    build_gesture_tracks(RobotTools('0.0.0.0', 0), story, args.book, cache_dir, force=args.force)
@@ -0,0 +1,30 @@
+# latency_log.py: 遅延の記録と集計（control_channel.py・reading_sim.py・gap_bench.py で共有。外部ライブラリに依存しない）
+import typing
+
+
+class LatencyLog(object):
+    """名前ごとの遅延 [ms] の記録と集計。"""
+
+    def __init__(self):
+        self.samples: typing.Dict[str, typing.List[float]] = {}
+
+    def add(self, name: str, ms: float) -> None:
+        self.samples.setdefault(name, []).append(ms)
+
+    def summary(self) -> typing.Dict[str, dict]:
+        result = {}
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            result[name] = dict(
+                n=len(ordered),
+                mean_ms=sum(ordered) / len(ordered),
+                p50_ms=ordered[len(ordered) // 2],
+                p95_ms=ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                max_ms=ordered[-1],
+            )
+        return result
+
+    def print_summary(self, title: str) -> None:
+        for name, s in self.summary().items():
+            print(f"  {title} {name}: n={s['n']}, 平均 {s['mean_ms']:.1f}ms, 中央値 {s['p50_ms']:.1f}ms, "
+                  f"p95 {s['p95_ms']:.1f}ms, 最大 {s['max_ms']:.1f}ms")
@@ -4,6 +4,9 @@ import os
 import textwrap
 import time
 from robottools3 import RobotTools 
+from gesture_track import build_gesture_tracks
+from synth_planner import cache_dir_for, story_file_path
+from text_chunker import ChunkRegistry
 
 # ==============================================================================
 # 1. 設定
@@ -15,12 +18,25 @@ rt = RobotTools(DUMMY_IP, DUMMY_PORT)
 
 # ★★★ 読み聞かせたい絵本IDを設定 ★★★
 CURRENT_BOOK_ID = "inu" 
-STORY_FILE_PATH = f'story_{CURRENT_BOOK_ID}_normal.json' 
-
-# キャッシュディレクトリ名
-BOOK_CACHE_DIR = f'{CURRENT_BOOK_ID}_1_2_speech_cache' 
+# ストーリー種別（synth_planner.STORY_VARIANTS のキー）
+STORY_VARIANT = "normal"
+STORY_FILE_PATH = story_file_path(CURRENT_BOOK_ID, STORY_VARIANT)
+
+# キャッシュディレクトリ名（sample3.py / classroom.py / session_plan.py が読む名前と同じにする）
+# このスクリプトはめくり時間の比率で話速を決め、感情も使うので条件 "1"（synth_planner.CONDITIONS）にあたる
+CONDITION = "1"
+BOOK_CACHE_DIR = cache_dir_for(CURRENT_BOOK_ID, STORY_VARIANT, CONDITION)
 os.makedirs(BOOK_CACHE_DIR, exist_ok=True) 
 
+# True: 各チャンクを speed=100 で一度だけ合成し、ページごとの話速はタイムストレッチで作る
+# （flip_duration や話速の式を変えても VOICEPEAK の再実行が不要になる）
+# 実験刺激の音質が変わるため既定は False（VOICEPEAK がページごとの話速で直接合成する）
+STRETCH_FROM_BASE = False
+
+# キャッシュキーの感情パラメータ丸め幅（1: VOICEPEAKの整数値そのまま / 5: happy・sad・pitch を5刻み）
+EMOTION_STEP = 1
+PITCH_STEP = 1
+
 # ==============================================================================
 # 2. メイン処理
 # ==============================================================================
@@ -61,6 +77,9 @@ print("-" * 30)
 # ------------------------------------------------------------------------------
 # STEP B: 算出した全体平均を基に、各ページのスピードを計算して音声合成
 # ------------------------------------------------------------------------------
+# 同一内容のチャンクは全ページを通して1回だけ合成する
+registry = ChunkRegistry()
+
 for i, item in enumerate(story_data):
     
     text = item.get('text', '')
@@ -104,8 +123,27 @@ for i, item in enumerate(story_data):
         cache_dir=BOOK_CACHE_DIR, 
         book_id=CURRENT_BOOK_ID,
         base_filename=base_filename,
-        speed=final_speed 
+        speed=final_speed,
+        stretch_from_base=STRETCH_FROM_BASE,
+        emotion_step=EMOTION_STEP,
+        pitch_step=PITCH_STEP,
+        registry=registry,
     )
 
+print(f"  {registry.summary()}")
+
+# ------------------------------------------------------------------------------
+# STEP C: Sotaへ送る転送用wav（16kHz/モノラル/16bit）を事前に作成し、送信サイズを表示
+# ------------------------------------------------------------------------------
+print("-" * 30)
+rt.prepare_transfer_cache(cache_dir=BOOK_CACHE_DIR, book_id=CURRENT_BOOK_ID)
+
+# ------------------------------------------------------------------------------
+# STEP D: 音声の抑揚に合わせたジェスチャ（play_motion のキーフレーム）を作り、マニフェストに保存
+# ------------------------------------------------------------------------------
+# 読み聞かせ中は、ページの再生開始と同時に1回の play_motion で送るだけになる
+print("-" * 30)
+build_gesture_tracks(rt, story_data, CURRENT_BOOK_ID, BOOK_CACHE_DIR)
+
 print("-" * 30)
 print(f"✅ 全プロセスの完了。全体平均 {avg_flip:.1f}ms に基づき、全音声の生成が終わりました。")
\ No newline at end of file
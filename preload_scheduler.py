@@ -0,0 +1,310 @@
+# preload_scheduler.py: 回線速度に合わせた先読みスケジューラ（Sota 上に「この先 N 秒分」の音声を置いておく）
+#
+# - PUT にかかった時間から実効スループット（bytes/s）を推定する
+# - 再生位置から見て、Sota 上に連続して保存済みの音声が horizon_sec 秒分になるまで先のページを送る
+#   （プランの先読み時刻 schedule を渡した場合は、各ページをプランの start_ms になったら送る）
+# - 次のページの送信が再生に追いつかれそうなとき（推定送信時間 > 残りバッファ）は警告し、そのページを最優先で送る
+# - Sota 側の保存容量の上限（max_resident_bytes）を超えて先読みしない
+# - 複数台の Sota を同時に動かすときは、1つの PreloadWorker を共有して送信を1本にまとめ、
+#   バッファの残りが最も少ないロボットから順に送る（ホストの回線を取り合わない）
+import threading
+import time
+import typing
+
+# スループットの初期推定値（実測が入るまで） [bytes/s]
+DEFAULT_THROUGHPUT_BPS = 1_000_000.0
+# スループット推定の指数移動平均の重み（新しい測定値側）
+THROUGHPUT_ALPHA = 0.3
+# 送信失敗時の再試行間隔 [s]
+RETRY_SEC = 1.0
+
+
+class _Page(object):
+    def __init__(self, base_filename: str, items: list, preload: typing.Optional[dict] = None):
+        self.base_filename = base_filename
+        self.start_ms: typing.Optional[int] = preload["start_ms"] if preload else None         # プラン上の送信開始
+        self.deadline_ms: typing.Optional[int] = preload["deadline_ms"] if preload else None   # プラン上の再生開始
+        self.items = items                          # [(key, duration_ms, FileBody)]
+        self.keys = [key for key, _, _ in items]
+        self.duration_sec = sum(ms for _, ms, _ in items) / 1000.0
+        self.nbytes = sum(len(data) for _, _, data in items)
+        self.resident = False
+        self.played = False
+
+
+class PreloadScheduler(object):
+    """
+    RobotTools.start_preload_scheduler() で作る。読み上げ側は
+      notify_playing(base) → （再生）→ notify_finished(base)
+    を呼び、再生前に wait_resident(base) で保存完了を待つ。
+    """
+
+    def __init__(self, rt, base_filenames: typing.List[str], cache_dir: str, book_id: typing.Optional[str] = None,
+                 horizon_sec: float = 60.0, max_resident_bytes: typing.Optional[int] = None, timeout: float = 120.0,
+                 worker: typing.Optional["PreloadWorker"] = None,
+                 schedule: typing.Optional[typing.Dict[str, dict]] = None, origin: typing.Optional[float] = None):
+        """
+        base_filenames: 再生順のページ（例: ["page01", "page03", ...]）
+        horizon_sec: 再生位置より先に Sota 上へ置いておく音声の長さ [s]（schedule がないページに使う）
+        max_resident_bytes: Sota 上の未再生音声の合計バイト数の上限（None で無制限）
+        worker: 複数台で共有する送信スレッド（None ならこのスケジューラ専用のものを作る）
+        schedule: {ページ: プランの preload（start_ms, deadline_ms, eta_ms）}。session_plan.compile_plan が作る
+        origin: プランの時刻 0 に当たる time.monotonic() の値（schedule を使うときに必要）
+        """
+        self.horizon_sec = horizon_sec
+        self.max_resident_bytes = max_resident_bytes
+        self.throughput_bps: typing.Optional[float] = None
+        self.uploaded_bytes = 0
+        self._rt = rt
+        self._timeout = timeout
+
+        schedule = schedule if origin is not None else None
+        self._origin = origin
+        self._pages = [_Page(base, rt._page_upload_items(base, cache_dir, book_id), (schedule or {}).get(base))
+                       for base in base_filenames]
+        self._pages = [p for p in self._pages if p.items]
+        self._index = {p.base_filename: i for i, p in enumerate(self._pages)}
+        self._position = 0                              # 再生中（または次に再生する）ページ
+        self._play_started: typing.Optional[float] = None
+        self._urgent: typing.Optional[int] = None
+
+        self._stopped = False
+        self._retry_at = 0.0
+        self._own_worker = worker is None
+        self._worker = PreloadWorker(timeout=timeout) if worker is None else worker
+        self._cond = self._worker.cond
+        self._worker.add(self)
+
+    # --- 読み上げ側から呼ぶ ---
+    def mark_resident(self, base_filenames: typing.Iterable[str]) -> None:
+        """一括先読み（BUNDLE）などで既に Sota 上にあるページを登録する。"""
+        with self._cond:
+            for base in base_filenames:
+                if base in self._index:
+                    self._pages[self._index[base]].resident = True
+            self._cond.notify_all()
+
+    def notify_playing(self, base_filename: str) -> None:
+        with self._cond:
+            idx = self._index.get(base_filename)
+            if idx is None:
+                return
+            for p in self._pages[:idx]:
+                p.played = True
+            self._position = idx
+            self._play_started = time.monotonic()
+            self._cond.notify_all()
+
+    def notify_finished(self, base_filename: str) -> None:
+        with self._cond:
+            idx = self._index.get(base_filename)
+            if idx is None:
+                return
+            self._pages[idx].played = True
+            self._position = max(self._position, idx + 1)
+            self._play_started = None
+            self._cond.notify_all()
+
+    def wait_resident(self, base_filename: str, timeout: typing.Optional[float] = None) -> bool:
+        """
+        ページが Sota 上に保存されるまで待つ（未保存で、プランの送信開始時刻を過ぎていれば最優先で送る）。
+        キャッシュにないページは即 False。
+        """
+        with self._cond:
+            idx = self._index.get(base_filename)
+            if idx is None:
+                return False
+            page = self._pages[idx]
+            if not page.resident and self._due_locked(page):
+                print(f"⏳【先読み】{base_filename} の保存を待ちます（バッファ {self._buffer_ahead_locked():.1f}秒）")
+                self._urgent = idx
+                self._cond.notify_all()
+            return self._cond.wait_for(lambda: page.resident or self._stopped, timeout) and page.resident
+
+    def keys_for(self, base_filename: str) -> typing.List[str]:
+        idx = self._index.get(base_filename)
+        return list(self._pages[idx].keys) if idx is not None else []
+
+    @property
+    def buffer_ahead_sec(self) -> float:
+        """再生位置から先、途切れずに再生できる保存済み音声の長さ [s]。"""
+        with self._cond:
+            return self._buffer_ahead_locked()
+
+    def status(self) -> dict:
+        with self._cond:
+            return dict(
+                position=self._pages[self._position].base_filename if self._position < len(self._pages) else None,
+                buffer_ahead_sec=self._buffer_ahead_locked(),
+                throughput_bps=self.throughput_bps,
+                resident_pages=sum(1 for p in self._pages if p.resident and not p.played),
+                resident_bytes=self._resident_bytes_locked(),
+            )
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._worker.remove(self)
+        if self._own_worker:
+            self._worker.stop()
+
+    # --- 内部処理 ---
+    def _buffer_ahead_locked(self) -> float:
+        ahead = 0.0
+        for i in range(self._position, len(self._pages)):
+            p = self._pages[i]
+            if not p.resident:
+                break
+            if i == self._position and self._play_started is not None:
+                ahead += max(0.0, p.duration_sec - (time.monotonic() - self._play_started))
+            else:
+                ahead += p.duration_sec
+        return ahead
+
+    def _due_locked(self, page: _Page) -> bool:
+        """プランの送信開始時刻を過ぎたか（プランの時刻がないページは常に True）。"""
+        return page.start_ms is None or (time.monotonic() - self._origin) * 1000.0 >= page.start_ms
+
+    def _next_start_in_locked(self) -> typing.Optional[float]:
+        """次に送るページのプランの送信開始までの秒数（プランの時刻がなければ None）。"""
+        idx = next((i for i in range(self._position, len(self._pages)) if not self._pages[i].resident), None)
+        if idx is None or self._pages[idx].start_ms is None:
+            return None
+        return self._pages[idx].start_ms / 1000.0 - (time.monotonic() - self._origin)
+
+    def _resident_bytes_locked(self) -> int:
+        return sum(p.nbytes for p in self._pages if p.resident and not p.played)
+
+    def _next_job_locked(self) -> typing.Optional[int]:
+        if self._urgent is not None and not self._pages[self._urgent].resident:
+            return self._urgent
+        # 再生位置から最初の未保存ページ（連続したバッファを伸ばす順）
+        idx = next((i for i in range(self._position, len(self._pages)) if not self._pages[i].resident), None)
+        if idx is None:
+            return None
+        # 再生中・次に再生するページは常に送る。それより先はプランの送信開始時刻（なければ horizon）と容量上限の範囲内だけ
+        if idx > self._position:
+            if self._pages[idx].start_ms is not None:
+                if not self._due_locked(self._pages[idx]):
+                    return None
+            elif self._buffer_ahead_locked() >= self.horizon_sec:
+                return None
+            if (self.max_resident_bytes is not None
+                    and self._resident_bytes_locked() + self._pages[idx].nbytes > self.max_resident_bytes):
+                return None
+        return idx
+
+    def _upload(self, idx: int) -> None:
+        """1ページを送る（PreloadWorker のスレッドから呼ばれる）。"""
+        with self._cond:
+            page = self._pages[idx]
+            buffer_sec = self._buffer_ahead_locked()
+        eta = page.nbytes / (self.throughput_bps or DEFAULT_THROUGHPUT_BPS)
+        if page.deadline_ms is not None:
+            remaining = page.deadline_ms / 1000.0 - (time.monotonic() - self._origin)
+            if eta > remaining:
+                print(f"⚠️【先読み】{page.base_filename} の送信（推定 {eta:.1f}秒）がプランの再生開始"
+                      f"（残り {remaining:.1f}秒）に間に合わない見込みです")
+        elif eta > buffer_sec and self._play_started is not None:
+            print(f"⚠️【先読み】{page.base_filename} の送信（推定 {eta:.1f}秒）が再生に追いつかれそうです"
+                  f"（バッファ {buffer_sec:.1f}秒）")
+
+        t0 = time.monotonic()
+        try:
+            sent = self._rt._put_items(page.items, self._timeout)
+        except Exception as e:
+            print(f"【警告】先読みに失敗しました ({page.base_filename}): {e}。{RETRY_SEC}秒後に再試行します。")
+            with self._cond:
+                # 再試行まではこのスケジューラを飛ばす（共有中の他のロボットの送信は止めない）
+                self._retry_at = time.monotonic() + RETRY_SEC
+            return
+        elapsed = max(time.monotonic() - t0, 1e-3)
+
+        with self._cond:
+            # Sota 上に保存済みで送信を省いた場合（sent == 0）は測定に使わない
+            if sent > 0:
+                measured = sent / elapsed
+                self.throughput_bps = (measured if self.throughput_bps is None
+                                       else THROUGHPUT_ALPHA * measured + (1 - THROUGHPUT_ALPHA) * self.throughput_bps)
+            self.uploaded_bytes += sent
+            page.resident = True
+            if self._urgent == idx:
+                self._urgent = None
+            self._cond.notify_all()
+            print(f"✅【先読み】{page.base_filename} ({sent} bytes, {elapsed:.2f}s, "
+                  f"{(self.throughput_bps or 0) / 1e6:.2f}MB/s) バッファ {self._buffer_ahead_locked():.1f}秒")
+
+
+class PreloadWorker(object):
+    """
+    先読みの送信スレッド。複数台の Sota を同時に動かすときは1つ作って各ロボットのスケジューラで共有する。
+
+        worker = PreloadWorker()
+        rt_a.start_preload_scheduler(bases_a, cache_dir, book_id, worker=worker)
+        rt_b.start_preload_scheduler(bases_b, cache_dir, book_id, worker=worker)
+
+    送るページは「保存待ち（最優先）のページ」→「バッファの残りが最も少ないロボットの次のページ」の順に選ぶ。
+    送信は1本ずつなので、ホストの回線を複数台で取り合って全員のバッファが同時に減ることがない。
+    """
+
+    def __init__(self, timeout: float = 120.0):
+        self.cond = threading.Condition()
+        self._timeout = timeout
+        self._schedulers: typing.List[PreloadScheduler] = []
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="preload-worker", daemon=True)
+        self._thread.start()
+
+    def add(self, scheduler: PreloadScheduler) -> None:
+        with self.cond:
+            self._schedulers.append(scheduler)
+            self.cond.notify_all()
+
+    def remove(self, scheduler: PreloadScheduler) -> None:
+        with self.cond:
+            if scheduler in self._schedulers:
+                self._schedulers.remove(scheduler)
+            self.cond.notify_all()
+
+    def stop(self) -> None:
+        with self.cond:
+            self._stopped = True
+            self.cond.notify_all()
+        self._thread.join(timeout=self._timeout)
+
+    def _next_job_locked(self) -> typing.Optional[typing.Tuple[PreloadScheduler, int]]:
+        now = time.monotonic()
+        jobs = []
+        for s in self._schedulers:
+            if s._stopped or s._retry_at > now:
+                continue
+            idx = s._next_job_locked()
+            if idx is not None:
+                jobs.append((idx != s._urgent, s._buffer_ahead_locked(), s, idx))
+        if not jobs:
+            return None
+        _, _, scheduler, idx = min(jobs, key=lambda job: job[:2])
+        return scheduler, idx
+
+    def _wait_sec_locked(self) -> float:
+        """次に見直すまでの秒数（プランの送信開始が近いページがあれば、その時刻に起きる）。"""
+        wait = 0.5
+        for s in self._schedulers:
+            start_in = s._next_start_in_locked()
+            if start_in is not None and start_in > 0:
+                wait = min(wait, start_in)
+        return max(wait, 0.001)
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                # 再生が進むとバッファが減るので、待機中も定期的に見直す
+                job = self._next_job_locked()
+                while not self._stopped and job is None:
+                    self.cond.wait(self._wait_sec_locked())
+                    job = self._next_job_locked()
+                if self._stopped:
+                    return
+            scheduler, idx = job
+            scheduler._upload(idx)
@@ -0,0 +1,451 @@
+# reading_session.py: 読み聞かせ1回分を asyncio のタスクグラフとして実行するエンジン
+#
+# 各ページ（奇数ページ）を次の小さなタスクに分け、依存関係のないものは同時に進める。
+#
+#   preload(p+1) ──────────────────────────────┐
+#   resident(p) → audio(p) ─(終了 lead_ms 前)→ motion(p)
+#                                 └─(腕がページに届いた時点)→ turn(p) → audio(p+1)
+#
+# - audio   : Sota 上に保存済みの音声を再生する（play_cached_speech_from_sota）
+# - gesture : 音声に合わせた身振り（gesture_track.py で事前に作ったもの）。再生開始と同時に1回の play_motion で送る
+# - motion  : ページめくりモーション（play_motion）。音声の終わり lead_ms 前に始める
+# - turn    : ブラウザのページめくり（Flask へ通知し、ブラウザからのめくり完了通知 page_turned を待つ）
+# - preload : 次ページの音声の保存待ち（先読みスケジューラ）。現ページの再生と同時に進める
+#             スケジューラはプランの先読み時刻（ページごとの preload.start_ms）に従って送る
+#
+# ページの選別・保存キー・モーション・時刻はすべて session_plan.py で作ったプランに従う。
+# 実行中は依存関係に沿って進め、実際の時刻とプランの時刻の差（drift）を記録する。
+# RobotTools の呼び出しはブロッキングなので、ループのスレッドプールで実行する。
+# 時刻はすべてイベントループの時計（loop.time()）で測るので、reading_sim.py の仮想時計ループでもそのまま動く。
+import asyncio
+import concurrent.futures
+import json
+import os
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from control_channel import Notifier
+
+# めくり完了通知を待つ上限 = めくり時間 × 2（前のめくりの完了待ちで保留される分）+ この余裕 [ms]
+TURN_ACK_MARGIN_MS = 2000
+# run_sessions: 1台あたりに同時に走るブロッキング呼び出し（再生・モーション・めくり完了待ち・先読み待ち）の数
+THREADS_PER_SESSION = 4
+# これより古いチェックポイントからは再開しない（次の子どもの回を途中から始めないように）[s]
+CHECKPOINT_MAX_AGE_SEC = 30 * 60
+
+
+def checkpoint_file_path(cache_dir: str, book_id: str, session_id: typing.Optional[str] = None) -> str:
+    """チェックポイントの保存先（キャッシュディレクトリ直下）。同じ絵本を複数台で読むときはセッションごとに分ける。"""
+    if session_id is None:
+        return os.path.join(cache_dir, f"_checkpoint_{book_id}.json")
+    return os.path.join(cache_dir, f"_checkpoint_{book_id}_{session_id}.json")
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoint(path: str) -> None:
+    """チェックポイントを消す（最初から読み始めるとき）。"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load_checkpoint(path: str, plan: dict, max_age_sec: typing.Optional[float] = CHECKPOINT_MAX_AGE_SEC) -> typing.Optional[dict]:
+    """
+    続きから読めるチェックポイントを返す。ない・読み終えている・プランと合わない・max_age_sec より古い場合は None。
+    返り値の next_page を ReadingSession(start_page=...) に渡す。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("book_id") != plan["book_id"] or checkpoint.get("next_page") is None:
+        return None
+    if checkpoint["next_page"] not in [p["page_number"] for p in plan["pages"]]:
+        return None
+    if max_age_sec is not None:
+        age = time.time() - float(checkpoint.get("saved_at") or 0.0)
+        if age > max_age_sec:
+            print(f"⚠️ チェックポイントが古いため再開しません（{age / 60:.0f}分前。上限 {max_age_sec / 60:.0f}分）: {path}")
+            return None
+    return checkpoint
+
+
+class PageTask(object):
+    """プランの1ページ分と、実行中のタスクの状態。"""
+
+    def __init__(self, plan_page: dict):
+        self.plan = plan_page
+        self.page_number: int = plan_page["page_number"]
+        self.base_filename: str = plan_page["base"]
+        self.items = [(c["key"], c["ms"]) for c in plan_page["chunks"]]
+        self.waits = [c["wait_ms"] for c in plan_page["chunks"]]   # Sota がチャンクごとに待つ時間
+        self.should_flip = plan_page["turn"] is not None
+        self.flip_duration_ms: int = plan_page["flip_duration_ms"]
+        self.motion: typing.Optional[typing.List[dict]] = plan_page["motion"]["keyframes"] if self.should_flip else None
+        gesture = plan_page.get("gesture")
+        self.gesture: typing.Optional[typing.List[dict]] = gesture["keyframes"] if gesture else None
+        self.preload: typing.Optional[asyncio.Future] = None
+        # Sota の時計での再生開始（最初のチャンクの STARTED）・終了（最後のチャンクの FINISHED）[ms]
+        self.robot_ms: typing.Dict[str, typing.Optional[int]] = {}
+
+    def planned_ms(self, event: str) -> typing.Optional[int]:
+        """timeline のイベント名に対応するプラン上の時刻 [ms]。"""
+        p = self.plan
+        planned = dict(
+            audio_start=p["audio_start_ms"],
+            audio_end=p["audio_end_ms"],
+        )
+        if self.should_flip:
+            planned.update(motion_start=p["motion"]["start_ms"], motion_end=p["motion"]["end_ms"],
+                           turn_start=p["turn"]["start_ms"], turn_end=p["turn"]["end_ms"])
+        if self.gesture is not None:
+            planned.update(gesture_start=p["gesture"]["start_ms"])
+        return planned.get(event)
+
+
+class ReadingSession(object):
+    """
+    プラン（session_plan.compile_plan / load_plan）1冊分の読み聞かせを実行する。
+
+        session = ReadingSession(rt, plan, notifier=SocketIONotifier(server_url))
+        asyncio.run(session.run())
+
+    timeline には (開始からの秒数, ページ番号, イベント名) が記録される。
+    """
+
+    def __init__(self, rt, plan: dict, notifier: typing.Optional["Notifier"] = None,
+                 preload_horizon_sec: typing.Optional[float] = None, resident_timeout: float = 120.0,
+                 start_page: typing.Optional[int] = None, startup_wait_sec: typing.Optional[float] = None,
+                 checkpoint_path: typing.Optional[str] = None, preload_worker=None):
+        """
+        preload_horizon_sec: 先読みスケジューラが Sota 上に置いておく音声の長さ [s]（省略時はプランの値。
+                             プランの先読み時刻がないページにだけ使う）
+        resident_timeout: ページの音声の保存を待つ上限（プランの再生開始時刻を過ぎてから）[s]
+        start_page: このページ番号から読み始める（ブラウザは turn.js の page() で直接そのページを表示する）
+        startup_wait_sec: 開始前の待ち時間（省略時はプランの値。再開時は 0 にすると待たずに始まる）
+        checkpoint_path: 読み終えたページごとに進み具合を書き出すファイル（load_checkpoint で読む。最初から読むときは消す）
+        preload_worker: 複数台で共有する先読みの送信スレッド（preload_scheduler.PreloadWorker。run_sessions 参照）
+        """
+        self.rt = rt
+        self.plan = plan
+        self.book_id: str = plan["book_id"]
+        self.cache_dir: str = plan["cache_dir"]
+        self.notifier = notifier
+        self.flip_lead_ms: int = plan["flip_lead_ms"]
+        self.startup_wait_sec = plan["startup_wait_ms"] / 1000.0 if startup_wait_sec is None else startup_wait_sec
+        self.turn_at_motion_half: bool = plan["turn_at_motion_half"]
+        self.preload_horizon_sec = (plan["preload_horizon_ms"] / 1000.0 if preload_horizon_sec is None
+                                    else preload_horizon_sec)
+        self.resident_timeout = resident_timeout
+        self.checkpoint_path = checkpoint_path
+        self.preload_worker = preload_worker
+        self.start_page = start_page
+        self.pages = [PageTask(p) for p in plan["pages"]]
+        if start_page is not None:
+            if start_page not in [p.page_number for p in self.pages]:
+                raise RuntimeError(f"page {start_page} is not in the plan")
+            self.pages = [p for p in self.pages if p.page_number >= start_page]
+        # 途中から始める場合・待ち時間を変えた場合は、プランの時刻をこの分だけずらして比べる
+        self._plan_offset_ms = (self.pages[0].plan["audio_start_ms"] - int(self.startup_wait_sec * 1000)
+                                if self.pages else 0)
+        self.timeline: typing.List[typing.Tuple[float, typing.Optional[int], str]] = []
+        self.scheduler = None
+        self._by_number = {p.page_number: p for p in self.pages}
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._t0 = 0.0
+
+    @property
+    def planned_total_sec(self) -> float:
+        return (self.plan["total_ms"] - self._plan_offset_ms) / 1000.0
+
+    @property
+    def t0(self) -> float:
+        """開始時刻（イベントループの時計。既定のループでは time.monotonic()）。timeline はここからの秒数。"""
+        return self._t0
+
+    def drift(self) -> typing.List[typing.Tuple[int, str, float]]:
+        """(ページ番号, イベント名, 実際の時刻 − プランの時刻 [s]) の一覧。"""
+        result = []
+        for t, page_number, event in self.timeline:
+            page = self._by_number.get(page_number)
+            planned = page.planned_ms(event) if page is not None else None
+            if planned is not None:
+                result.append((page_number, event, t - (planned - self._plan_offset_ms) / 1000.0))
+        return result
+
+    # --- 実行 ---
+    async def run(self) -> typing.List[typing.Tuple[float, typing.Optional[int], str]]:
+        self._loop = asyncio.get_running_loop()
+        self._t0 = self._loop.time()
+        self._mark(None, "session_start")
+        if self.start_page is None and self.checkpoint_path is not None:
+            # 最初から読む回では前の回のチェックポイントを消しておく
+            clear_checkpoint(self.checkpoint_path)
+        print(f"⏱ 予定の長さ: {self.planned_total_sec:.1f}秒（{len(self.pages)} ページ）")
+        try:
+            await self._startup()
+            for n, page in enumerate(self.pages):
+                # 次ページの保存待ちは現ページと同時に進める
+                if n + 1 < len(self.pages):
+                    nxt = self.pages[n + 1]
+                    nxt.preload = asyncio.ensure_future(self._wait_resident(nxt))
+                await self._run_page(page)
+        finally:
+            for page in self.pages:
+                if page.preload is not None and not page.preload.done():
+                    page.preload.cancel()
+            self._mark(None, "session_end")
+            # 再生・送信中に溜めたキャッシュの使用記録（LRU 用）をここで1回だけ書き出す
+            await self._call(self.rt.flush_cache_usage)
+        late = max((d for _, _, d in self.drift()), default=0.0)
+        print(f"⏱ 実際の長さ: {self.timeline[-1][0]:.1f}秒（予定 {self.planned_total_sec:.1f}秒, 最大の遅れ {late:.2f}秒）")
+        if self.notifier is not None:
+            self.notifier.latency.print_summary("めくり指示")
+        return self.timeline
+
+    async def _startup(self) -> None:
+        """
+        開始前の待ち時間と全ページの一括先読みを同時に行い、先読みスケジューラを起動する。
+        スケジューラは一括先読みが終わった（失敗した）時点で起動し、待ち時間中の先読み時刻のページから送り始める。
+        """
+        bases = [p.base_filename for p in self.pages]
+
+        async def bundle() -> None:
+            try:
+                bundled = await self._call(self.rt.preload_book_to_sota, bases, cache_dir=self.cache_dir,
+                                           book_id=self.book_id)
+            except Exception as e:
+                print(f"⚠️ 一括先読みに失敗しました。ページごとの先読みで続行します: {e}")
+                bundled = {}
+            kwargs = dict(worker=self.preload_worker) if self.preload_worker is not None else {}
+            # 各ページはプランの先読み時刻に送る（既定のイベントループの loop.time() は time.monotonic() と同じ時計）
+            schedule = {p.base_filename: p.plan["preload"] for p in self.pages}
+            origin = self._t0 - self._plan_offset_ms / 1000.0
+            self.scheduler = self.rt.start_preload_scheduler(bases, cache_dir=self.cache_dir, book_id=self.book_id,
+                                                             horizon_sec=self.preload_horizon_sec,
+                                                             schedule=schedule, origin=origin, **kwargs)
+            self.scheduler.mark_resident(bundled)
+
+        async def seek() -> None:
+            # 途中から始める場合は、めくりを繰り返さずにブラウザを読み始めるページへ移す
+            if self.start_page is not None and self.pages and self.notifier is not None:
+                if await self._call(self.notifier.seek_page, self.pages[0].page_number):
+                    print(f"⏩ ブラウザをページ {self.pages[0].page_number} へ移動しました。")
+
+        await asyncio.gather(bundle(), seek(), asyncio.sleep(self.startup_wait_sec))
+        self._mark(None, "startup_done")
+
+    async def _run_page(self, page: PageTask) -> None:
+        p = page.plan
+        print(f"\n=======================================================")
+        print(f"📖 Page {page.page_number} の読み聞かせを開始（予定 {p['audio_start_ms'] / 1000:.1f}秒）")
+        print(f"  感情: V={p['valence']:.4f}, I={p['intensity']:.4f}")
+        print(f"  テキスト: {p['text'].strip()}")
+        print(f"  ファイルコア: {self.book_id}_{page.base_filename}")
+        print(f"=======================================================")
+
+        resident = await (page.preload if page.preload is not None else self._wait_resident(page))
+        if not resident:
+            await self._upload_now(page)
+
+        lead = asyncio.Event()
+        started = self._loop.create_future()
+        tasks = [asyncio.ensure_future(self._audio(page, lead, started))]
+        if page.should_flip:
+            tasks.append(asyncio.ensure_future(self._flip(page, lead)))
+        if page.gesture is not None:
+            tasks.append(asyncio.ensure_future(self._gesture(page, started)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    # --- 各タスク ---
+    async def _wait_resident(self, page: PageTask) -> bool:
+        # 先のページはプランの先読み時刻まで送られないので、待ち時間はプランの再生開始時刻から数える
+        deadline_sec = (page.plan["preload"]["deadline_ms"] - self._plan_offset_ms) / 1000.0
+        until_deadline = max(0.0, deadline_sec - (self._loop.time() - self._t0))
+        ok = await self._call(self.scheduler.wait_resident, page.base_filename, until_deadline + self.resident_timeout)
+        self._mark(page.page_number, "resident" if ok else "not_resident")
+        return ok
+
+    async def _upload_now(self, page: PageTask) -> None:
+        """先読みが間に合わなかったページを、再生前にその場で送る（送れなくても再生を試みる）。"""
+        print(f"⚠️ Page {page.page_number} の先読みが間に合わなかったため、再生前に送信します。")
+        try:
+            await self._call(self.rt.preload_cached_speech_to_sota, page.base_filename, cache_dir=self.cache_dir,
+                             book_id=self.book_id)
+        except Exception as e:
+            print(f"⚠️ Page {page.page_number} の送信に失敗しました: {e}")
+            return
+        self.scheduler.mark_resident([page.base_filename])
+        self._mark(page.page_number, "uploaded")
+
+    async def _audio(self, page: PageTask, lead: asyncio.Event, started: asyncio.Future) -> None:
+        """started: 最初のチャンクの再生が始まったら True（再生されずに終わったら False）になる。"""
+        loop = self._loop
+        durations = page.waits
+        timer: typing.List[asyncio.TimerHandle] = []
+
+        def on_started(index: int) -> None:
+            if not started.done():
+                started.set_result(True)
+            if not page.should_flip:
+                return
+            # 発火点（全体の終わりの lead_ms 前）を含むチャンクが始まったら、残り時間からタイマーを掛ける
+            if lead.is_set() or timer:
+                return
+            remaining = sum(durations[index:])
+            if remaining - self.flip_lead_ms > durations[index]:
+                return
+            timer.append(loop.call_later(max(0.0, (remaining - self.flip_lead_ms) / 1000.0), lead.set))
+
+        def on_robot_event(event: dict) -> None:
+            self._record_playback(page, event)
+            if event["event"] == "STARTED":
+                on_started(event["index"])
+
+        def on_event(event: dict) -> None:
+            # 受信スレッドから呼ばれることがあるので、ループ上で処理する
+            loop.call_soon_threadsafe(on_robot_event, event)
+
+        self.scheduler.notify_playing(page.base_filename)
+        self._mark(page.page_number, "audio_start")
+        try:
+            if page.items:
+                await self._call(self.rt.play_keys_with_events, page.items, on_event=on_event)
+        except Exception as e:
+            # 1ページの再生に失敗しても読み聞かせ全体は止めない（めくって次のページへ進む）
+            print(f"⚠️ Page {page.page_number} の再生に失敗しました。次のページへ進みます: {e}")
+            self._mark(page.page_number, "audio_failed")
+        finally:
+            # イベントが届かなかった場合・音声がないページも、めくりは進める
+            for handle in timer:
+                handle.cancel()
+            lead.set()
+            if not started.done():
+                started.set_result(False)
+        self._mark(page.page_number, "audio_end")
+        self.scheduler.notify_finished(page.base_filename)
+        self._save_checkpoint(page)
+        print(f"  先読みバッファ: {self.scheduler.buffer_ahead_sec:.1f}秒")
+
+    async def _gesture(self, page: PageTask, started: asyncio.Future) -> None:
+        """再生が始まったら、ページ全体のジェスチャを1回の play_motion で送る（めくりモーションの前に終わる）。"""
+        if not await started:
+            return
+        self._mark(page.page_number, "gesture_start")
+        try:
+            await self._call(self.rt.play_motion, page.gesture)
+        except Exception as e:
+            # 身振りがなくても読み聞かせは続ける
+            print(f"⚠️ ジェスチャの送信に失敗しました: {e}")
+
+    async def _flip(self, page: PageTask, lead: asyncio.Event) -> None:
+        """めくりモーションとブラウザのめくり。モーションとめくりは並行して進む。"""
+        await lead.wait()
+        motion = page.motion
+        print(f'🤖 ページめくりモーションを開始します（めくり時間 {page.flip_duration_ms}ms, 片道 {motion[0]["Msec"]}ms）')
+        self._mark(page.page_number, "motion_start")
+        motion_task = asyncio.ensure_future(self._call(self.rt.play_motion, motion))
+        motion_task.add_done_callback(lambda _: self._mark(page.page_number, "motion_end"))
+        if self.turn_at_motion_half:
+            await asyncio.sleep(motion[0]["Msec"] / 1000.0)
+        else:
+            await motion_task
+        await self._turn(page)
+        await motion_task
+
+    async def _turn(self, page: PageTask) -> None:
+        print(f'📢 Flaskサーバーにページめくり通知を送信します。めくり速度: {page.flip_duration_ms}ms')
+        self._mark(page.page_number, "turn_start")
+        t0 = self._loop.time()
+        sent = False
+        turn_id = None
+        if self.notifier is not None:
+            turn_id = self.notifier.new_turn_id()
+            sent = await self._call(self.notifier.notify_flip, page.flip_duration_ms, turn_id)
+            if sent:
+                print('✅ Flaskサーバーへの通知に成功しました。')
+
+        # ブラウザのめくり完了を待つ（完了通知がなければ、めくり時間だけ待つ）
+        ack = None
+        if sent and turn_id is not None and getattr(self.notifier, "browsers", None) == 0:
+            print('⚠️ このセッションにはブラウザが接続していません。めくり完了は待たずに進みます。')
+        elif sent and turn_id is not None:
+            timeout = (2 * page.flip_duration_ms + TURN_ACK_MARGIN_MS) / 1000.0
+            ack = await self._call(self.notifier.wait_turned, turn_id, timeout)
+            if ack is None:
+                print(f'⚠️ ブラウザのめくり完了通知が {timeout:.1f}秒以内に届きませんでした。次のページへ進みます。')
+            else:
+                print(f'✅ ブラウザのめくり完了を確認しました（{self._loop.time() - t0:.2f}秒'
+                      f'{", めくりなし" if ack.get("skipped") else ""}）')
+        if ack is None:
+            await asyncio.sleep(max(0.0, t0 + page.flip_duration_ms / 1000.0 - self._loop.time()))
+        self._mark(page.page_number, "turn_end")
+
+    # --- 補助 ---
+    async def _call(self, func, *args, **kwargs):
+        """ブロッキング処理をスレッドプールで実行する（コルーチン関数ならそのまま待つ。reading_sim.py のスタンドイン用）。"""
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args, **kwargs)
+        return await self._loop.run_in_executor(None, lambda: func(*args, **kwargs))
+
+    def _save_checkpoint(self, page: PageTask) -> None:
+        """読み終えたページの次のページを書き出す（途中で止まったら、そのページから再開する）。"""
+        if self.checkpoint_path is None:
+            return
+        numbers = [p.page_number for p in self.pages]
+        idx = numbers.index(page.page_number)
+        save_checkpoint(self.checkpoint_path, dict(
+            book_id=self.book_id,
+            cache_dir=self.cache_dir,
+            last_read_page=page.page_number,
+            next_page=numbers[idx + 1] if idx + 1 < len(numbers) else None,
+            saved_at=time.time(),
+        ))
+
+    def _record_playback(self, page: PageTask, event: dict) -> None:
+        """
+        Sota からのイベントのうち、ページの最初のチャンクの STARTED と最後のチャンクの FINISHED を記録する。
+        timeline には受信時刻で play_started / play_finished を、page.robot_ms には Sota の時計での時刻を入れる。
+        """
+        if event["event"] == "STARTED" and event["index"] == 0:
+            name = "play_started"
+        elif event["event"] == "FINISHED" and event["index"] == len(page.items) - 1:
+            name = "play_finished"
+        else:
+            return
+        self.timeline.append((event["host_time"] - self._t0, page.page_number, name))
+        page.robot_ms[name] = event.get("robot_ms")
+
+    def _mark(self, page_number: typing.Optional[int], event: str) -> None:
+        self.timeline.append((self._loop.time() - self._t0, page_number, event))
+
+
+async def run_sessions(sessions: typing.List[ReadingSession]) -> typing.List[typing.Any]:
+    """
+    複数台（ロボット + ブラウザの組）の読み聞かせを1つのイベントループで同時に実行する。
+    1台が失敗しても他の台は続ける。返り値はセッションごとの timeline（失敗した台は例外）。
+    先読みを共有するには、各セッションに同じ preload_worker を渡しておくこと。
+    """
+    loop = asyncio.get_running_loop()
+    # 既定のスレッドプール（CPU数 + 4）では台数が増えると再生・めくりの呼び出しが待たされる
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+        max_workers=THREADS_PER_SESSION * max(1, len(sessions)), thread_name_prefix="reading"))
+    results = await asyncio.gather(*(s.run() for s in sessions), return_exceptions=True)
+    for session, result in zip(sessions, results):
+        if isinstance(result, BaseException):
+            print(f"❌ {session.book_id} の読み聞かせが中断しました: {result}")
+    return results
+
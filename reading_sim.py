@@ -0,0 +1,400 @@
+# reading_sim.py: 読み聞かせ1回分を仮想時計で実行するシミュレーションモード
+#
+# ReadingSession（reading_session.py）はそのままに、周りを仮想時計上のスタンドインに置き換える。
+#   SimRobot   : RobotTools（AudioAckServer の保存・再生、モーションサーバの play_motion）
+#   SimScheduler: 先読みスケジューラ（一括先読みに入らなかったページを順に送る）
+#   SimBrowser : Flask/SocketIO サーバーとブラウザ（めくり指示 → turn.js のめくり → page_turned）
+# 待ち時間はすべて VirtualClockLoop の仮想時刻で進むので、1冊分（数分〜十数分）が1秒もかからずに終わり、
+# timeline には実機と同じ依存関係で計算した正確な時刻が残る。
+#
+# 使い方:
+#   python reading_sim.py --book suhu --variant normal --condition 1
+#   python reading_sim.py --plan suhu_1_speech_cache/_plan_suhu.json --bandwidth-mbps 2 --no-bundle
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import selectors
+import time
+import typing
+
+from audio_protocol import MIN_WAIT_MS, SAFETY_MS, play_wait_ms
+from latency_log import LatencyLog
+from reading_session import ReadingSession
+
+
+# ==============================================================================
+# 1. 仮想時計のイベントループ
+# ==============================================================================
+class _VirtualSelector(selectors.DefaultSelector):
+    """タイマー待ちの select(timeout) を実際には待たず、仮想時刻を timeout だけ進める。"""
+
+    def __init__(self, loop: "VirtualClockLoop"):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: typing.Optional[float] = None):
+        if timeout is not None and timeout > 0:
+            self._loop.advance(timeout)
+            timeout = 0
+        # タイマーがないとき（timeout=None）は、スレッドからの通知などを実際に待つ
+        return super().select(timeout)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    loop.time() が仮想時刻を返すイベントループ。実行可能な処理がなくなると、次のタイマーまで時刻を飛ばす。
+    スタンドインはすべてコルーチンで待つこと（スレッドでの待ちは仮想時刻に反映されない）。
+    """
+
+    def __init__(self):
+        self.virtual_time = 0.0
+        super().__init__(_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+    def advance(self, sec: float) -> None:
+        self.virtual_time += sec
+
+
+def run_virtual(coro):
+    """コルーチンを仮想時計ループで最後まで実行する。"""
+    loop = VirtualClockLoop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+# ==============================================================================
+# 2. スタンドイン
+# ==============================================================================
+class SimRobot(object):
+    """
+    RobotTools のスタンドイン（ReadingSession が使うメソッドだけ）。ページの大きさ・再生時間はプランから取る。
+    bandwidth_bps: Sota への転送帯域 [bytes/s]（None で転送時間なし）
+    audio_latency_ms / motion_latency_ms: コマンドを送ってから Sota 側で動き出すまでの片道遅延 [ms]
+    """
+
+    def __init__(self, plan: dict, bandwidth_bps: typing.Optional[float] = None, audio_latency_ms: float = 0.0,
+                 motion_latency_ms: float = 0.0, bundle: bool = True,
+                 min_wait_ms: int = MIN_WAIT_MS, safety_ms: int = SAFETY_MS):
+        """bundle: False なら一括先読み（BUNDLE）が失敗した場合を再現する（全ページを読み聞かせ中に送る）"""
+        self.bandwidth_bps = bandwidth_bps
+        self.audio_latency_ms = audio_latency_ms
+        self.motion_latency_ms = motion_latency_ms
+        self.bundle = bundle
+        self.min_wait_ms = min_wait_ms
+        self.safety_ms = safety_ms
+        self.pages = {p["base"]: p for p in plan["pages"]}
+        self.resident: typing.Set[str] = set()
+        self.events: typing.List[typing.Tuple[float, str, str]] = []
+        self.scheduler: typing.Optional[SimScheduler] = None
+        self._link = asyncio.Lock()  # 転送は1本ずつ
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    async def upload(self, bases: typing.Iterable[str]) -> int:
+        """ページの音声を Sota へ送る（帯域・遅延どおりに時間が進む）。返り値: 送信バイト数"""
+        pages = [self.pages[b] for b in bases if b in self.pages]
+        nbytes = sum(p["bytes"] for p in pages)
+        async with self._link:
+            await asyncio.sleep(self.audio_latency_ms / 1000.0)
+            if self.bandwidth_bps:
+                await asyncio.sleep(nbytes / self.bandwidth_bps)
+            for p in pages:
+                self.resident.update(c["key"] for c in p["chunks"])
+                self.events.append((self._now(), "put", p["base"]))
+        return nbytes
+
+    async def preload_book_to_sota(self, base_filenames: typing.List[str], cache_dir: str,
+                                   book_id: typing.Optional[str] = None) -> typing.Dict[str, typing.List[str]]:
+        if not self.bundle:
+            raise RuntimeError("bundle disabled (simulated failure)")
+        await self.upload(base_filenames)
+        return {b: [c["key"] for c in self.pages[b]["chunks"]] for b in base_filenames if b in self.pages}
+
+    async def preload_cached_speech_to_sota(self, base_filename: str, cache_dir: str,
+                                            book_id: typing.Optional[str] = None) -> typing.List[str]:
+        await self.upload([base_filename])
+        return [c["key"] for c in self.pages[base_filename]["chunks"]] if base_filename in self.pages else []
+
+    def start_preload_scheduler(self, base_filenames: typing.List[str], cache_dir: str,
+                                book_id: typing.Optional[str] = None, horizon_sec: float = 60.0,
+                                schedule: typing.Optional[typing.Dict[str, dict]] = None,
+                                origin: typing.Optional[float] = None, **kwargs) -> "SimScheduler":
+        self.scheduler = SimScheduler(self, base_filenames, schedule, origin)
+        return self.scheduler
+
+    def stop_preload_scheduler(self) -> None:
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    async def play_keys_with_events(self, items: typing.List[typing.Tuple[str, int]],
+                                    on_event: typing.Optional[typing.Callable[[dict], None]] = None,
+                                    timeout: float = 300.0) -> typing.List[dict]:
+        events: typing.List[dict] = []
+
+        def emit(status: str, index: int) -> None:
+            robot_ms = int(self._now() * 1000)
+            event = dict(event=status, index=index, key=items[index][0], robot_ms=robot_ms, host_time=self._now())
+            events.append(event)
+            if on_event is not None:
+                on_event(event)
+
+        await asyncio.sleep(self.audio_latency_ms / 1000.0)
+        for index, (key, duration_ms) in enumerate(items):
+            if key not in self.resident:
+                raise RuntimeError(f"unexpected response: NOFILE {index}")
+            self.events.append((self._now(), "play_start", key))
+            emit("STARTED", index)
+            await asyncio.sleep(play_wait_ms(duration_ms, self.min_wait_ms, self.safety_ms) / 1000.0)
+            self.events.append((self._now(), "play_end", key))
+            emit("FINISHED", index)
+        await asyncio.sleep(self.audio_latency_ms / 1000.0)
+        return events
+
+    def flush_cache_usage(self) -> None:
+        pass
+
+    async def play_motion(self, motion: typing.List[dict]) -> None:
+        await asyncio.sleep(self.motion_latency_ms / 1000.0)
+        self.events.append((self._now(), "motion_start", f"{len(motion)} keyframes"))
+        await asyncio.sleep(sum(k["Msec"] for k in motion) / 1000.0)
+        self.events.append((self._now(), "motion_end", ""))
+
+
+class SimScheduler(object):
+    """
+    PreloadScheduler のスタンドイン。Sota 上にないページを再生順に1ページずつ送る（保存待ちのページを優先）。
+    schedule / origin を渡すと、各ページはプランの preload.start_ms（仮想時計）になるまで送らない。
+    """
+
+    def __init__(self, robot: SimRobot, base_filenames: typing.List[str],
+                 schedule: typing.Optional[typing.Dict[str, dict]] = None, origin: typing.Optional[float] = None):
+        self._robot = robot
+        self._schedule = schedule if origin is not None else {}
+        self._origin = origin
+        self._order = [b for b in base_filenames if b in robot.pages]
+        self._done = {b: asyncio.Event() for b in self._order}
+        self._urgent: typing.Optional[str] = None
+        self._wakeup = asyncio.Event()
+        self._position = 0
+        self._task = asyncio.ensure_future(self._run())
+
+    def mark_resident(self, base_filenames: typing.Iterable[str]) -> None:
+        for base in base_filenames:
+            if base in self._done:
+                self._done[base].set()
+        self._wakeup.set()
+
+    def notify_playing(self, base_filename: str) -> None:
+        if base_filename in self._done:
+            self._position = self._order.index(base_filename)
+
+    def notify_finished(self, base_filename: str) -> None:
+        if base_filename in self._done:
+            self._position = self._order.index(base_filename) + 1
+
+    async def wait_resident(self, base_filename: str, timeout: typing.Optional[float] = None) -> bool:
+        event = self._done.get(base_filename)
+        if event is None:
+            return False
+        preload = self._schedule.get(base_filename)
+        due = preload is None or asyncio.get_running_loop().time() >= self._origin + preload["start_ms"] / 1000.0
+        if not event.is_set() and due:
+            self._urgent = base_filename
+            self._wakeup.set()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @property
+    def buffer_ahead_sec(self) -> float:
+        ahead = 0.0
+        for base in self._order[self._position:]:
+            if not self._done[base].is_set():
+                break
+            page = self._robot.pages[base]
+            ahead += (page["audio_end_ms"] - page["audio_start_ms"]) / 1000.0
+        return ahead
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            pending = [b for b in self._order if not self._done[b].is_set()]
+            if not pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            base = self._urgent if self._urgent in pending else pending[0]
+            preload = self._schedule.get(base)
+            if base != self._urgent and preload is not None:
+                delay = self._origin + preload["start_ms"] / 1000.0 - asyncio.get_running_loop().time()
+                if delay > 0:
+                    # 送信開始時刻まで待つ（その間に保存待ちのページが出たら起きる）
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+            await self._robot.upload([base])
+            self._done[base].set()
+            if self._urgent == base:
+                self._urgent = None
+
+
+class SimBrowser(object):
+    """
+    Flask/SocketIO サーバーとブラウザのスタンドイン（control_channel の通知クラスと同じメソッド）。
+    めくりは1つずつ行い、前のめくりの途中で届いた指示は完了後に始める（index.html の pendingTurnData と同じ）。
+    command_latency_ms: 指示を送ってからブラウザでめくりが始まるまで [ms]
+    ack_latency_ms: めくり完了から page_turned が読み上げ側に届くまで [ms]
+    turn_overhead_ms: turn.js のめくりが flip_duration より長くかかる分 [ms]
+    browsers: セッションに接続しているブラウザの数（0 ならめくり指示は誰にも届かず、完了通知も来ない）
+    """
+
+    def __init__(self, command_latency_ms: float = 0.0, ack_latency_ms: float = 0.0, turn_overhead_ms: float = 0.0,
+                 browsers: int = 1):
+        self.browsers = browsers
+        self.command_latency_ms = command_latency_ms
+        self.ack_latency_ms = ack_latency_ms
+        self.turn_overhead_ms = turn_overhead_ms
+        self.latency = LatencyLog()
+        self.events: typing.List[typing.Tuple[float, str, str]] = []
+        self.page = 1
+        self._turn_ids = (str(n) for n in itertools.count(1))
+        self._busy_until = 0.0
+        self._acked_at: typing.Dict[str, float] = {}
+        self._sent_at: typing.Dict[str, float] = {}
+
+    def new_turn_id(self) -> str:
+        return next(self._turn_ids)
+
+    async def notify_flip(self, flip_duration_ms: int, turn_id: typing.Optional[str] = None) -> bool:
+        now = asyncio.get_running_loop().time()
+        if self.browsers == 0:
+            await asyncio.sleep(2 * self.command_latency_ms / 1000.0)
+            return True
+        start = max(now + self.command_latency_ms / 1000.0, self._busy_until)
+        self._busy_until = start + (flip_duration_ms + self.turn_overhead_ms) / 1000.0
+        self.page += 2
+        self.events.append((start, "turn_start", str(turn_id)))
+        self.events.append((self._busy_until, "turn_end", str(turn_id)))
+        if turn_id is not None:
+            self._acked_at[turn_id] = self._busy_until + self.ack_latency_ms / 1000.0
+            self._sent_at[turn_id] = now
+        # SocketIO の受付応答（往復）
+        await asyncio.sleep(2 * self.command_latency_ms / 1000.0)
+        self.latency.add('flip_command', 2 * self.command_latency_ms)
+        return True
+
+    async def wait_turned(self, turn_id: str, timeout: float) -> typing.Optional[dict]:
+        loop = asyncio.get_running_loop()
+        acked_at = self._acked_at.pop(turn_id, None)
+        if acked_at is None or acked_at - loop.time() > timeout:
+            await asyncio.sleep(timeout)
+            return None
+        await asyncio.sleep(max(0.0, acked_at - loop.time()))
+        self.latency.add('flip_turned', (loop.time() - self._sent_at.pop(turn_id)) * 1000.0)
+        return dict(turn_id=turn_id, page=self.page, skipped=False)
+
+    async def seek_page(self, page_number: int) -> bool:
+        await asyncio.sleep(2 * self.command_latency_ms / 1000.0)
+        self.page = page_number
+        self.events.append((asyncio.get_running_loop().time(), "seek", str(page_number)))
+        return True
+
+    async def notify_finished(self, survey_url: str) -> bool:
+        self.events.append((asyncio.get_running_loop().time(), "survey", survey_url))
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+# ==============================================================================
+# 3. 実行
+# ==============================================================================
+def run_simulation(plan: dict, robot: typing.Optional[SimRobot] = None, browser: typing.Optional[SimBrowser] = None,
+                   quiet: bool = True, **session_kwargs) -> ReadingSession:
+    """
+    プランを仮想時計で実行し、実行済みの ReadingSession を返す（timeline / drift() を参照）。
+    quiet: ReadingSession の表示を抑える
+    """
+    robot = robot if robot is not None else SimRobot(plan)
+    browser = browser if browser is not None else SimBrowser()
+    session = ReadingSession(robot, plan, notifier=browser, **session_kwargs)
+
+    async def main() -> None:
+        try:
+            await session.run()
+            await browser.notify_finished(plan.get("survey_url", ""))
+        finally:
+            robot.stop_preload_scheduler()
+
+    out = io.StringIO() if quiet else None
+    with (contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext()):
+        run_virtual(main())
+    return session
+
+
+def print_timeline(session: ReadingSession) -> None:
+    planned = {(p, e): d for p, e, d in session.drift()}
+    for t, page_number, event in session.timeline:
+        drift = planned.get((page_number, event))
+        drift_str = f"  (予定との差 {drift * 1000:+.1f}ms)" if drift is not None else ""
+        print(f"  {t:9.3f}s  {'' if page_number is None else f'p{page_number:02d}':4s} {event}{drift_str}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="読み聞かせを仮想時計でシミュレーションする")
+    parser.add_argument("--plan", default=None, help="session_plan.py で書き出したプラン")
+    parser.add_argument("--book", default=None, help="絵本ID（--plan を省略したとき、キャッシュからプランを作る）")
+    parser.add_argument("--variant", default="normal")
+    parser.add_argument("--condition", default="1")
+    parser.add_argument("--bandwidth-mbps", type=float, default=None, help="Sota への転送帯域 [MB/s]")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="音声コマンドの片道遅延 [ms]")
+    parser.add_argument("--motion-latency-ms", type=float, default=0.0, help="モーションの開始遅延 [ms]")
+    parser.add_argument("--browser-latency-ms", type=float, default=0.0, help="めくり指示・完了通知の片道遅延 [ms]")
+    parser.add_argument("--no-bundle", action="store_true", help="一括先読みなし（読み聞かせ中に送る）")
+    parser.add_argument("--verbose", action="store_true", help="ReadingSession の表示をそのまま出す")
+    args = parser.parse_args()
+
+    if args.plan:
+        with open(args.plan, "r", encoding="utf-8") as f:
+            sim_plan = json.load(f)
+    elif args.book:
+        from robottools3 import RobotTools
+        from session_plan import compile_plan
+        from synth_planner import story_file_path, cache_dir_for
+        with open(story_file_path(args.book, args.variant), "r", encoding="utf-8") as f:
+            story = json.load(f)
+        sim_plan = compile_plan(RobotTools('0.0.0.0', 0), story, args.book,
+                                cache_dir_for(args.book, args.variant, args.condition))
+    else:
+        parser.error("--plan か --book を指定してください")
+
+    t0 = time.perf_counter()
+    sim = run_simulation(
+        sim_plan,
+        robot=SimRobot(sim_plan, bandwidth_bps=args.bandwidth_mbps * 1e6 if args.bandwidth_mbps else None,
+                       audio_latency_ms=args.latency_ms, motion_latency_ms=args.motion_latency_ms,
+                       bundle=not args.no_bundle),
+        browser=SimBrowser(command_latency_ms=args.browser_latency_ms, ack_latency_ms=args.browser_latency_ms),
+        quiet=not args.verbose,
+    )
+    elapsed = time.perf_counter() - t0
+    print_timeline(sim)
+    print(f"✅ シミュレーション完了: 仮想 {sim.timeline[-1][0]:.3f}秒"
+          f"（予定 {sim_plan['total_ms'] / 1000:.3f}秒）, 実時間 {elapsed * 1000:.0f}ms")
@@ -9,38 +9,135 @@ import random
 import textwrap 
 import re 
 import hashlib 
-from voicepeak_cli_min import synth 
+import shutil
+import threading
+import collections
+from voicepeak_cli_min import engine_params 
+from tts_engine import TTSEngine, get_engine
+from text_chunker import ChunkRegistry, chunk_text, normalize_text, MAX_CHARS
+from audio_session import AudioSession
+from preload_scheduler import PreloadScheduler, PreloadWorker
+import audio_protocol
+import audio_post
+from speech_cache import SpeechCacheManifest, manifest_lock, transfer_path, base_render_dir
 
 # ★ 修正: SPEECH_CACHE_DIR のグローバル定義は削除し、各関数で動的に扱う ★
 
+# 事前合成で使う話者（synth_planner の見積もりと一致させるためモジュール定数にする）
+DEFAULT_NARRATOR = "Japanese Female 1"
+
 class RobotTools(object):
-    def __init__(self, ip: str, port: int, audio_port: int = 30001, use_audio_ack: bool = False):
+    def __init__(self, ip: str, port: int, audio_port: int = 30001, use_audio_ack: bool = False,
+                 transfer_rate: typing.Optional[int] = audio_post.TRANSFER_RATE,
+                 tts_engine: typing.Optional[TTSEngine] = None,
+                 robot_cache_budget_bytes: typing.Optional[int] = 100_000_000):
         """
         ip/port: 既存のRobotToolsサーバ（通常 22222）への接続先。
         audio_port: Sota上で動かすACK付き音声サーバのポート（例: 30001）。
         use_audio_ack: True の場合、音声再生は audio_port 側へ送り、ACKを受け取るまで待機する。
+        transfer_rate: Sotaへ送るwavを「この周波数 / モノラル / 16bit」に変換してから送る（None で無変換）。
+        tts_engine: 音声合成エンジン（省略時は環境変数 TTS_ENGINE、既定は VOICEPEAK）。
+        robot_cache_budget_bytes: Sota 上（/dev/shm/tts_cache）に置く音声の合計の上限。超えたら再生済みのキーから削除する（None で無制限）。
         """
         self.__ip = ip
         self.__port = port
         self.__audio_port = audio_port
         self.__use_audio_ack = use_audio_ack
+        self.__transfer_rate = transfer_rate
+        self.__tts_engine = tts_engine if tts_engine is not None else get_engine()
+        self.__audio_session: typing.Optional[AudioSession] = None
+        self.__preload_scheduler: typing.Optional[PreloadScheduler] = None
+
+        # Sota 上の保存状況（LIST で同期し、PUT/DEL のたびに更新する）。None は未同期
+        self.__robot_cache_budget = robot_cache_budget_bytes
+        self.__robot_inventory: typing.Optional[typing.Dict[str, typing.Tuple[int, str]]] = None  # key -> (size, sha256)
+        self.__robot_played: "collections.OrderedDict[str, float]" = collections.OrderedDict()   # 再生済み（古い順）
+        self.__inventory_lock = threading.RLock()
+        self.__inventory_supported = True
+        self.__playseq_supported: typing.Optional[bool] = None   # None: 1コマンド1接続方式でまだ確かめていない
+        # キャッシュの使用記録（LRU 用）はここに溜めて flush_cache_usage() でまとめて書く
+        self.__pending_touch: typing.Dict[str, typing.Dict[str, float]] = {}   # cache_dir -> {path: 使用時刻}
+        self.__touch_lock = threading.Lock()
+
+    @property
+    def tts_engine(self) -> TTSEngine:
+        return self.__tts_engine
 
     def set_audio_ack_enabled(self, enabled: bool) -> None:
         """ACK付き音声再生を有効/無効にする。"""
         self.__use_audio_ack = bool(enabled)
 
+    # --- 常時接続セッション（AudioAckServer の SESSION モード） ---
+    def open_audio_session(self, heartbeat_sec: float = 5.0) -> AudioSession:
+        """
+        audio_port への長寿命接続を開く。開いている間は PUT/PLAYKEY/PLAY/BATCH がこの接続を使い、
+        コマンドごとの接続確立が不要になる（PUT は応答を待たずにパイプライン送信される）。
+        切断された場合は自動的に従来の1コマンド1接続方式に戻る。
+        """
+        self.close_audio_session()
+        self.__audio_session = AudioSession(self.__ip, self.__audio_port, heartbeat_sec=heartbeat_sec)
+        print(f"✅ [SESSION] {self.__ip}:{self.__audio_port} とのセッションを開始しました。")
+        return self.__audio_session
+
+    def close_audio_session(self) -> None:
+        if self.__audio_session is not None:
+            self.__audio_session.close()
+            self.__audio_session = None
+
+    def _active_session(self) -> typing.Optional[AudioSession]:
+        """生きているセッションがあれば返す（切断済みなら破棄して None）。"""
+        session = self.__audio_session
+        if session is not None and not session.alive:
+            print("⚠️ [SESSION] セッションが切断されています。1コマンド1接続方式に戻ります。")
+            self.__audio_session = None
+            session = None
+        return session
+
+    # --- 先読みスケジューラ ---
+    def start_preload_scheduler(self, base_filenames: typing.List[str], cache_dir: str,
+                                book_id: typing.Optional[str] = None, horizon_sec: float = 60.0,
+                                max_resident_bytes: typing.Optional[int] = None,
+                                worker: typing.Optional[PreloadWorker] = None,
+                                schedule: typing.Optional[typing.Dict[str, dict]] = None,
+                                origin: typing.Optional[float] = None) -> PreloadScheduler:
+        """
+        再生位置より horizon_sec 秒先までの音声を、回線速度を測りながらバックグラウンドで Sota に保存し続ける。
+        base_filenames は再生順のページ名。既存のスケジューラは止めてから作り直す。
+        worker: 複数台で共有する送信スレッド（複数台を同時に動かすとき。None ならこのロボット専用）
+        schedule / origin: プランの先読み時刻（ページごとの preload）と、プランの時刻 0 の time.monotonic()。
+                           渡すと各ページをプランの start_ms に送り始める（PreloadScheduler 参照）
+        """
+        self.stop_preload_scheduler()
+        self.__preload_scheduler = PreloadScheduler(self, base_filenames, cache_dir, book_id,
+                                                    horizon_sec=horizon_sec, max_resident_bytes=max_resident_bytes,
+                                                    worker=worker, schedule=schedule, origin=origin)
+        return self.__preload_scheduler
+
+    def stop_preload_scheduler(self) -> None:
+        if self.__preload_scheduler is not None:
+            self.__preload_scheduler.stop()
+            self.__preload_scheduler = None
+
+    @property
+    def preload_scheduler(self) -> typing.Optional[PreloadScheduler]:
+        return self.__preload_scheduler
+
+    @staticmethod
+    def _expect(status: str, expected: str) -> None:
+        if status != expected:
+            raise RuntimeError(f"unexpected response: {status!r}")
+
     # --- ヘルパー: キャッシュ用ファイル名生成 (cache_dir, book_id を追加) ---
     def _get_cache_path(self, text: str, valence: float, intensity: float, narrator: str, 
                         chunk_index: int, total_chunks: int, cache_dir: str, 
                         base_name: typing.Optional[str] = None, book_id: typing.Optional[str] = None,
-                        speed=100) -> str:
+                        speed=100, emotion_step: int = 1, pitch_step: int = 1) -> str:
         """
         ファイルパスを生成する。cache_dirを使用し、ファイル名にbook_idをプレフィックスとして付与する。
+        ハッシュは VOICEPEAK に実際に渡すパラメータ（narrator, happy, sad, pitch, speed と
+        クリーンアップ後のテキスト）から作るため、valence の微小な変化では再合成されない。
         """
-        # ハッシュ元の文字列を生成
-        unique_string = f"{text}|{valence}|{intensity}|{narrator}|{speed}"
-        # SHA256でハッシュ値を計算 (8文字に短縮)
-        hash_id = hashlib.sha256(unique_string.encode('utf-8')).hexdigest()[:8] 
+        hash_id = self._cache_hash(text, valence, intensity, narrator, speed, emotion_step, pitch_step)
         
         # ファイル名のコアに book_id を追加
         file_prefix = f"{book_id}_" if book_id else ""
@@ -64,6 +161,105 @@ class RobotTools(object):
         # 渡された cache_dir を使用
         return os.path.join(cache_dir, wav_filename)
 
+    def _cache_hash(self, text: str, valence: float, intensity: float, narrator: str,
+                    speed=100, emotion_step: int = 1, pitch_step: int = 1) -> str:
+        """キャッシュキー（8文字のハッシュ）。正規化テキストと実効パラメータだけから決まる。"""
+        # ハッシュ元の文字列を生成（生の valence / intensity ではなく実効パラメータを使う）
+        p = engine_params(valence, intensity, speed, emotion_step, pitch_step)
+        unique_string = f"{normalize_text(text)}|{narrator}|{p['happy']}|{p['sad']}|{p['pitch']}|{p['speed']}"
+        # VOICEPEAK 以外のエンジンの出力は別キーにする（代替エンジンの音声が本番キャッシュに混ざらないように）
+        if self.__tts_engine.cache_tag:
+            unique_string += f"|{self.__tts_engine.cache_tag}"
+        # SHA256でハッシュ値を計算 (8文字に短縮)
+        return hashlib.sha256(unique_string.encode('utf-8')).hexdigest()[:8]
+
+    # --- ヘルパー: 転送用wavの取得（なければ変換してキャッシュ） ---
+    def _get_transfer_file(self, wav_path: str, manifest: typing.Optional[SpeechCacheManifest] = None) -> str:
+        """
+        Sotaへ送る実ファイルのパスを返す。
+        transfer_rate が有効なら cache_dir/_tx<rate>/ に変換済みwavを作り（元より新しければ再利用）、そのパスを返す。
+        """
+        rate = self.__transfer_rate
+        if not rate or not audio_post.needs_transcode(wav_path, rate):
+            return wav_path
+
+        tx_path = transfer_path(wav_path, rate)
+        cache_dir = os.path.dirname(wav_path)
+        # 同じキャッシュを使う他の RobotTools（classroom.py の複数台）が同じファイルを同時に変換しないよう、
+        # 確認・変換・マニフェストの更新をキャッシュディレクトリのロック内で行う
+        with manifest_lock(cache_dir):
+            if os.path.exists(tx_path) and os.path.getmtime(tx_path) >= os.path.getmtime(wav_path):
+                return tx_path
+
+            os.makedirs(os.path.dirname(tx_path), exist_ok=True)
+            tx_bytes = audio_post.transcode_wav_file(wav_path, tx_path, rate=rate)
+
+            own_manifest = manifest is None
+            if own_manifest:
+                manifest = SpeechCacheManifest(cache_dir)
+            transfer = dict(manifest.get(wav_path).get("transfer", {}))
+            transfer[str(rate)] = {"bytes": tx_bytes}
+            manifest.update(wav_path, transfer=transfer)
+            if own_manifest:
+                manifest.save()
+        return tx_path
+
+    # --- prepare_transfer_cache (転送用wavの一括作成とサイズ報告) ---
+    def prepare_transfer_cache(self, cache_dir: str, book_id: typing.Optional[str] = None) -> typing.Dict[str, typing.Tuple[int, int]]:
+        """
+        キャッシュ内の全ページについて転送用wavを作成し、ページごとの送信バイト数を表示する。
+        - 返り値: {ページ名: (元のバイト数, 送信バイト数)}
+        """
+        manifest = SpeechCacheManifest(cache_dir)
+        file_prefix = f"{book_id}_" if book_id else ""
+        per_page: typing.Dict[str, typing.Tuple[int, int]] = {}
+
+        for filename in sorted(os.listdir(cache_dir)):
+            if not filename.endswith(".wav") or not filename.startswith(file_prefix):
+                continue
+            wav_path = os.path.join(cache_dir, filename)
+            try:
+                tx_path = self._get_transfer_file(wav_path, manifest)
+            except Exception as e:
+                print(f"【警告】転送用wavの作成に失敗しました ({filename}): {e}")
+                continue
+            # チャンク番号を除いたページ名で集計（例: suhu_page03_2 → suhu_page03）
+            page_name = re.sub(r"_\d+$", "", filename.split("__")[0])
+            src_total, tx_total = per_page.get(page_name, (0, 0))
+            per_page[page_name] = (src_total + os.path.getsize(wav_path), tx_total + os.path.getsize(tx_path))
+
+        manifest.save()
+        for page_name, (src_total, tx_total) in per_page.items():
+            print(f"  {page_name}: {src_total / 1e6:.2f}MB → {tx_total / 1e6:.2f}MB (送信)")
+        src_sum = sum(v[0] for v in per_page.values())
+        tx_sum = sum(v[1] for v in per_page.values())
+        print(f"✅ 転送用wav: 合計 {src_sum / 1e6:.2f}MB → {tx_sum / 1e6:.2f}MB ({len(per_page)} pages)")
+        return per_page
+
+    def _touch_cache(self, cache_dir: str, paths: typing.List[str]) -> None:
+        """
+        キャッシュwavの使用時刻をメモリに記録する（cache_gc.py の LRU 退避用）。
+        送信・再生の経路でマニフェストを読み書きしないよう、書き出しは flush_cache_usage() でまとめて行う。
+        """
+        now = time.time()
+        with self.__touch_lock:
+            pending = self.__pending_touch.setdefault(cache_dir, {})
+            for path in paths:
+                pending[path] = now
+
+    def flush_cache_usage(self) -> None:
+        """溜めておいたキャッシュの使用記録をマニフェストに書き出す（読み聞かせ1回の終わりに呼ぶ）。"""
+        with self.__touch_lock:
+            pending, self.__pending_touch = self.__pending_touch, {}
+        for cache_dir, used in pending.items():
+            try:
+                manifest = SpeechCacheManifest(cache_dir)
+                for path, used_at in used.items():
+                    manifest.touch([path], now=used_at)
+                manifest.save()
+            except OSError as e:
+                print(f"【警告】キャッシュの使用記録に失敗しました: {e}")
+
     # --- ヘルパー: キャッシュファイルの検索とソート (cache_dir, book_id を追加) ---
     def _get_cached_chunk_files(self, base_prefix: str, cache_dir: str, book_id: typing.Optional[str] = None) -> typing.List[str]:
         """
@@ -122,10 +318,11 @@ class RobotTools(object):
         if not chunk_files:
             print(f"【エラー】'{book_id}_{base_filename}' に対応するキャッシュファイルが'{cache_dir}'に見つかりません。")
             return 0.0
+        self._touch_cache(cache_dir, chunk_files)
 
         # ========== ACK(BATCH)方式 ==========
         if self.__use_audio_ack:
-            items: typing.List[typing.Tuple[int, bytes]] = []  # (duration_ms, wav_bytes)
+            items: typing.List[typing.Tuple[int, audio_protocol.FileBody]] = []  # (duration_ms, wav)
             per_file_info: typing.List[typing.Tuple[str, float, int]] = []  # (display_name, sec, ms)
 
             for wav_filename in chunk_files:
@@ -134,12 +331,12 @@ class RobotTools(object):
                     continue
 
                 try:
-                    # wavバイト列
-                    with open(wav_filename, "rb") as f:
-                        wav_bytes = f.read()
+                    # 転送用フォーマットがあればそちらを送る（読み込まずに送信時にファイルから直接流す）
+                    send_path = self._get_transfer_file(wav_filename)
+                    wav_body = audio_protocol.FileBody(send_path)
 
                     # duration算出（ms）
-                    with wave.open(wav_filename, "rb") as wf:
+                    with wave.open(send_path, "rb") as wf:
                         fr = wf.getframerate()
                         nf = wf.getnframes()
                         sec = (nf / fr) if fr > 0 else 0.0
@@ -149,7 +346,7 @@ class RobotTools(object):
                     if book_id:
                         display_name = display_name.replace(f"{book_id}_", "")
 
-                    items.append((duration_ms, wav_bytes))
+                    items.append((duration_ms, wav_body))
                     per_file_info.append((display_name, sec, duration_ms))
                     total_duration += sec
 
@@ -165,9 +362,9 @@ class RobotTools(object):
             print(f"▶ [ACK-BATCH] {len(items)} files will be played continuously.")
             # まとめて再生（最後まで終わったらACKが返る）
             if len(items) == 1:
-                duration_ms, wav_bytes = items[0]
+                duration_ms, wav_body = items[0]
                 print("▶ [ACK] single file (PLAY) mode.")
-                self.play_wav_data_ack(wav_bytes, duration_ms=duration_ms)
+                self.play_wav_data_ack(wav_body, duration_ms=duration_ms)
             else:
                 print(f"▶ [ACK-BATCH] {len(items)} files will be played continuously.")
                 self.play_wav_batch_ack(items)
@@ -188,17 +385,16 @@ class RobotTools(object):
                 continue
 
             try:
-                with open(wav_filename, "rb") as f:
-                    full_wav_data = f.read()
+                send_path = self._get_transfer_file(wav_filename)
 
-                with wave.open(wav_filename, "rb") as wf:
+                with wave.open(send_path, "rb") as wf:
                     frame_rate = wf.getframerate()
                     num_frames = wf.getnframes()
                     audio_duration = num_frames / frame_rate if frame_rate > 0 else 0.0
 
                 # RobotToolsサーバへ送信（従来）
                 t0 = time.monotonic()
-                self.play_wav_data(full_wav_data)
+                self.play_wav_file(send_path)
                 send_elapsed = time.monotonic() - t0
                 safety_margin = 0.25
                 time.sleep(audio_duration + send_elapsed + safety_margin)
@@ -231,42 +427,43 @@ class RobotTools(object):
                                 base_filename: typing.Optional[str] = None, 
                                 cache_dir: typing.Optional[str] = 'speech_cache',
                                 book_id: typing.Optional[str] = None,
-                                speed = 100) -> None:
+                                speed = 100,
+                                trim_silence: bool = True,
+                                head_ms: int = audio_post.DEFAULT_HEAD_MS,
+                                tail_ms: int = audio_post.DEFAULT_TAIL_MS,
+                                gap_ms: int = 120,
+                                stretch_from_base: bool = False,
+                                emotion_step: int = 1,
+                                pitch_step: int = 1,
+                                registry: typing.Optional[ChunkRegistry] = None) -> None:
         """
-        VOICEPEAK CLIを使用して音声を生成し、キャッシュに保存する。再生は行わない。
+        音声合成エンジン（既定: VOICEPEAK CLI）を使用して音声を生成し、キャッシュに保存する。再生は行わない。
+        trim_silence=True の場合、合成直後の各チャンクの先頭/末尾無音を head_ms / tail_ms まで詰める。
+        gap_ms: 複数チャンクを統合するときにチャンク間へ挿入する無音 [ms]。
+        stretch_from_base=True の場合、各チャンクは speed=100 で一度だけ合成して cache_dir/_base/ に保存し、
+        指定 speed の音声はそこからタイムストレッチ（WSOLA）で作る。speed を変えても再合成は走らない。
+        emotion_step / pitch_step: happy・sad / pitch を丸める刻み。大きくするほどキャッシュが再利用されやすい。
+        registry: 複数ページ・複数絵本をまとめて合成するときに共有する台帳。同一内容のチャンクは1回だけ合成する。
         """
         print(f"--- プリロード開始: テキストの音声合成を開始 ---")
-        narrator = "Japanese Female 1" 
+        narrator = DEFAULT_NARRATOR
         
-        # --- テキストを句読点で分割（say_text_with_emotion と同一ロジックを流用） ---
-        MAX_CHARS = 140 
-        segments = re.split(r'(?<=[。！？\n])', text)
-        text_chunks = []
-        current_chunk = ""
-        for segment in segments:
-            if not segment.strip():
-                continue
-            if len(current_chunk) + len(segment) > MAX_CHARS and current_chunk:
-                text_chunks.append(current_chunk.strip())
-                current_chunk = segment
-            else:
-                current_chunk += segment
-        if current_chunk:
-            if len(current_chunk) > MAX_CHARS:
-                 temp_splits = [current_chunk[i:i + MAX_CHARS] for i in range(0, len(current_chunk), MAX_CHARS)]
-                 text_chunks.extend(temp_splits)
-            else:
-                 text_chunks.append(current_chunk.strip())
-        # -----------------------------------------------------------------
+        # --- テキストを正規化してから文単位でチャンク分割（エンジン呼び出し回数が最小になるように詰める） ---
+        text_chunks = chunk_text(text, MAX_CHARS)
 
         total_chunks = len(text_chunks) 
         
         # キャッシュディレクトリが存在しない場合は作成
         os.makedirs(cache_dir, exist_ok=True) 
+        manifest = SpeechCacheManifest(cache_dir)
+        trim_params = dict(head_ms=head_ms, tail_ms=tail_ms, threshold_db=audio_post.DEFAULT_THRESHOLD_DB)
+        chunk_wavs: typing.List[str] = []
 
         for i, chunk in enumerate(text_chunks):
             # 1. キャッシュファイルのフルパスを決定
-            wav_filename = self._get_cache_path(chunk, valence, intensity, narrator, i, total_chunks, cache_dir, base_name=base_filename, book_id=book_id, speed=speed)
+            wav_filename = self._get_cache_path(chunk, valence, intensity, narrator, i, total_chunks, cache_dir, base_name=base_filename, book_id=book_id, speed=speed,
+                                                emotion_step=emotion_step, pitch_step=pitch_step)
+            chunk_wavs.append(wav_filename)
             
             # 2. ファイルが存在する場合はスキップ（キャッシュヒット）
             if os.path.exists(wav_filename):
@@ -275,21 +472,71 @@ class RobotTools(object):
                  
             # 3. ファイルが存在しない場合は合成を実行
             try:
-                # テキストクリーンアップ
-                clean_chunk = re.sub(r'　+', ' ', chunk).strip() 
-                clean_chunk = clean_chunk.replace('・・・・・・', '...').replace('・・・', '...')
-                clean_chunk = re.sub(r'\s+', ' ', clean_chunk) 
-                
-                synth(
-                    text=clean_chunk, # クリーンアップ後のテキストを使用
-                    narrator=narrator, 
-                    valence=valence, 
-                    intensity=intensity, 
-                    out_path=wav_filename,
-                    speed=speed,
-                )
-                display_name = os.path.basename(wav_filename).split('__')[0]
-                print(f"  チャンク {i+1}/{total_chunks} の合成完了 (ファイル名: {display_name}.wav)")
+                # テキストクリーンアップ（chunk_text で正規化済み）
+                clean_chunk = chunk
+
+                # 話速変換モードでは speed=100 の基準レンダリングを合成対象にする
+                if stretch_from_base:
+                    render_path = self._get_cache_path(chunk, valence, intensity, narrator, i, total_chunks,
+                                                       base_render_dir(cache_dir), base_name=base_filename,
+                                                       book_id=book_id, speed=audio_post.BASE_SPEED,
+                                                       emotion_step=emotion_step, pitch_step=pitch_step)
+                    render_speed = audio_post.BASE_SPEED
+                    os.makedirs(os.path.dirname(render_path), exist_ok=True)
+                else:
+                    render_path = wav_filename
+                    render_speed = speed
+
+                render_key = self._cache_hash(chunk, valence, intensity, narrator, render_speed, emotion_step, pitch_step)
+                dup_path = registry.lookup(render_key) if registry is not None and not os.path.exists(render_path) else None
+
+                if stretch_from_base and os.path.exists(render_path):
+                    print(f"  チャンク {i+1}/{total_chunks} の基準音声(speed={render_speed})はキャッシュに存在します。")
+                elif dup_path is not None:
+                    # 同じ実行内で同一内容のチャンクを合成済み → コピーして再利用（トリミング済み）
+                    span = registry.span(render_key)
+                    if span is None:
+                        shutil.copy2(dup_path, render_path)
+                    else:
+                        audio_post.extract_wav_file(dup_path, render_path, *span)
+                    print(f"  チャンク {i+1}/{total_chunks} は合成済みの同一チャンクを再利用 ({os.path.basename(dup_path)})")
+                else:
+                    self.__tts_engine.synth(
+                        text=clean_chunk, # クリーンアップ後のテキストを使用
+                        narrator=narrator, 
+                        valence=valence, 
+                        intensity=intensity, 
+                        out_path=render_path,
+                        speed=render_speed,
+                        emotion_step=emotion_step,
+                        pitch_step=pitch_step,
+                    )
+                    display_name = os.path.basename(render_path).split('__')[0]
+                    print(f"  チャンク {i+1}/{total_chunks} の合成完了 (ファイル名: {display_name}.wav)")
+
+                    # 合成直後に無音トリミング（統合前に行うことでチャンク間の無音も gap_ms に揃う）
+                    if trim_silence:
+                        stats = audio_post.postprocess_wav_file(render_path, head_ms=head_ms, tail_ms=tail_ms)
+                        print(f"    無音トリミング: {stats['before_ms']}ms → {stats['after_ms']}ms")
+
+                if registry is not None:
+                    registry.register(render_key, render_path)
+
+                if stretch_from_base:
+                    if int(speed) == audio_post.BASE_SPEED:
+                        shutil.copy2(render_path, wav_filename)
+                    else:
+                        t0 = time.monotonic()
+                        audio_post.stretch_wav_file(render_path, wav_filename, speed=int(speed))
+                        print(f"    話速変換: speed {audio_post.BASE_SPEED} → {int(speed)} ({(time.monotonic() - t0) * 1000:.0f}ms)")
+
+                entry = dict(duration_ms=self._calc_wav_duration_ms(wav_filename))
+                if trim_silence:
+                    entry["trim"] = trim_params
+                if stretch_from_base:
+                    entry["stretched_from"] = os.path.basename(render_path)
+                    entry["speed"] = int(speed)
+                manifest.update(wav_filename, **entry)
                 
             except Exception as e:
                 print(f"【エラー】音声合成失敗 (チャンク {i+1}): {e}")
@@ -302,33 +549,123 @@ class RobotTools(object):
                 chunk_paths: typing.List[str] = []
                 for ci, ctext in enumerate(text_chunks):
                     cp = self._get_cache_path(ctext, valence, intensity, narrator, ci, total_chunks, cache_dir,
-                                             base_name=base_filename, book_id=book_id, speed=speed)
+                                             base_name=base_filename, book_id=book_id, speed=speed,
+                                             emotion_step=emotion_step, pitch_step=pitch_step)
                     if not os.path.exists(cp):
                         raise FileNotFoundError(f"結合対象のチャンクファイルが見つかりません: {cp}")
                     chunk_paths.append(cp)
 
                 # 統合後のwav（チャンク番号なし）
                 merged_path = self._get_cache_path(text, valence, intensity, narrator, 0, 1, cache_dir,
-                                                   base_name=base_filename, book_id=book_id, speed=speed)
+                                                   base_name=base_filename, book_id=book_id, speed=speed,
+                                                   emotion_step=emotion_step, pitch_step=pitch_step)
 
                 # すでに統合ファイルが存在する場合はスキップ
                 if os.path.exists(merged_path):
                     print(f"  統合wavは既に存在します。結合をスキップ (ファイル: {os.path.basename(merged_path)})")
                 else:
-                    self._concat_wavs(chunk_paths, merged_path, silence_ms=120)
+                    self._concat_wavs(chunk_paths, merged_path, silence_ms=gap_ms)
+                    merged_entry = dict(duration_ms=self._calc_wav_duration_ms(merged_path))
+                    if trim_silence:
+                        merged_entry["trim"] = trim_params
+                    manifest.update(merged_path, **merged_entry)
                     print(f"  ✅ チャンクwavを統合して保存しました (ファイル: {os.path.basename(merged_path)})")
 
-                # 混在・重複再生を防ぐため、元チャンクを削除（必要ならコメントアウト）
+                # 台帳が参照している元チャンクは、統合wav内の位置で参照し直す
+                if registry is not None:
+                    for cp, span in zip(chunk_paths, self._concat_spans(chunk_paths, silence_ms=gap_ms)):
+                        registry.relocate(cp, merged_path, span)
+
+                # 混在・重複再生を防ぐため、元チャンクを削除（失敗時に残ったものは cache_gc.py で回収される）
                 for cp in chunk_paths:
                     try:
                         os.remove(cp)
-                    except Exception:
-                        pass
+                        manifest.remove(cp)
+                    except OSError as e:
+                        print(f"【警告】統合済みチャンクの削除に失敗しました ({os.path.basename(cp)}): {e}")
 
             except Exception as e:
                 print(f"【警告】チャンクwavの統合に失敗しました: {e}")
 
+        # --- 古いキャッシュキー（パラメータ変更前）のwavを削除（同じページの音声が二重に再生されないように） ---
+        if base_filename:
+            current = chunk_wavs
+            if total_chunks > 1:
+                merged_path = self._get_cache_path(text, valence, intensity, narrator, 0, 1, cache_dir,
+                                                   base_name=base_filename, book_id=book_id, speed=speed,
+                                                   emotion_step=emotion_step, pitch_step=pitch_step)
+                if os.path.exists(merged_path):
+                    current = [merged_path]
+            if current and all(os.path.exists(p) for p in current):
+                self._prune_superseded(base_filename, cache_dir, book_id, current, manifest)
+
+        manifest.save()
         print(f"--- プリロード終了 ---")
+
+    def _prune_superseded(self, base_filename: str, cache_dir: str, book_id: typing.Optional[str],
+                          current: typing.List[str], manifest: SpeechCacheManifest) -> int:
+        """ページの現在のwav（current）以外で、同じページ名に一致するwav（と転送用wav）を削除する。"""
+        keep = {os.path.normpath(p) for p in current}
+        removed = 0
+        for path in self._get_cached_chunk_files(base_filename, cache_dir, book_id):
+            if os.path.normpath(path) in keep:
+                continue
+            for sub in os.listdir(cache_dir):
+                tx_path = os.path.join(cache_dir, sub, os.path.basename(path))
+                if sub.startswith("_tx") and os.path.exists(tx_path):
+                    os.remove(tx_path)
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"【警告】古いキャッシュの削除に失敗しました ({os.path.basename(path)}): {e}")
+                continue
+            manifest.remove(path)
+            removed += 1
+            print(f"  🧹 古いキャッシュを削除しました: {os.path.basename(path)}")
+        return removed
+
+    # --- postprocess_cached_speech (既存キャッシュの無音トリミング) ---
+    def postprocess_cached_speech(self, cache_dir: str, book_id: typing.Optional[str] = None,
+                                  head_ms: int = audio_post.DEFAULT_HEAD_MS,
+                                  tail_ms: int = audio_post.DEFAULT_TAIL_MS,
+                                  max_gap_ms: typing.Optional[int] = None,
+                                  threshold_db: float = audio_post.DEFAULT_THRESHOLD_DB) -> typing.Dict[str, dict]:
+        """
+        キャッシュ済みwavを再合成せずに後処理する（先頭/末尾無音のトリミング、任意でギャップ正規化）。
+        - max_gap_ms: 指定時、統合wav内の max_gap_ms を超える無音を max_gap_ms に縮める
+        - 同じパラメータで処理済みのファイルはスキップする（マニフェストで管理）
+        - 返り値: {ファイル名: {"before_ms", "after_ms", "dead_before_ms", "dead_after_ms"}}
+        """
+        manifest = SpeechCacheManifest(cache_dir)
+        trim_params = dict(head_ms=head_ms, tail_ms=tail_ms, threshold_db=threshold_db)
+        if max_gap_ms is not None:
+            trim_params["max_gap_ms"] = max_gap_ms
+        file_prefix = f"{book_id}_" if book_id else ""
+
+        results: typing.Dict[str, dict] = {}
+        for filename in sorted(os.listdir(cache_dir)):
+            if not filename.endswith(".wav") or not filename.startswith(file_prefix):
+                continue
+            path = os.path.join(cache_dir, filename)
+            if manifest.get(path).get("trim") == trim_params:
+                continue
+            try:
+                stats = audio_post.postprocess_wav_file(path, head_ms=head_ms, tail_ms=tail_ms,
+                                                        max_gap_ms=max_gap_ms, threshold_db=threshold_db)
+            except Exception as e:
+                print(f"【警告】後処理に失敗しました ({filename}): {e}")
+                continue
+            manifest.update(path, duration_ms=stats["after_ms"], trim=trim_params)
+            results[filename] = stats
+
+            display_name = filename.split("__")[0]
+            print(f"  {display_name}: 無音 {stats['dead_before_ms']}ms → {stats['dead_after_ms']}ms "
+                  f"(長さ {stats['before_ms']}ms → {stats['after_ms']}ms)")
+
+        manifest.save()
+        saved_ms = sum(r["before_ms"] - r["after_ms"] for r in results.values())
+        print(f"✅ 後処理完了: {len(results)} files, 合計 {saved_ms}ms の無音を削減しました。")
+        return results
     
     # --- ヘルパー: wavファイルの結合（同一フォーマット前提） ---
     def _concat_wavs(self, wav_paths: typing.List[str], out_path: str, silence_ms: int = 120) -> None:
@@ -366,6 +703,19 @@ class RobotTools(object):
                 if silence_bytes and i != len(wav_paths) - 1:
                     wout.writeframes(silence_bytes)
 
+    def _concat_spans(self, wav_paths: typing.List[str], silence_ms: int = 120) -> typing.List[typing.Tuple[int, int]]:
+        """_concat_wavs で結合したときの各wavの位置 [(開始フレーム, フレーム数)] を返す。"""
+        spans = []
+        pos = 0
+        for wp in wav_paths:
+            with wave.open(wp, "rb") as win:
+                if not spans:
+                    silence_frames = int(win.getframerate() * (silence_ms / 1000.0))
+                nframes = win.getnframes()
+            spans.append((pos, nframes))
+            pos += nframes + silence_frames
+        return spans
+
     # --- Sota通信メソッド ---
 
     def read_axes(self) -> dict: # ... (省略)
@@ -411,7 +761,13 @@ class RobotTools(object):
             self.__send(conn, 'play_wav'.encode('utf-8'))
             self.__send(conn, data)
             
-    def play_wav_data_ack(self, data: bytes, duration_ms: int, timeout: float = 120.0) -> None:
+    def play_wav_file(self, wav_path: str):
+        """WAVファイルを読み込まずに（sendfile で）Sotaに送信する"""
+        with self.__connect() as conn:
+            self.__send(conn, 'play_wav'.encode('utf-8'))
+            self.__send_file(conn, wav_path)
+
+    def play_wav_data_ack(self, data: audio_protocol.Body, duration_ms: int, timeout: float = 120.0) -> None:
         """
         プロトコル:
         - `PLAY\n`
@@ -423,28 +779,17 @@ class RobotTools(object):
         t0 = time.monotonic()
         print(f"▶ [ACK] send start: {len(data)} bytes, duration={duration_ms}ms to {self.__ip}:{self.__audio_port}")
 
-        with self.__connect_audio() as conn:
-            conn.settimeout(timeout)
-            conn.sendall(b"PLAY\n")
-            conn.sendall(int(duration_ms).to_bytes(4, "big", signed=True))
-            conn.sendall(len(data).to_bytes(4, "big"))
-            conn.sendall(data)
-
-            # ACK行（\nまで）を待つ
-            buf = b""
-            while not buf.endswith(b"\n"):
-                chunk = conn.recv(1)
-                if not chunk:
-                    raise RuntimeError("connection closed before ACK")
-                buf += chunk
+        session = self._active_session()
+        if session is not None:
+            self._expect(session.play(data, duration_ms).result(timeout), "ACK")
+            print(f"✅ [ACK] received after {time.monotonic() - t0:.2f}s (session)")
+            return
 
-        dt = time.monotonic() - t0
-        if buf.strip() != b"ACK":
-            raise RuntimeError(f"unexpected response: {buf!r}")
-        print(f"✅ [ACK] received after {dt:.2f}s")
+        self.__audio_request(audio_protocol.encode_play(data, duration_ms), b"ACK", timeout)
+        print(f"✅ [ACK] received after {time.monotonic() - t0:.2f}s")
 
 
-    def put_wav_cache(self, key: str, data: bytes, duration_ms: int, timeout: float = 120.0) -> None:
+    def put_wav_cache(self, key: str, data: audio_protocol.Body, duration_ms: int, timeout: float = 120.0) -> None:
         """
         Sota上(AudioAckServer)に wav を保存だけしておく（再生しない）。
 
@@ -458,24 +803,14 @@ class RobotTools(object):
         t0 = time.monotonic()
         print(f"▶ [PUT] send start: key={key}, {len(data)} bytes, duration={duration_ms}ms to {self.__ip}:{self.__audio_port}")
 
-        with self.__connect_audio() as conn:
-            conn.settimeout(timeout)
-            conn.sendall(f"PUT {key}\n".encode("utf-8"))
-            conn.sendall(int(duration_ms).to_bytes(4, "big", signed=True))
-            conn.sendall(len(data).to_bytes(4, "big"))
-            conn.sendall(data)
-
-            buf = b""
-            while not buf.endswith(b"\n"):
-                chunk = conn.recv(1)
-                if not chunk:
-                    raise RuntimeError("connection closed before OK")
-                buf += chunk
-
-        dt = time.monotonic() - t0
-        if buf.strip() != b"OK":
-            raise RuntimeError(f"unexpected response: {buf!r}")
-        print(f"✅ [PUT] done after {dt:.2f}s (key={key})")
+        session = self._active_session()
+        if session is not None:
+            self._expect(session.put(key, data, duration_ms).result(timeout), "OK")
+            print(f"✅ [PUT] done after {time.monotonic() - t0:.2f}s (key={key}, session)")
+            return
+
+        self.__audio_request(audio_protocol.encode_put(key, data, duration_ms), b"OK", timeout)
+        print(f"✅ [PUT] done after {time.monotonic() - t0:.2f}s (key={key})")
 
     def play_wav_key_ack(self, key: str, duration_ms: int, timeout: float = 300.0) -> None:
         """
@@ -489,44 +824,32 @@ class RobotTools(object):
         t0 = time.monotonic()
         print(f"▶ [PLAYKEY] send: key={key}, duration={duration_ms}ms to {self.__ip}:{self.__audio_port}")
 
-        with self.__connect_audio() as conn:
-            conn.settimeout(timeout)
-            conn.sendall(f"PLAYKEY {key}\n".encode("utf-8"))
-            conn.sendall(int(duration_ms).to_bytes(4, "big", signed=True))
-
-            buf = b""
-            while not buf.endswith(b"\n"):
-                chunk = conn.recv(1)
-                if not chunk:
-                    raise RuntimeError("connection closed before ACK")
-                buf += chunk
+        session = self._active_session()
+        if session is not None:
+            self._expect(session.play_key(key, duration_ms).result(timeout), "ACK")
+            self._mark_played(key)
+            print(f"✅ [PLAYKEY] ACK after {time.monotonic() - t0:.2f}s (key={key}, session)")
+            return
 
-        dt = time.monotonic() - t0
-        if buf.strip() != b"ACK":
-            raise RuntimeError(f"unexpected response: {buf!r}")
-        print(f"✅ [PLAYKEY] ACK after {dt:.2f}s (key={key})")
+        self.__audio_request(audio_protocol.encode_playkey(key, duration_ms), b"ACK", timeout)
+        self._mark_played(key)
+        print(f"✅ [PLAYKEY] ACK after {time.monotonic() - t0:.2f}s (key={key})")
 
 
     # ===========================
     # 先読み（Sota側へ保存）関連
     # ===========================
 
-    def preload_cached_speech_to_sota(
+    def _page_upload_items(
         self,
         base_filename: str,
         cache_dir: str,
         book_id: typing.Optional[str] = None,
         key_prefix: typing.Optional[str] = None,
-        timeout: float = 120.0,
-    ) -> typing.List[str]:
+    ) -> typing.List[typing.Tuple[str, int, audio_protocol.FileBody]]:
         """
-        事前合成キャッシュwav（1ページ分）を Sota 上の AudioAckServer に「保存だけ」する。
-        - 返り値: 保存したキーの順序リスト（再生順と一致）
-
-        キー命名:
-          key_prefix があればそれを使う（例: f"{book_id}_{base_filename}"）
-          なければ (book_id と base_filename) から自動生成する。
-          各wavに対して suffix "__{idx:03d}" を付ける。
+        1ページ分の保存キー・duration_ms・送信ファイル（転送用フォーマットがあればそちら）の一覧。
+        キー命名は preload_cached_speech_to_sota の説明を参照。キャッシュがなければ空リスト。
         """
         if book_id is None:
             # book_id 省略時は prefix を base_filename のみにする
@@ -536,25 +859,243 @@ class RobotTools(object):
             print(f"【先読み】キャッシュが見つからないためスキップ: book_id={book_id}, base={base_filename}")
             return []
 
+        self._touch_cache(cache_dir, chunk_files)
+
         if key_prefix is None:
             key_prefix = f"{book_id}_{base_filename}" if book_id else base_filename
 
-        saved_keys: typing.List[str] = []
+        items = []
         for idx, wav_path in enumerate(chunk_files):
-            # wavを読み込む
-            with open(wav_path, "rb") as f:
-                data = f.read()
-
+            send_path = self._get_transfer_file(wav_path)
             # 再生待機用の duration_ms を計算（Sota側はこれで待つ）
-            duration_ms = self._calc_wav_duration_ms(wav_path)
+            duration_ms = self._calc_wav_duration_ms(send_path)
+            items.append((f"{key_prefix}__{idx:03d}", duration_ms, audio_protocol.FileBody(send_path)))
+        return items
 
-            key = f"{key_prefix}__{idx:03d}"
-            self.put_wav_cache(key=key, data=data, duration_ms=duration_ms, timeout=timeout)
-            saved_keys.append(key)
+    def preload_cached_speech_to_sota(
+        self,
+        base_filename: str,
+        cache_dir: str,
+        book_id: typing.Optional[str] = None,
+        key_prefix: typing.Optional[str] = None,
+        timeout: float = 120.0,
+    ) -> typing.List[str]:
+        """
+        事前合成キャッシュwav（1ページ分）を Sota 上の AudioAckServer に「保存だけ」する。
+        - 返り値: 保存したキーの順序リスト（再生順と一致）
 
-        print(f"✅【先読み】Sotaへ保存完了: {key_prefix} ({len(saved_keys)} files)")
+        キー命名:
+          key_prefix があればそれを使う（例: f"{book_id}_{base_filename}"）
+          なければ (book_id と base_filename) から自動生成する。
+          各wavに対して suffix "__{idx:03d}" を付ける。
+        """
+        items = self._page_upload_items(base_filename, cache_dir, book_id, key_prefix)
+        if not items:
+            return []
+
+        sent_bytes = self._put_items(items, timeout)
+        saved_keys = [key for key, _, _ in items]
+        print(f"✅【先読み】Sotaへ保存完了: {base_filename} ({len(saved_keys)} files, {sent_bytes} bytes)")
         return saved_keys
 
+    # ===========================
+    # Sota 上の保存状況（HAS / LIST / DEL）
+    # ===========================
+
+    def robot_has(self, key: str, sha256: typing.Optional[str] = None, timeout: float = 10.0) -> bool:
+        """Sota 上に key が保存済みか（sha256 を渡した場合は内容も一致するか）。"""
+        session = self._active_session()
+        if session is not None:
+            return session.has(key, sha256).result(timeout) == "YES"
+        return self.__audio_call(audio_protocol.encode_has(key, sha256), timeout) == "YES"
+
+    def robot_delete(self, key: str, timeout: float = 10.0) -> bool:
+        """Sota 上の key を削除する。削除したら True（元からなければ False）。"""
+        session = self._active_session()
+        if session is not None:
+            status = session.delete(key).result(timeout)
+        else:
+            status = self.__audio_call(audio_protocol.encode_del(key), timeout)
+        if status not in ("OK", "NOFILE"):
+            raise RuntimeError(f"unexpected response: {status!r}")
+        with self.__inventory_lock:
+            if self.__robot_inventory is not None:
+                self.__robot_inventory.pop(key, None)
+            self.__robot_played.pop(key, None)
+        return status == "OK"
+
+    def robot_list(self, timeout: float = 30.0) -> typing.Dict[str, typing.Tuple[int, str]]:
+        """
+        Sota 上の保存済み wav の一覧 {key: (size, sha256)}。
+        プロトコル(LIST): `LIST\n` → `<件数>\n` + 1件1行 `<key> <size> <sha256>\n`（SESSION では使えない）
+        """
+        with self.__connect_audio() as conn:
+            conn.settimeout(timeout)
+            audio_protocol.send_frames(conn, audio_protocol.encode_line("LIST"))
+            reader = audio_protocol.FrameReader(conn)
+            head = reader.readline().decode("utf-8", "replace").strip()
+            if not head.isdigit():
+                raise RuntimeError(f"unexpected response: {head!r}")
+            inventory = {}
+            for _ in range(int(head)):
+                key, size, sha256 = reader.readline().decode("utf-8", "replace").split()
+                inventory[key] = (int(size), sha256)
+        return inventory
+
+    def sync_robot_inventory(self) -> typing.Optional[typing.Dict[str, typing.Tuple[int, str]]]:
+        """
+        LIST で Sota 上の保存状況を取り込む（以降の先読みは内容が一致するキーの再送を省く）。
+        前回までのセッションで残ったキーは「再生済み」として扱い、容量超過時の削除候補にする。
+        LIST に対応していないサーバなら None（再送の省略と削除は行わない）。
+        """
+        try:
+            inventory = self.robot_list()
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"⚠️ [INVENTORY] Sota 上の保存状況を取得できませんでした。毎回送信します: {e}")
+            with self.__inventory_lock:
+                self.__inventory_supported = False
+            return None
+        with self.__inventory_lock:
+            self.__robot_inventory = inventory
+            self.__robot_played = collections.OrderedDict((key, 0.0) for key in inventory)
+        total = sum(size for size, _ in inventory.values())
+        print(f"✅ [INVENTORY] Sota 上の保存済み音声: {len(inventory)} files, {total / 1e6:.1f}MB")
+        return inventory
+
+    def _mark_played(self, key: str) -> None:
+        with self.__inventory_lock:
+            self.__robot_played.pop(key, None)
+            self.__robot_played[key] = time.monotonic()
+
+    @staticmethod
+    def _body_sha256(data: audio_protocol.Body) -> str:
+        if isinstance(data, audio_protocol.FileBody):
+            return data.sha256()
+        return hashlib.sha256(data).hexdigest()
+
+    def _filter_uploaded(self, items: typing.List[typing.Tuple[str, int, audio_protocol.Body]]
+                         ) -> typing.List[typing.Tuple[str, int, audio_protocol.Body]]:
+        """Sota 上に同じ内容で保存済みのキーを除く。渡されたキーはこれから再生するので削除候補から外す。"""
+        with self.__inventory_lock:
+            if self.__robot_inventory is None and self.__inventory_supported:
+                self.sync_robot_inventory()
+            for key, _, _ in items:
+                self.__robot_played.pop(key, None)
+            if self.__robot_inventory is None:
+                return list(items)
+            todo = [(key, ms, data) for key, ms, data in items
+                    if self.__robot_inventory.get(key, (None, None))[1] != self._body_sha256(data)]
+        if len(todo) < len(items):
+            print(f"♻️ [INVENTORY] Sota 上に保存済みのため送信を省略: {len(items) - len(todo)}/{len(items)} files")
+        return todo
+
+    def _record_uploaded(self, items: typing.List[typing.Tuple[str, int, audio_protocol.Body]]) -> None:
+        """送信済みのキーを記録し、容量上限を超えていれば再生済みのキーを古い順に削除する。"""
+        with self.__inventory_lock:
+            if self.__robot_inventory is None:
+                return
+            for key, _, data in items:
+                self.__robot_inventory[key] = (len(data), self._body_sha256(data))
+            if self.__robot_cache_budget is None:
+                return
+            total = sum(size for size, _ in self.__robot_inventory.values())
+            victims = []
+            for key in list(self.__robot_played):
+                if total <= self.__robot_cache_budget:
+                    break
+                total -= self.__robot_inventory.get(key, (0, None))[0]
+                victims.append(key)
+        for key in victims:
+            try:
+                self.robot_delete(key)
+            except (OSError, RuntimeError) as e:
+                print(f"【警告】Sota 上の {key} を削除できませんでした: {e}")
+        if victims:
+            print(f"🧹 [INVENTORY] 容量上限のため再生済みの音声を削除: {len(victims)} files")
+
+    def _put_items(self, items: typing.List[typing.Tuple[str, int, audio_protocol.Body]], timeout: float = 120.0) -> int:
+        """(key, duration_ms, wav) を順に PUT する（Sota 上に同じ内容があれば省く）。返り値: 送信バイト数"""
+        items = self._filter_uploaded(items)
+        sent_bytes = 0
+        session = self._active_session()
+        pending = []
+        for key, duration_ms, data in items:
+            if session is not None:
+                # セッション中は応答を待たずに次のPUTを送る（最後にまとめてOKを確認）
+                pending.append((key, session.put(key, data, duration_ms)))
+            else:
+                self.put_wav_cache(key=key, data=data, duration_ms=duration_ms, timeout=timeout)
+            sent_bytes += len(data)
+
+        for key, fut in pending:
+            self._expect(fut.result(timeout), "OK")
+        self._record_uploaded(items)
+        return sent_bytes
+
+    def put_wav_bundle(self, items: typing.List[typing.Tuple[str, int, audio_protocol.Body]],
+                       timeout: float = 300.0) -> None:
+        """
+        複数の wav を1回の転送で Sota 上に保存する（再生しない）。
+
+        プロトコル(BUNDLE):
+        - `BUNDLE\n`
+        - 4byte big-endian: count
+        - (count回繰り返し)
+            - `<key>\n`
+            - 4byte big-endian: duration_ms
+            - 4byte big-endian: wav size
+            - wav bytes
+        - server -> `OK\n`（全て保存後）
+        """
+        if not items:
+            return
+        if len(items) > audio_protocol.MAX_BUNDLE_ITEMS:
+            raise RuntimeError(f"too many bundle items: {len(items)} > {audio_protocol.MAX_BUNDLE_ITEMS}")
+
+        t0 = time.monotonic()
+        total_bytes = sum(len(data) for _, _, data in items)
+        print(f"▶ [BUNDLE] send start: files={len(items)}, total_bytes={total_bytes} to {self.__ip}:{self.__audio_port}")
+
+        session = self._active_session()
+        if session is not None:
+            self._expect(session.bundle(items).result(timeout), "OK")
+            print(f"✅ [BUNDLE] done after {time.monotonic() - t0:.2f}s (session)")
+            return
+
+        self.__audio_request(audio_protocol.encode_bundle(items), b"OK", timeout)
+        print(f"✅ [BUNDLE] done after {time.monotonic() - t0:.2f}s")
+
+    def preload_book_to_sota(
+        self,
+        base_filenames: typing.List[str],
+        cache_dir: str,
+        book_id: typing.Optional[str] = None,
+        timeout: float = 300.0,
+    ) -> typing.Dict[str, typing.List[str]]:
+        """
+        絵本1冊分（base_filenames の全ページ）のキャッシュwavを、1回の BUNDLE 転送で Sota に保存する。
+        キーは preload_cached_speech_to_sota と同じなので、そのまま play_cached_speech_from_sota で再生できる。
+        - 返り値: {base_filename: 保存したキーの順序リスト}（キャッシュがないページは含まない）
+        """
+        per_page: typing.Dict[str, typing.List[str]] = {}
+        items: typing.List[typing.Tuple[str, int, audio_protocol.FileBody]] = []
+        for base_filename in base_filenames:
+            page_items = self._page_upload_items(base_filename, cache_dir, book_id)
+            if page_items:
+                per_page[base_filename] = [key for key, _, _ in page_items]
+                items.extend(page_items)
+
+        # Sota 上に同じ内容があるものは送らない。件数上限を超える場合は分割して送る
+        todo = self._filter_uploaded(items)
+        step = audio_protocol.MAX_BUNDLE_ITEMS
+        for start in range(0, len(todo), step):
+            self.put_wav_bundle(todo[start:start + step], timeout=timeout)
+        self._record_uploaded(todo)
+
+        print(f"✅【一括先読み】Sotaへ保存完了: {len(per_page)} pages, {len(todo)}/{len(items)} files, "
+              f"{sum(len(data) for _, _, data in todo)} bytes")
+        return per_page
+
     def play_cached_speech_from_sota(
         self,
         key_prefix: str,
@@ -562,10 +1103,15 @@ class RobotTools(object):
         base_filename: str,
         book_id: typing.Optional[str] = None,
         timeout: float = 300.0,
+        on_event: typing.Optional[typing.Callable[[dict], None]] = None,
+        before_end: typing.Optional[typing.Callable[[], None]] = None,
+        lead_ms: int = 0,
     ) -> float:
         """
         先読み済み（PUT済み）の音声を、Sota側の保存キーから再生する（送信なし）。
         - 返り値: 合計再生時間（秒）
+        - on_event: チャンクごとの開始・終了イベント（play_keys_with_events を参照）
+        - before_end: ページの音声が終わる lead_ms 前に（別スレッドで）呼ぶ。めくりモーションの前倒し用
         ※ キーの数を決めるために、ローカルの cache_dir から対応ファイルを列挙する。
         """
         if book_id is None:
@@ -576,14 +1122,151 @@ class RobotTools(object):
             print(f"【再生】ローカルキャッシュが見つからない: {base_filename}")
             return 0.0
 
-        total_sec = 0.0
-        for idx, wav_path in enumerate(chunk_files):
-            duration_ms = self._calc_wav_duration_ms(wav_path)
-            key = f"{key_prefix}__{idx:03d}"
-            self.play_wav_key_ack(key=key, duration_ms=duration_ms, timeout=timeout)
-            total_sec += duration_ms / 1000.0
+        items = [(f"{key_prefix}__{idx:03d}", self._calc_wav_duration_ms(wav_path))
+                 for idx, wav_path in enumerate(chunk_files)]
+        durations = [ms for _, ms in items]
+
+        trigger = None
+        if before_end is not None:
+            trigger = self._lead_trigger(durations, lead_ms, before_end)
+
+        def dispatch(event: dict) -> None:
+            if trigger is not None:
+                trigger(event)
+            if on_event is not None:
+                on_event(event)
+
+        self.play_keys_with_events(items, on_event=dispatch, timeout=timeout)
+        # まだ呼ばれていなければ（イベントが届かなかった場合など）再生後すぐに呼ぶ
+        if trigger is not None:
+            trigger(None)
+        return sum(durations) / 1000.0
 
-        return total_sec
+    @staticmethod
+    def _lead_trigger(durations_ms: typing.List[int], lead_ms: int,
+                      callback: typing.Callable[[], None]) -> typing.Callable[[typing.Optional[dict]], None]:
+        """
+        STARTED イベントを受けて「全体の終わりの lead_ms 前」にタイマーで callback を1回だけ呼ぶハンドラを返す。
+        発火点を含むチャンクが始まった時点で、そのチャンク以降の長さから残り時間を計算する。
+        None を渡すと（まだ呼んでいなければ）その場で呼ぶ。戻った時点で callback は必ず完了している。
+        """
+        lock = threading.Lock()
+        state = dict(done=False, timer=None)
+
+        def fire_once() -> None:
+            with lock:
+                if state["done"]:
+                    return
+                state["done"] = True
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"【警告】before_end の処理でエラー: {e}")
+
+        def on_event(event: typing.Optional[dict]) -> None:
+            if event is None:
+                if state["timer"] is not None:
+                    state["timer"].cancel()
+                fire_once()
+                return
+            if state["timer"] is not None or event["event"] != "STARTED":
+                return
+            remaining = sum(durations_ms[event["index"]:])
+            if remaining - lead_ms > durations_ms[event["index"]]:
+                return  # 発火点はまだ先のチャンク
+            timer = threading.Timer(max(0.0, (remaining - lead_ms) / 1000.0), fire_once)
+            timer.daemon = True
+            state["timer"] = timer
+            timer.start()
+
+        return on_event
+
+    def play_keys_with_events(
+        self,
+        items: typing.List[typing.Tuple[str, int]],
+        on_event: typing.Optional[typing.Callable[[dict], None]] = None,
+        timeout: float = 300.0,
+    ) -> typing.List[dict]:
+        """
+        保存済みの wav（(key, duration_ms) の列）を1コマンドで順に再生し、チャンクごとの開始・終了を受け取る。
+
+        プロトコル(PLAYSEQ):
+        - `PLAYSEQ\n`
+        - 4byte big-endian: count
+        - (count回繰り返し) `<key>\n` + 4byte big-endian: duration_ms
+        - server -> `STARTED <index> <robot_ms>\n` / `FINISHED <index> <robot_ms>\n`（チャンクごと）
+        - server -> `ACK\n`（全て再生完了後） / `NOFILE <index>\n` / `ERR <index>\n`（再生失敗。RuntimeError にする）
+
+        イベント: {"event": "STARTED"|"FINISHED", "index", "key", "robot_ms"（Sota の時計）, "host_time"（受信時の time.monotonic()）}
+        on_event は受信スレッドから呼ばれるので、重い処理は別スレッドで行うこと。
+        1コマンド1接続方式で最初に送った PLAYSEQ に（イベントより先に）`ERR` が返った場合だけ、PLAYSEQ に対応していない
+        サーバとみなして以降は PLAYKEY を1つずつ送る（イベントは host_time のみ、robot_ms は None）。
+        SESSION に対応したサーバは PLAYSEQ にも対応しているので、SESSION 中の `ERR` は RuntimeError にする
+        （途中まで再生したページを最初から再生し直さないように）。
+        返り値: 受け取ったイベントの一覧
+        """
+        if not items:
+            return []
+        if len(items) > audio_protocol.MAX_SEQ_ITEMS:
+            raise RuntimeError(f"too many items: {len(items)} > {audio_protocol.MAX_SEQ_ITEMS}")
+
+        events: typing.List[dict] = []
+
+        def emit(status: str, index: int, robot_ms: typing.Optional[int]) -> None:
+            event = dict(event=status, index=index, key=items[index][0], robot_ms=robot_ms, host_time=time.monotonic())
+            events.append(event)
+            if on_event is not None:
+                on_event(event)
+
+        t0 = time.monotonic()
+        print(f"▶ [PLAYSEQ] send: {len(items)} keys, total={sum(ms for _, ms in items)}ms to {self.__ip}:{self.__audio_port}")
+        session = self._active_session()
+        if session is not None:
+            status = session.play_seq(items, on_event=emit).result(timeout)
+        elif self.__playseq_supported is False:
+            self.__play_keys_one_by_one(items, emit, timeout)
+            return events
+        else:
+            status = self.__playseq_connection(items, emit, timeout)
+            if status == "ERR" and self.__playseq_supported is None and not events:
+                print("⚠️ [PLAYSEQ] サーバが PLAYSEQ に対応していないため PLAYKEY で再生します。")
+                self.__playseq_supported = False
+                self.__play_keys_one_by_one(items, emit, timeout)
+                return events
+        self._expect(status, "ACK")
+        self.__playseq_supported = True
+        for key, _ in items:
+            self._mark_played(key)
+        print(f"✅ [PLAYSEQ] ACK after {time.monotonic() - t0:.2f}s")
+        return events
+
+    def __playseq_connection(self, items: typing.List[typing.Tuple[str, int]],
+                             emit: typing.Callable[[str, int, typing.Optional[int]], None], timeout: float) -> str:
+        """1コマンド1接続方式の PLAYSEQ。イベント行を処理し、最終応答（ACK / NOFILE / ERR）を返す。"""
+        with self.__connect_audio() as conn:
+            conn.settimeout(timeout)
+            audio_protocol.send_frames(conn, audio_protocol.encode_playseq(items))
+            reader = audio_protocol.FrameReader(conn)
+            while True:
+                try:
+                    words = reader.readline().decode("utf-8", "replace").split()
+                except ConnectionError:
+                    raise RuntimeError("connection closed before ACK")
+                if not words:
+                    continue
+                if words[0] in audio_protocol.EVENT_STATUSES:
+                    emit(words[0], *audio_protocol.parse_event(words[1:]))
+                    continue
+                if words[0] == "ERR" and len(words) >= 2:
+                    raise RuntimeError(f"playback failed at index {words[1]}")
+                return words[0]
+
+    def __play_keys_one_by_one(self, items: typing.List[typing.Tuple[str, int]],
+                               emit: typing.Callable[[str, int, typing.Optional[int]], None], timeout: float) -> None:
+        for index, (key, duration_ms) in enumerate(items):
+            emit("STARTED", index, None)
+            self.play_wav_key_ack(key=key, duration_ms=duration_ms, timeout=timeout)
+            emit("FINISHED", index, None)
 
     @staticmethod
     def _calc_wav_duration_ms(wav_path: str) -> int:
@@ -601,7 +1284,7 @@ class RobotTools(object):
 
     def play_wav_batch_ack(
         self,
-        items: typing.List[typing.Tuple[int, bytes]],
+        items: typing.List[typing.Tuple[int, audio_protocol.Body]],
         timeout: float = 300.0
     ) -> None:
         """
@@ -622,28 +1305,14 @@ class RobotTools(object):
         total_ms = sum(ms for ms, _ in items)
         print(f"▶ [ACK-BATCH] send start: files={len(items)}, total_bytes={total_bytes}, total_ms={total_ms} to {self.__ip}:{self.__audio_port}")
 
-        with self.__connect_audio() as conn:
-            conn.settimeout(timeout)
-
-            conn.sendall(b"BATCH\n")
-            conn.sendall(int(len(items)).to_bytes(4, "big", signed=False))
-
-            for duration_ms, data in items:
-                conn.sendall(int(duration_ms).to_bytes(4, "big", signed=True))
-                conn.sendall(int(len(data)).to_bytes(4, "big", signed=False))
-                conn.sendall(data)
-
-            buf = b""
-            while not buf.endswith(b"\n"):
-                chunk = conn.recv(1)
-                if not chunk:
-                    raise RuntimeError("connection closed before ACK")
-                buf += chunk
+        session = self._active_session()
+        if session is not None:
+            self._expect(session.batch(items).result(timeout), "ACK")
+            print(f"✅ [ACK-BATCH] received after {time.monotonic() - t0:.2f}s (session)")
+            return
 
-        dt = time.monotonic() - t0
-        if buf.strip() != b"ACK":
-            raise RuntimeError(f"unexpected response: {buf!r}")
-        print(f"✅ [ACK-BATCH] received after {dt:.2f}s")
+        self.__audio_request(audio_protocol.encode_batch(items), b"ACK", timeout)
+        print(f"✅ [ACK-BATCH] received after {time.monotonic() - t0:.2f}s")
 
 
     def stop_wav(self):
@@ -655,6 +1324,12 @@ class RobotTools(object):
         conn.sendall(size)
         conn.sendall(data)
 
+    def __send_file(self, conn: socket.socket, path: str):
+        """__send と同じ形式（4byte長 + 本体）で、長さはファイルサイズから取りファイルを直接流す。"""
+        body = audio_protocol.FileBody(path)
+        conn.sendall(len(body).to_bytes(4, byteorder='big'))
+        audio_protocol.send_frames(conn, [body])
+
     def __connect(self) -> socket.socket:
         conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         conn.connect((self.__ip, self.__port))
@@ -665,6 +1340,24 @@ class RobotTools(object):
         conn.connect((self.__ip, self.__audio_port))
         return conn
 
+    def __audio_call(self, parts: typing.Sequence[audio_protocol.Body], timeout: float) -> str:
+        """1コマンド1接続方式: コマンドを送り、応答行（YES / NO / OK / NOFILE など）を返す。"""
+        with self.__connect_audio() as conn:
+            conn.settimeout(timeout)
+            audio_protocol.send_frames(conn, parts)
+            try:
+                return audio_protocol.FrameReader(conn).readline().decode("utf-8", "replace").strip()
+            except ConnectionError:
+                raise RuntimeError("connection closed before response")
+
+    def __audio_request(self, parts: typing.Sequence[audio_protocol.Body], expected: bytes, timeout: float) -> None:
+        """1コマンド1接続方式: コマンドをまとめて送り、応答行が expected であることを確認する。"""
+        with self.__connect_audio() as conn:
+            conn.settimeout(timeout)
+            audio_protocol.send_frames(conn, parts)
+            audio_protocol.expect_line(audio_protocol.FrameReader(conn), expected,
+                                       f"connection closed before {expected.decode()}")
+
 
     def __recvall(self, conn: socket.socket, size: int):
         chunks = []
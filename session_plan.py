@@ -0,0 +1,290 @@
+# session_plan.py: ストーリーJSON とキャッシュ済み音声から、読み聞かせ1回分のタイムライン（プラン）を作る
+#
+# ページの選別（奇数ページのみ）、保存キーと再生時間、めくりモーション、めくり・先読み（Sota への送信）の時刻、
+# ジェスチャ（gesture_track.py でマニフェストに保存したもの）、アンケートURLをすべて事前に決めてファイルに書き出す。reading_session.py はプランを実行するだけ。
+# 時刻はすべて読み聞かせ開始（Enter を押した時点）からの ms。全体の長さはロボットを動かす前にわかる。
+#
+# 使い方:
+#   python session_plan.py --book suhu --variant normal --condition 1
+#   python session_plan.py --book suhu --variant normal --condition 1 --lead-ms 300 --startup-wait 10 -o plan.json
+import argparse
+import json
+import math
+import os
+import typing
+
+from audio_protocol import play_wait_ms
+from gesture_track import GESTURE_VERSION, page_gesture, track_ms
+from preload_scheduler import DEFAULT_THROUGHPUT_BPS
+from robottools3 import RobotTools
+from speech_cache import SpeechCacheManifest
+from synth_planner import STORY_VARIANTS, story_file_path, cache_dir_for
+
+PLAN_VERSION = 3
+
+# ブラウザのめくり時間の既定値 [ms]（ストーリーデータに flip_duration がないとき）
+DEFAULT_FLIP_DURATION_MS = 600
+# めくりモーション片道の下限 [ms]
+MIN_MOTION_HALF_MS = 100
+
+
+def page_base_filename(page_number: int) -> str:
+    return f"page{str(page_number).zfill(2)}"
+
+
+def plan_file_path(cache_dir: str, book_id: str) -> str:
+    """プランの保存先（キャッシュディレクトリ直下。*.wav ではないので音声の検索には影響しない）。"""
+    return os.path.join(cache_dir, f"_plan_{book_id}.json")
+
+
+def build_flip_motion(flip_duration_ms: int, lag_ms: int = 0) -> typing.List[dict]:
+    """めくりモーション（腕を伸ばす → 戻す）。片道はめくり時間の半分（下限 MIN_MOTION_HALF_MS）。"""
+    half = max(MIN_MOTION_HALF_MS, (flip_duration_ms - lag_ms) // 2)
+    return [
+        dict(Msec=half, ServoMap=dict(BODY_Y=60, L_SHOU=-90, L_ELBO=0, R_SHOU=30, R_ELBO=20, HEAD_Y=30, HEAD_P=0, HEAD_R=0)),
+        dict(Msec=half, ServoMap=dict(BODY_Y=0, L_SHOU=-90, L_ELBO=0, R_SHOU=90, R_ELBO=0, HEAD_Y=0, HEAD_P=0, HEAD_R=0)),
+    ]
+
+
+def survey_url_for_cache_dir(cache_dir: str, book_id: str, survey_urls: typing.Dict[str, str]) -> str:
+    """
+    キャッシュディレクトリ名（<id>_<条件>_..._speech_cache）から実験条件を読み取り、対応するアンケートURLを返す。
+    survey_urls: {条件: URL}
+    """
+    name = os.path.basename(os.path.normpath(cache_dir))
+    prefix = f"{book_id}_"
+    if name.startswith(prefix):
+        condition = name[len(prefix):].split("_", 1)[0]
+        if condition in survey_urls:
+            return survey_urls[condition]
+    print(f"⚠️ キャッシュディレクトリ '{cache_dir}' に対応するアンケートURLがありません。")
+    return ""
+
+
+# ==============================================================================
+# 1. コンパイル
+# ==============================================================================
+def _page_audio(rt: RobotTools, base_filename: str, cache_dir: str, book_id: str) -> typing.List[dict]:
+    """
+    1ページ分のチャンク（保存キー・再生時間・転送ファイル）。キー命名は RobotTools._page_upload_items と同じ。
+    ms は Sota へ送る再生時間、wait_ms は Sota が実際に待つ時間（audio_protocol.play_wait_ms。時刻の計算に使う）。
+    """
+    chunks = []
+    for idx, wav_path in enumerate(rt._get_cached_chunk_files(base_filename, cache_dir, book_id or None)):
+        send_path = rt._get_transfer_file(wav_path)
+        ms = rt._calc_wav_duration_ms(send_path)
+        chunks.append(dict(
+            key=f"{book_id}_{base_filename}__{idx:03d}" if book_id else f"{base_filename}__{idx:03d}",
+            ms=ms,
+            wait_ms=play_wait_ms(ms),
+            file=os.path.relpath(send_path, cache_dir),
+            bytes=os.path.getsize(send_path),
+        ))
+    return chunks
+
+
+def _page_gesture(manifest: SpeechCacheManifest, chunks: typing.List[dict],
+                  until_ms: typing.Optional[int]) -> typing.Optional[typing.List[dict]]:
+    """チャンクごとのジェスチャを、チャンクの再生開始時刻に合わせて1本にする。作成されていなければ None。"""
+    tracks = []
+    offset = 0
+    for c in chunks:
+        gesture = manifest.get(c["file"]).get("gesture") or {}
+        if gesture.get("version") == GESTURE_VERSION and gesture.get("keyframes"):
+            tracks.append((offset, gesture["keyframes"]))
+        offset += c["wait_ms"]
+    if not tracks:
+        return None
+    return page_gesture(tracks, until_ms) or None
+
+
+def _plan_preloads(pages: typing.List[dict], horizon_ms: int, throughput_bps: float) -> int:
+    """
+    各ページの先読み（Sota への送信）の時刻を page["preload"] に入れる。
+    送信は1本ずつ再生順に行い、ページの再生開始の horizon_ms 前になったら送り始める（前のページの送信中は待つ）。
+    送信時間 eta_ms は bytes / throughput_bps の見積もり。返り値: 再生開始（deadline_ms）に間に合わない見込みのページ数
+    """
+    late = 0
+    link_free_ms = 0
+    for page in pages:
+        eta_ms = int(math.ceil(page["bytes"] * 1000.0 / throughput_bps))
+        start_ms = max(0, page["audio_start_ms"] - horizon_ms, link_free_ms)
+        link_free_ms = start_ms + eta_ms
+        page["preload"] = dict(start_ms=start_ms, deadline_ms=page["audio_start_ms"], eta_ms=eta_ms)
+        if link_free_ms > page["audio_start_ms"]:
+            late += 1
+    return late
+
+
+def compile_plan(rt: RobotTools, story_data: typing.List[dict], book_id: str, cache_dir: str,
+                 flip_lead_ms: int = 300, startup_wait_sec: float = 10.0, turn_at_motion_half: bool = True,
+                 survey_url: str = "", story_file: str = "", gestures: bool = True,
+                 preload_horizon_sec: float = 60.0, throughput_bps: float = DEFAULT_THROUGHPUT_BPS) -> dict:
+    """
+    プランを作る。各ページの時刻は「前のページのめくり（ブラウザとモーションの両方）が終わったら次の音声」
+    という reading_session.py の依存関係に、キャッシュ済み音声の再生時間を当てはめたもの。
+
+    flip_lead_ms: 音声の終わり何 ms 前にめくりモーションを始めるか
+    startup_wait_sec: 開始前の待ち時間（この間に全ページを一括先読みする）
+    turn_at_motion_half: True なら腕がページに届いた時点でブラウザをめくる。False ならモーション完了後
+    gestures: True ならマニフェストのジェスチャを入れる（めくりモーションが始まる前に終わるよう切り詰める）
+    preload_horizon_sec: 再生開始の何秒前からそのページを Sota へ送り始めるか（先読みスケジューラはこの時刻に従う）
+    throughput_bps: 送信時間の見積もりに使う Sota への転送速度 [bytes/s]
+    """
+    startup_ms = int(startup_wait_sec * 1000)
+    manifest = SpeechCacheManifest(cache_dir) if gestures else None
+    pages = []
+    t = startup_ms
+    for i, item in enumerate(story_data):
+        page_number_raw = item.get('page_number', i + 1)
+        try:
+            page_number = int(page_number_raw)
+        except (TypeError, ValueError):
+            print(f"⚠️ ページ番号 '{page_number_raw}' は不正な値です。スキップします。")
+            continue
+        # 偶数ページは読まない（JSONのデータ構造に依存）
+        if page_number % 2 == 0:
+            continue
+
+        base = page_base_filename(page_number)
+        chunks = _page_audio(rt, base, cache_dir, book_id)
+        if not chunks:
+            print(f"⚠️ {base} のキャッシュが見つかりません（音声なしでめくりだけ行います）。")
+        audio_ms = sum(c["wait_ms"] for c in chunks)
+        page = dict(
+            page_number=page_number,
+            base=base,
+            text=item.get('text', ''),
+            valence=item.get('valence', 0.0),
+            intensity=item.get('intensity', 0.0),
+            chunks=chunks,
+            bytes=sum(c["bytes"] for c in chunks),
+            flip_duration_ms=int(item.get('flip_duration', DEFAULT_FLIP_DURATION_MS)),
+            audio_start_ms=t,
+            audio_end_ms=t + audio_ms,
+            motion=None,
+            turn=None,
+            gesture=None,
+        )
+        t = page["audio_end_ms"]
+
+        # ページめくりが必要な条件: 奇数ページであり、最後の項目ではない
+        if i != len(story_data) - 1:
+            keyframes = build_flip_motion(page["flip_duration_ms"])
+            half = keyframes[0]["Msec"]
+            motion_start = max(page["audio_start_ms"], page["audio_end_ms"] - flip_lead_ms)
+            motion_end = motion_start + sum(k["Msec"] for k in keyframes)
+            turn_start = motion_start + half if turn_at_motion_half else motion_end
+            turn_end = turn_start + page["flip_duration_ms"]
+            page["motion"] = dict(start_ms=motion_start, end_ms=motion_end, keyframes=keyframes)
+            page["turn"] = dict(start_ms=turn_start, end_ms=turn_end)
+            t = max(t, motion_end, turn_end)
+        if manifest is not None and chunks:
+            until = page["motion"]["start_ms"] - page["audio_start_ms"] if page["motion"] is not None else None
+            keyframes = _page_gesture(manifest, chunks, until)
+            if keyframes is not None:
+                page["gesture"] = dict(start_ms=page["audio_start_ms"],
+                                       end_ms=page["audio_start_ms"] + track_ms(keyframes), keyframes=keyframes)
+        pages.append(page)
+
+    horizon_ms = int(preload_horizon_sec * 1000)
+    late = _plan_preloads(pages, horizon_ms, throughput_bps)
+    if late:
+        print(f"⚠️ {late} ページの先読みが、転送速度 {throughput_bps / 1e6:.2f}MB/s の見積もりでは再生開始に間に合いません。")
+
+    return dict(
+        version=PLAN_VERSION,
+        book_id=book_id,
+        cache_dir=cache_dir,
+        story_file=story_file,
+        flip_lead_ms=flip_lead_ms,
+        startup_wait_ms=startup_ms,
+        turn_at_motion_half=turn_at_motion_half,
+        survey_url=survey_url,
+        preload_horizon_ms=horizon_ms,
+        throughput_bps=throughput_bps,
+        total_ms=t,
+        pages=pages,
+    )
+
+
+# ==============================================================================
+# 2. 保存・読み込み
+# ==============================================================================
+def save_plan(plan: dict, path: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_plan(path: str) -> dict:
+    """プランを読み込み、参照している音声ファイルがキャッシュに残っているか確認する。"""
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise RuntimeError(f"unsupported plan version: {plan.get('version')} ({path})")
+    check_plan(plan)
+    return plan
+
+
+def check_plan(plan: dict) -> None:
+    """キャッシュが作り直されていたら（ファイルがない・サイズが違う）RuntimeError。プランを作り直すこと。"""
+    for page in plan["pages"]:
+        for c in page["chunks"]:
+            path = os.path.join(plan["cache_dir"], c["file"])
+            if not os.path.exists(path) or os.path.getsize(path) != c["bytes"]:
+                raise RuntimeError(f"plan is stale (cache changed): {path}")
+
+
+def summarize_plan(plan: dict) -> None:
+    audio_ms = sum(p["audio_end_ms"] - p["audio_start_ms"] for p in plan["pages"])
+    flips = [p for p in plan["pages"] if p["turn"] is not None]
+    gestures = [p for p in plan["pages"] if p.get("gesture") is not None]
+    late = [p for p in plan["pages"] if p["preload"]["start_ms"] + p["preload"]["eta_ms"] > p["preload"]["deadline_ms"]]
+    print("-" * 30)
+    print(f"📋 読み聞かせプラン: {plan['book_id']} ({plan['cache_dir']})")
+    for p in plan["pages"]:
+        line = (f"  {p['base']}: 先読み {p['preload']['start_ms'] / 1000:7.2f}秒〜, "
+                f"音声 {p['audio_start_ms'] / 1000:7.2f}–{p['audio_end_ms'] / 1000:7.2f}秒")
+        if p["turn"] is not None:
+            line += (f", モーション {p['motion']['start_ms'] / 1000:.2f}秒〜"
+                     f", めくり {p['turn']['start_ms'] / 1000:.2f}–{p['turn']['end_ms'] / 1000:.2f}秒")
+        print(line)
+    print(f"  ページ数: {len(plan['pages'])}, めくり: {len(flips)} 回, ジェスチャ: {len(gestures)} ページ, "
+          f"音声合計: {audio_ms / 1000:.1f}秒")
+    print(f"  先読み: 再生開始の {plan['preload_horizon_ms'] / 1000:.0f}秒前から送信"
+          f"（見積もり {plan['throughput_bps'] / 1e6:.2f}MB/s, 間に合わない見込み {len(late)} ページ）")
+    print(f"  全体の長さ: {plan['total_ms'] / 1000:.1f}秒（開始前の待ち {plan['startup_wait_ms'] / 1000:.1f}秒を含む）")
+    print("-" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ストーリーJSONとキャッシュ済み音声から読み聞かせプランを作る")
+    parser.add_argument("--book", required=True, help="絵本ID (例: suhu)")
+    parser.add_argument("--variant", default="normal", choices=list(STORY_VARIANTS),
+                        help="ストーリー種別 (normal / emo / random)")
+    parser.add_argument("--condition", default="1", help="実験条件（キャッシュディレクトリ名に使う）")
+    parser.add_argument("--cache-dir", default=None, help="キャッシュディレクトリ（省略時は種別・条件から決める）")
+    parser.add_argument("--lead-ms", type=int, default=300, help="音声の終わり何ms前にめくりモーションを始めるか")
+    parser.add_argument("--startup-wait", type=float, default=10.0, help="開始前の待ち時間 [s]")
+    parser.add_argument("--preload-horizon", type=float, default=60.0, help="再生開始の何秒前からページを送り始めるか")
+    parser.add_argument("--turn-after-motion", action="store_true", help="めくりモーション完了後にブラウザをめくる")
+    parser.add_argument("--survey-url", default="", help="読み聞かせ後に表示するアンケートURL")
+    parser.add_argument("--no-gestures", action="store_true", help="ジェスチャ（gesture_track.py）を使わない")
+    parser.add_argument("-o", "--output", default=None, help="出力先（省略時は <cache_dir>/_plan_<id>.json）")
+    args = parser.parse_args()
+
+    story_file = story_file_path(args.book, args.variant)
+    cache_dir = args.cache_dir or cache_dir_for(args.book, args.variant, args.condition)
+    with open(story_file, "r", encoding="utf-8") as f:
+        story = json.load(f)
+    plan = compile_plan(RobotTools('0.0.0.0', 0), story, args.book, cache_dir,
+                        flip_lead_ms=args.lead_ms, startup_wait_sec=args.startup_wait,
+                        turn_at_motion_half=not args.turn_after_motion, survey_url=args.survey_url,
+                        story_file=story_file, gestures=not args.no_gestures,
+                        preload_horizon_sec=args.preload_horizon)
+    output = args.output or plan_file_path(cache_dir, args.book)
+    save_plan(plan, output)
+    summarize_plan(plan)
+    print(f"✅ プランを書き出しました: {output}")
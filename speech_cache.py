@@ -0,0 +1,175 @@
+# speech_cache.py: 音声キャッシュのメタ情報（マニフェスト）管理
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+import wave
+
+# キャッシュディレクトリ直下に置くマニフェストファイル名
+# （*.wav ではないので _get_cached_chunk_files の検索には引っかからない）
+MANIFEST_NAME = "_manifest.json"
+
+# キャッシュディレクトリごとのロック（同じプロセス内の全 RobotTools / スレッドで共有する）
+_DIR_LOCKS: typing.Dict[str, threading.RLock] = {}
+_DIR_LOCKS_GUARD = threading.Lock()
+
+
+def manifest_lock(cache_dir: str) -> threading.RLock:
+    """cache_dir のマニフェストの読み書きを直列化するロックを返す。"""
+    key = os.path.normcase(os.path.abspath(cache_dir))
+    with _DIR_LOCKS_GUARD:
+        lock = _DIR_LOCKS.get(key)
+        if lock is None:
+            lock = _DIR_LOCKS[key] = threading.RLock()
+        return lock
+
+
+def transfer_path(wav_path: str, rate: int) -> str:
+    """
+    転送用に変換したwavの保存先を返す。
+    例: suhu_cache/suhu_page03__xxxx.wav → suhu_cache/_tx16000/suhu_page03__xxxx.wav
+    （サブディレクトリなので元キャッシュの検索・ソートには影響しない）
+    """
+    cache_dir, filename = os.path.split(wav_path)
+    return os.path.join(cache_dir, f"_tx{int(rate)}", filename)
+
+
+def base_render_dir(cache_dir: str) -> str:
+    """
+    話速変換の元になる基準レンダリング（speed=100）の保存先。
+    ページ用wavと同じ階層に置くと同一ページとして二重に列挙されるため、サブディレクトリに分ける。
+    """
+    return os.path.join(cache_dir, "_base")
+
+
+class SpeechCacheManifest(object):
+    """
+    キャッシュwavごとのメタ情報（再生時間・後処理の履歴など）を JSON で保持する。
+    キーは cache_dir からの相対ファイル名（例: "suhu_page03__1a2b3c4d.wav"）。
+    save() はロックを取ってディスク上の最新の内容を読み直し、このインスタンスで変更したフィールドだけを
+    書き戻す（同じキャッシュを使う他のインスタンスの変更を消さない）。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, MANIFEST_NAME)
+        self._entries: typing.Dict[str, dict] = {}
+        self._changed: typing.Dict[str, dict] = {}   # キー → このインスタンスで更新したフィールド
+        self._removed: typing.Set[str] = set()
+        self._dirty = False
+        self.load()
+
+    def _read_entries(self) -> typing.Dict[str, dict]:
+        """ディスク上のエントリを読む。存在しなければ空、壊れていれば例外。"""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("マニフェストの形式が不正です")
+        return data.get("entries", {}) or {}
+
+    def load(self) -> None:
+        """マニフェストを読み込む。存在しない/壊れている場合は空から始める（壊れている場合は保存もしない）。"""
+        self._entries = {}
+        self._changed = {}
+        self._removed = set()
+        self._dirty = False
+        with manifest_lock(self.cache_dir):
+            try:
+                self._entries = self._read_entries()
+            except (OSError, ValueError) as e:
+                print(f"【警告】マニフェストの読み込みに失敗しました。上書きしないよう保存を止めます ({self.path}): {e}")
+
+    def save(self) -> None:
+        """
+        変更があれば、ロック内でディスク上の内容に変更分をマージし、一時ファイル経由でアトミックに書き出す。
+        ディスク上のマニフェストが読めない場合は上書きせずに警告だけ出す（壊れたまま空で作り直さない）。
+        """
+        if not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with manifest_lock(self.cache_dir):
+            try:
+                entries = self._read_entries()
+            except (OSError, ValueError) as e:
+                print(f"【警告】マニフェストが読めないため保存しません ({self.path}): {e}")
+                return
+            for key in self._removed:
+                entries.pop(key, None)
+            for key, fields in self._changed.items():
+                entries.setdefault(key, {}).update(fields)
+
+            fd, tmp_path = tempfile.mkstemp(prefix=MANIFEST_NAME + ".", suffix=".tmp", dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"entries": entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        self._entries = entries
+        self._changed = {}
+        self._removed = set()
+        self._dirty = False
+
+    @staticmethod
+    def key_for(path: str) -> str:
+        """フルパス/ファイル名からマニフェストのキーを得る。"""
+        return os.path.basename(path)
+
+    def get(self, path: str) -> dict:
+        return self._entries.get(self.key_for(path), {})
+
+    def update(self, path: str, **fields) -> dict:
+        key = self.key_for(path)
+        entry = self._entries.setdefault(key, {})
+        entry.update(fields)
+        self._changed.setdefault(key, {}).update(fields)
+        self._removed.discard(key)
+        self._dirty = True
+        return entry
+
+    def remove(self, path: str) -> None:
+        key = self.key_for(path)
+        self._entries.pop(key, None)
+        self._changed.pop(key, None)
+        self._removed.add(key)
+        self._dirty = True
+
+    def names(self) -> typing.List[str]:
+        return list(self._entries.keys())
+
+    def touch(self, paths: typing.Iterable[str], now: typing.Optional[float] = None) -> None:
+        """再生・送信に使ったファイルの最終使用時刻を記録する（LRU 退避用）。"""
+        now = time.time() if now is None else now
+        for path in paths:
+            if float(self.get(path).get("last_used", 0.0)) < now:
+                self.update(path, last_used=now)
+
+    def last_used(self, path: str) -> float:
+        """最終使用時刻。記録がなければファイルの更新時刻で代用する。"""
+        recorded = self.get(path).get("last_used")
+        if recorded is not None:
+            return float(recorded)
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+
+def validate_wav(path: str) -> bool:
+    """wav がヘッダ通りのデータを持っているか確認する（書き込み途中で止まった合成結果などを検出）。"""
+    try:
+        with wave.open(path, "rb") as wf:
+            nframes = wf.getnframes()
+            frame_bytes = wf.getnchannels() * wf.getsampwidth()
+            if nframes <= 0 or wf.getframerate() <= 0:
+                return False
+            data = wf.readframes(nframes)
+        return len(data) == nframes * frame_bytes
+    except (OSError, EOFError, wave.Error):
+        return False
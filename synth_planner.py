@@ -0,0 +1,259 @@
+# synth_planner.py: 絵本 × ストーリー種別 × 条件 をまとめて事前合成するプランナー（ドライラン見積もり付き）
+#
+# 使い方:
+#   python synth_planner.py --books suhu inu --variants normal emo --conditions 1 2 --dry-run
+#   python synth_planner.py --books suhu --variants normal emo --conditions 1 2 3
+import argparse
+import json
+import os
+import time
+import typing
+
+import audio_post
+from gesture_track import build_gesture_tracks
+from robottools3 import RobotTools, DEFAULT_NARRATOR
+from speech_cache import base_render_dir
+from text_chunker import ChunkRegistry, chunk_text, MAX_CHARS
+
+# ==============================================================================
+# 1. 設定
+# ==============================================================================
+
+# 実験条件ごとの合成設定
+#   speed_mode: "flip_ratio" = めくり時間の比率から話速を決める（pre_synthesize.py と同じ式）
+#               "fixed"      = 常に speed 100
+#   use_emotion: False なら valence を 0 として合成（ニュートラル音声）
+CONDITIONS: typing.Dict[str, dict] = {
+    "1": dict(speed_mode="flip_ratio", use_emotion=True),
+    "2": dict(speed_mode="fixed", use_emotion=True),
+    "3": dict(speed_mode="fixed", use_emotion=False),
+}
+
+# 見積もり用の係数（VOICEPEAK の実測に合わせて調整）
+ENGINE_SEC_PER_CALL = 1.0    # 1回の呼び出しの固定コスト [s]
+ENGINE_SEC_PER_CHAR = 0.03   # 1文字あたりの合成時間 [s]
+SPEECH_MS_PER_CHAR = 130.0   # speed=100 での1文字あたりの発話時間 [ms]
+ENGINE_BYTES_PER_SEC = 48000 * 2          # VOICEPEAK 出力 (48kHz/16bit/mono)
+TRANSFER_BYTES_PER_SEC = audio_post.TRANSFER_RATE * 2
+
+
+# ストーリー種別 → ストーリーJSONのファイル名
+#   normal: めくり時間が一定 / emo: 感情に合わせためくり時間 / random: ページごとにばらばらのめくり時間（story_<id>.json）
+STORY_VARIANTS: typing.Dict[str, str] = {
+    "normal": "story_{book_id}_normal.json",
+    "emo": "story_{book_id}_emo.json",
+    "random": "story_{book_id}.json",
+}
+
+
+def story_file_path(book_id: str, variant: str) -> str:
+    """ストーリーJSONのパス。未知の種別は ValueError。"""
+    if variant not in STORY_VARIANTS:
+        raise ValueError(f"未知のストーリー種別です: {variant!r} (使えるもの: {', '.join(STORY_VARIANTS)})")
+    return STORY_VARIANTS[variant].format(book_id=book_id)
+
+
+def cache_dir_for(book_id: str, variant: str, condition: str) -> str:
+    """
+    キャッシュディレクトリ名。normal は sample3.py の既存名（<id>_<条件>_speech_cache）と互換にし、
+    それ以外の種別は同じページ名の wav が混ざらないよう種別名を付ける。
+    """
+    if variant in ("", "normal"):
+        return f"{book_id}_{condition}_speech_cache"
+    return f"{book_id}_{condition}_{variant}_speech_cache"
+
+
+def _page_number(item: dict) -> typing.Optional[int]:
+    raw = str(item.get("page_number", ""))
+    return int(raw) if raw.isdigit() else None
+
+
+def compute_page_speeds(story_data: typing.List[dict]) -> typing.Dict[int, int]:
+    """
+    奇数ページごとの話速を求める（全ページ平均めくり時間との比率。pre_synthesize.py と同じ式）。
+    返り値: {page_number: speed}
+    """
+    odd_items = [it for it in story_data if _page_number(it) is not None and _page_number(it) % 2 != 0]
+    if not odd_items:
+        return {}
+    avg_flip = sum(it.get("flip_duration", 600) for it in odd_items) / len(odd_items)
+    speeds = {}
+    for it in odd_items:
+        ratio = avg_flip / it.get("flip_duration", 600)
+        calculated_speed = 100 + (ratio - 1.0) * 40
+        speeds[_page_number(it)] = max(50, min(100, int(calculated_speed)))
+    return speeds
+
+
+# ==============================================================================
+# 2. プラン作成
+# ==============================================================================
+def build_plan(rt: RobotTools, books: typing.List[str], variants: typing.List[str],
+               conditions: typing.List[str], stretch_from_base: bool = False) -> typing.List[dict]:
+    """
+    必要なページ合成タスクの一覧を作る。既にキャッシュ済みのページ・チャンクは差し引く。
+    各タスク: {book_id, variant, condition, cache_dir, base_filename, text, valence, intensity, speed,
+              cached, final_path, render_paths, engine_jobs: [(key, chars)], stretch_jobs, est_ms}
+    engine_jobs は実行全体で重複排除済み（同一内容のチャンクは最初のタスクにだけ計上）。
+    """
+    narrator = DEFAULT_NARRATOR
+    planned_keys: typing.Set[str] = set()
+    tasks: typing.List[dict] = []
+
+    for book_id in books:
+        for variant in variants:
+            story_path = story_file_path(book_id, variant)
+            if not os.path.exists(story_path):
+                print(f"⚠️ '{story_path}' が見つからないためスキップします。")
+                continue
+            with open(story_path, "r", encoding="utf-8") as f:
+                story_data = json.load(f)
+
+            for condition in conditions:
+                spec = CONDITIONS[condition]
+                cache_dir = cache_dir_for(book_id, variant, condition)
+                speeds = compute_page_speeds(story_data)
+                base_dir = base_render_dir(cache_dir)
+
+                for item in story_data:
+                    page_number = _page_number(item)
+                    if page_number is None or page_number % 2 == 0:
+                        continue
+                    text = item.get("text", "")
+                    valence = item.get("valence", 0.0) if spec["use_emotion"] else 0.0
+                    intensity = item.get("intensity", 0.0) if spec["use_emotion"] else 0.0
+                    speed = speeds[page_number] if spec["speed_mode"] == "flip_ratio" else 100
+                    base_filename = f"page{str(page_number).zfill(2)}"
+                    chunks = chunk_text(text, MAX_CHARS)
+
+                    task = dict(book_id=book_id, variant=variant, condition=condition, cache_dir=cache_dir,
+                                base_filename=base_filename, text=text, valence=valence, intensity=intensity,
+                                speed=speed, cached=False, engine_jobs=[], stretch_jobs=0,
+                                est_ms=int(sum(len(c) for c in chunks) * SPEECH_MS_PER_CHAR * 100.0 / speed))
+                    tasks.append(task)
+
+                    # ページの最終wav（単一チャンクならそのチャンク、複数なら全文から作る統合wav）
+                    final_text = chunks[0] if len(chunks) == 1 else text
+                    task["final_path"] = rt._get_cache_path(final_text, valence, intensity, narrator, 0, 1, cache_dir,
+                                                            base_name=base_filename, book_id=book_id, speed=speed)
+
+                    # エンジンで合成する単位（話速変換モードでは _base/ の speed=100 レンダリング）
+                    render_speed = audio_post.BASE_SPEED if stretch_from_base else speed
+                    render_dir = base_dir if stretch_from_base else cache_dir
+                    renders = [(rt._get_cache_path(chunk, valence, intensity, narrator, ci, len(chunks), render_dir,
+                                                   base_name=base_filename, book_id=book_id, speed=render_speed),
+                                rt._cache_hash(chunk, valence, intensity, narrator, render_speed), len(chunk))
+                               for ci, chunk in enumerate(chunks)]
+                    task["render_paths"] = [path for path, _, _ in renders]
+
+                    # 最終wavが既にあれば何もしない
+                    if os.path.exists(task["final_path"]):
+                        task["cached"] = True
+                        continue
+
+                    for render_path, key, chars in renders:
+                        if stretch_from_base and render_speed != speed:
+                            task["stretch_jobs"] += 1
+                        if os.path.exists(render_path) or key in planned_keys:
+                            continue
+                        planned_keys.add(key)
+                        task["engine_jobs"].append((key, chars))
+    return tasks
+
+
+def summarize_plan(tasks: typing.List[dict]) -> dict:
+    """プランの見積もりを集計して表示する。"""
+    pending = [t for t in tasks if not t["cached"]]
+    engine_calls = sum(len(t["engine_jobs"]) for t in pending)
+    engine_chars = sum(chars for t in pending for _, chars in t["engine_jobs"])
+    engine_sec = engine_calls * ENGINE_SEC_PER_CALL + engine_chars * ENGINE_SEC_PER_CHAR
+    audio_sec = sum(t["est_ms"] for t in pending) / 1000.0
+    summary = dict(
+        pages=len(tasks),
+        cached_pages=len(tasks) - len(pending),
+        pending_pages=len(pending),
+        engine_calls=engine_calls,
+        stretch_jobs=sum(t["stretch_jobs"] for t in pending),
+        engine_sec=engine_sec,
+        disk_bytes=int(audio_sec * ENGINE_BYTES_PER_SEC),
+        transfer_bytes=int(audio_sec * TRANSFER_BYTES_PER_SEC),
+    )
+
+    print("-" * 30)
+    print("📋 事前合成プラン")
+    by_dir: typing.Dict[str, typing.List[dict]] = {}
+    for t in tasks:
+        by_dir.setdefault(t["cache_dir"], []).append(t)
+    for cache_dir, dir_tasks in by_dir.items():
+        n_pending = sum(1 for t in dir_tasks if not t["cached"])
+        n_jobs = sum(len(t["engine_jobs"]) for t in dir_tasks)
+        print(f"  {cache_dir}: 未合成 {n_pending}/{len(dir_tasks)} ページ, エンジン呼び出し {n_jobs} 回")
+    print(f"  合計: {summary['pending_pages']}/{summary['pages']} ページが未合成")
+    print(f"  エンジン呼び出し: {summary['engine_calls']} 回 (推定 {summary['engine_sec']:.0f} 秒)")
+    print(f"  話速変換: {summary['stretch_jobs']} チャンク")
+    print(f"  推定ディスク使用量: {summary['disk_bytes'] / 1e6:.1f}MB, 推定転送量: {summary['transfer_bytes'] / 1e6:.1f}MB")
+    print("-" * 30)
+    return summary
+
+
+# ==============================================================================
+# 3. 実行
+# ==============================================================================
+def execute_plan(rt: RobotTools, tasks: typing.List[dict], stretch_from_base: bool = False) -> ChunkRegistry:
+    """未合成のページだけを合成し、転送用wavとジェスチャ（マニフェスト）を用意する。"""
+    registry = ChunkRegistry()
+    touched_dirs: typing.Dict[str, str] = {}
+    t0 = time.monotonic()
+    for t in tasks:
+        if t["cached"]:
+            continue
+        os.makedirs(t["cache_dir"], exist_ok=True)
+        print(f"[{t['cache_dir']}] {t['base_filename']} (speed={t['speed']})")
+        rt.synthesize_and_cache_text(
+            text=t["text"],
+            valence=t["valence"],
+            intensity=t["intensity"],
+            base_filename=t["base_filename"],
+            cache_dir=t["cache_dir"],
+            book_id=t["book_id"],
+            speed=t["speed"],
+            stretch_from_base=stretch_from_base,
+            registry=registry,
+        )
+        touched_dirs[t["cache_dir"]] = t["book_id"]
+
+    for cache_dir, book_id in touched_dirs.items():
+        rt.prepare_transfer_cache(cache_dir=cache_dir, book_id=book_id)
+
+    # ジェスチャは合成したときと同じ valence / intensity で作る（作成済みのものは build_gesture_tracks が飛ばす）
+    gesture_pages: typing.Dict[typing.Tuple[str, str], typing.List[dict]] = {}
+    for t in tasks:
+        if not os.path.isdir(t["cache_dir"]):
+            continue
+        gesture_pages.setdefault((t["cache_dir"], t["book_id"]), []).append(
+            dict(page_number=int(t["base_filename"][len("page"):]), valence=t["valence"], intensity=t["intensity"]))
+    for (cache_dir, book_id), pages in gesture_pages.items():
+        build_gesture_tracks(rt, pages, book_id, cache_dir)
+
+    print(f"✅ 事前合成完了 ({time.monotonic() - t0:.1f}秒) {registry.summary()}")
+    return registry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数の絵本・ストーリー種別・条件をまとめて事前合成する")
+    parser.add_argument("--books", nargs="+", required=True, help="絵本ID (例: suhu inu)")
+    parser.add_argument("--variants", nargs="+", default=["normal"], choices=list(STORY_VARIANTS),
+                        help="ストーリー種別 (STORY_VARIANTS のキー)")
+    parser.add_argument("--conditions", nargs="+", default=["1"], choices=sorted(CONDITIONS.keys()),
+                        help="実験条件 (CONDITIONS のキー)")
+    parser.add_argument("--dry-run", action="store_true", help="見積もりだけ表示して合成しない")
+    parser.add_argument("--stretch", action="store_true",
+                        help="speed=100 の音声をタイムストレッチして各ページの話速を作る（既定: 話速ごとに VOICEPEAK で合成）")
+    args = parser.parse_args()
+
+    stretch = args.stretch
+    rt = RobotTools('0.0.0.0', 0)
+    plan = build_plan(rt, args.books, args.variants, args.conditions, stretch_from_base=stretch)
+    summarize_plan(plan)
+    if not args.dry_run:
+        execute_plan(rt, plan, stretch_from_base=stretch)
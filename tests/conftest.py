@@ -0,0 +1,5 @@
+# リポジトリ直下のモジュール（reading_sim.py など）を tests/ から import できるようにする
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
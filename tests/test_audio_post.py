@@ -0,0 +1,109 @@
+# audio_post.py の無音トリミング・ギャップ正規化・話速変換を合成した配列で確かめる
+import numpy as np
+import pytest
+
+from audio_post import (compress_gaps, duration_ms, measure_dead_time, time_stretch, trim_silence,
+                        wsola_positions)
+
+RATE = 16000
+PARAMS = dict(nchannels=1, sampwidth=2, framerate=RATE, comptype="NONE", compname="not compressed")
+
+
+def silence(ms: int) -> np.ndarray:
+    return np.zeros((RATE * ms // 1000, 1), dtype=np.int16)
+
+
+def tone(ms: int, freq: float = 440.0, amp: float = 0.5) -> np.ndarray:
+    t = np.arange(RATE * ms // 1000) / RATE
+    return np.round(amp * 32767 * np.sin(2 * np.pi * freq * t)).astype(np.int16).reshape(-1, 1)
+
+
+def concat(*parts) -> np.ndarray:
+    return np.concatenate(parts)
+
+
+def test_measure_dead_time():
+    samples = concat(silence(200), tone(300), silence(400))
+    assert measure_dead_time(samples, PARAMS) == (200, 400)
+
+
+def test_trim_keeps_head_and_tail_margin():
+    samples = concat(silence(200), tone(300), silence(400))
+    out = trim_silence(samples, PARAMS, head_ms=30, tail_ms=50)
+    assert duration_ms(out, RATE) == 30 + 300 + 50
+    assert measure_dead_time(out, PARAMS) == (30, 50)
+    # 有音部分はそのまま残る
+    assert np.array_equal(out[RATE * 30 // 1000: RATE * 330 // 1000], tone(300))
+
+
+def test_trim_does_not_add_silence():
+    samples = concat(silence(10), tone(300), silence(20))
+    out = trim_silence(samples, PARAMS, head_ms=30, tail_ms=30)
+    assert np.array_equal(out, samples)
+
+
+def test_all_silent_input_is_left_alone():
+    samples = silence(500)
+    assert measure_dead_time(samples, PARAMS) == (500, 0)
+    assert trim_silence(samples, PARAMS) is samples
+    assert compress_gaps(samples, PARAMS, max_gap_ms=100) is samples
+    empty = silence(0)
+    assert measure_dead_time(empty, PARAMS) == (0, 0)
+    assert len(trim_silence(empty, PARAMS)) == 0
+
+
+def test_compress_gaps_caps_long_gaps_only():
+    samples = concat(tone(100), silence(500), tone(100), silence(80), tone(100))
+    out = compress_gaps(samples, PARAMS, max_gap_ms=120)
+    assert duration_ms(out, RATE) == 100 + 120 + 100 + 80 + 100
+    # 短いギャップはそのまま、長いギャップだけが上限まで縮む
+    head, tail = measure_dead_time(out[RATE * 100 // 1000: RATE * 320 // 1000], PARAMS)
+    assert head == 120 and tail == 0
+
+
+def test_compress_gaps_needs_two_voiced_regions():
+    samples = concat(silence(300), tone(100), silence(600))
+    assert compress_gaps(samples, PARAMS, max_gap_ms=50) is samples
+
+
+def dominant_freq(samples: np.ndarray) -> float:
+    x = samples[:, 0].astype(np.float64) * np.hanning(len(samples))
+    spectrum = np.abs(np.fft.rfft(x))
+    return float(np.fft.rfftfreq(len(x), 1.0 / RATE)[np.argmax(spectrum)])
+
+
+@pytest.mark.parametrize("tempo", [0.5, 1.25, 2.0])
+def test_time_stretch_length_follows_tempo(tempo):
+    samples = tone(1000)
+    out = time_stretch(samples, PARAMS, tempo)
+    assert out.dtype == samples.dtype and out.shape[1] == 1
+    assert len(out) == int(round(len(samples) / tempo))
+
+
+@pytest.mark.parametrize("tempo", [0.5, 1.25, 2.0])
+def test_time_stretch_keeps_pitch(tempo):
+    out = time_stretch(tone(1000, freq=440.0), PARAMS, tempo)
+    # 窓の端を避けて中央部分の周波数を見る（FFT の分解能は 1 / 0.25s = 4Hz）
+    mid = len(out) // 2
+    assert dominant_freq(out[mid - RATE // 8: mid + RATE // 8]) == pytest.approx(440.0, abs=8.0)
+
+
+def test_time_stretch_tiny_inputs():
+    empty = silence(0)
+    assert len(time_stretch(empty, PARAMS, 1.25)) == 0
+    one = np.array([[1000]], dtype=np.int16)
+    assert len(time_stretch(one, PARAMS, 0.5)) == 2
+    assert len(time_stretch(one, PARAMS, 1.25)) == 1
+    assert len(time_stretch(one, PARAMS, 2.0)) == 0
+    assert time_stretch(one, PARAMS, 1.0) is one
+
+
+def test_wsola_positions_stay_in_range():
+    win, tol = 640, 160
+    mono = np.concatenate([tone(500)[:, 0] / 32767.0, np.zeros(win + tol + win // 2)])
+    positions = wsola_positions(mono, RATE, 1.25, win, tol)
+    assert positions[0] == 0
+    assert positions.min() >= 0 and positions.max() <= len(mono) - win
+    # 各フレームは名目位置から tol 以内に置かれる
+    nominal = np.minimum(len(mono) - win, np.round(np.arange(len(positions)) * (win // 2) * 1.25))
+    assert np.all(np.abs(positions - nominal) <= tol)
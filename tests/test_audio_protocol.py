@@ -0,0 +1,155 @@
+# audio_protocol.py の送受信（send_frames / FrameReader）を socketpair で往復させて確かめる
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+from audio_protocol import (FileBody, FrameReader, encode_bundle, encode_playseq, encode_put, expect_line,
+                            parse_event, send_frames)
+
+INT_PAIR = struct.Struct(">iI")
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def send_in_background(sock, parts):
+    """ソケットバッファより大きいフレームでも詰まらないように、送信は別スレッドで行う。"""
+    result = {}
+
+    def run():
+        result["sent"] = send_frames(sock, parts)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+class TrickleSocket(object):
+    """sendmsg が毎回 limit バイトまでしか送らない（部分送信を再現する）ソケットの代わり。"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.data = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, bufs):
+        self.calls += 1
+        budget = self.limit
+        for b in bufs:
+            take = bytes(b[:budget])
+            self.data += take
+            budget -= len(take)
+            if budget == 0:
+                break
+        return self.limit - budget
+
+
+def test_readline_across_partial_reads(pair):
+    a, b = pair
+    reader = FrameReader(b, bufsize=3)
+    for piece in (b"AC", b"K 1", b"2\r\nNO", b"FILE 7 3\n"):
+        a.sendall(piece)
+    assert reader.readline() == b"ACK 12"
+    assert reader.readline() == b"NOFILE 7 3"
+
+
+def test_several_frames_in_one_recv(pair):
+    a, b = pair
+    payload = os.urandom(100)
+    a.sendall(b"STARTED 4 0 1500\nFINISHED 4 0 2700\n" + INT_PAIR.pack(-1, len(payload)) + payload + b"ACK 4\n")
+    reader = FrameReader(b)
+    assert parse_event(reader.readline().split()[2:]) == (0, 1500)
+    assert parse_event(reader.readline().split()[2:]) == (0, 2700)
+    assert INT_PAIR.unpack(reader.read_exact(INT_PAIR.size)) == (-1, 100)
+    assert reader.read_exact(100) == payload
+    expect_line(reader, b"ACK 4", "closed")
+
+
+def test_line_too_long(pair):
+    a, b = pair
+    a.sendall(b"x" * 300)
+    with pytest.raises(RuntimeError, match="too long"):
+        FrameReader(b).readline(max_len=256)
+
+
+def test_expect_line_errors(pair):
+    a, b = pair
+    reader = FrameReader(b)
+    a.sendall(b"ERR 9 2\n")
+    with pytest.raises(RuntimeError, match="unexpected"):
+        expect_line(reader, b"ACK 9", "closed")
+    a.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        expect_line(reader, b"ACK 9", "closed")
+    with pytest.raises(ConnectionError):
+        reader.read_exact(1)
+
+
+def test_put_with_file_body_round_trip(pair, tmp_path):
+    a, b = pair
+    data = os.urandom(1_000_003)   # ソケットバッファより大きい
+    path = tmp_path / "page.wav"
+    path.write_bytes(data)
+
+    parts = encode_put("bk_page01", FileBody(str(path)), 2500, req_id="3")
+    thread, result = send_in_background(a, parts)
+    reader = FrameReader(b)
+    assert reader.readline() == b"PUT 3 bk_page01"
+    assert INT_PAIR.unpack(reader.read_exact(INT_PAIR.size)) == (2500, len(data))
+    assert reader.read_exact(len(data)) == data
+    thread.join()
+    assert result["sent"] == len(b"PUT 3 bk_page01\n") + INT_PAIR.size + len(data)
+
+
+def test_bundle_mixing_bytes_and_files(pair, tmp_path):
+    a, b = pair
+    files = []
+    for i in range(3):
+        path = tmp_path / f"{i}.wav"
+        path.write_bytes(os.urandom(70_000 + i))
+        files.append(path)
+    inline = os.urandom(500)
+    items = [("k0", 100, FileBody(str(files[0]))), ("k1", 200, inline),
+             ("k2", 300, FileBody(str(files[1]))), ("k3", 400, FileBody(str(files[2])))]
+
+    thread, _ = send_in_background(a, encode_bundle(items))
+    reader = FrameReader(b, bufsize=1000)
+    assert reader.readline() == b"BUNDLE"
+    assert struct.unpack(">I", reader.read_exact(4)) == (4,)
+    for key, duration_ms, body in items:
+        expected = body if isinstance(body, bytes) else open(body.path, "rb").read()
+        assert reader.readline() == key.encode()
+        assert INT_PAIR.unpack(reader.read_exact(INT_PAIR.size)) == (duration_ms, len(expected))
+        assert reader.read_exact(len(expected)) == expected
+    thread.join()
+
+
+def test_partial_sendmsg_resumes_mid_buffer():
+    sock = TrickleSocket(limit=7)
+    parts = encode_playseq([("a", 10), ("bb", 20)], req_id="1") + [b"", b"tail", bytearray(b"-end")]
+    sent = send_frames(sock, parts)
+    expected = b"".join(bytes(p) for p in parts)
+    assert bytes(sock.data) == expected
+    assert sent == len(expected)
+    assert sock.calls == -(-len(expected) // 7)
+
+
+def test_fallback_without_sendmsg():
+    class PlainSocket(object):
+        def __init__(self):
+            self.data = bytearray()
+
+        def sendall(self, b):
+            self.data += b
+
+    sock = PlainSocket()
+    assert send_frames(sock, [b"HAS k\n", memoryview(b"xyz")]) == 9
+    assert bytes(sock.data) == b"HAS k\nxyz"
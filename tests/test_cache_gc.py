@@ -0,0 +1,96 @@
+# cache_gc.collect_garbage が破損・参照なし・容量超過のwavを正しい順番で消すか確かめる
+import os
+import wave
+
+import pytest
+
+from cache_gc import collect_garbage, referenced_paths
+from speech_cache import SpeechCacheManifest, base_render_dir, transfer_path
+
+NFRAMES = 1600
+
+
+def write_wav(path: str) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b"\x01\x00" * NFRAMES)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """
+    a, b: 現在のプランのページ（a の方が最終使用が古い）。両方に転送用wavがあり、a は _base/ から作られている
+    old: 古いパラメータのページ（プランから参照されない）、broken: 書き込み途中で止まったページ
+    """
+    cache_dir = str(tmp_path / "bk_1_speech_cache")
+    paths = dict(
+        a=write_wav(os.path.join(cache_dir, "bk_page01__aaaa.wav")),
+        b=write_wav(os.path.join(cache_dir, "bk_page03__bbbb.wav")),
+        old=write_wav(os.path.join(cache_dir, "bk_page01__0000.wav")),
+        broken=write_wav(os.path.join(cache_dir, "bk_page05__dddd.wav")),
+    )
+    paths["a_base"] = write_wav(os.path.join(base_render_dir(cache_dir), "bk_page01__base.wav"))
+    for name in ("a", "b", "old"):
+        paths[name + "_tx"] = write_wav(transfer_path(paths[name], 16000))
+    with open(paths["broken"], "r+b") as f:
+        f.truncate(os.path.getsize(paths["broken"]) - 100)
+
+    manifest = SpeechCacheManifest(cache_dir)
+    for name, last_used in (("a", 100.0), ("b", 200.0), ("old", 300.0), ("broken", 50.0)):
+        manifest.update(paths[name], duration_ms=100, last_used=last_used)
+    manifest.save()
+
+    plan = [dict(final_path=paths["a"], render_paths=[paths["a_base"]]),
+            dict(final_path=paths["b"], render_paths=[]),
+            dict(final_path=paths["broken"], render_paths=[])]
+    return cache_dir, paths, referenced_paths(plan)
+
+
+def remaining(paths: dict) -> set:
+    return {name for name, path in paths.items() if os.path.exists(path)}
+
+
+def test_removes_corrupt_and_orphans_and_prunes_manifest(cache):
+    cache_dir, paths, refs = cache
+    result = collect_garbage([cache_dir], refs)
+
+    assert result["corrupt"] == [paths["broken"]]
+    # 参照されないページの転送用wavも元のページと一緒に消える
+    assert sorted(result["orphan"]) == sorted([paths["old"], paths["old_tx"]])
+    assert result["evicted"] == []
+    assert remaining(paths) == {"a", "a_tx", "a_base", "b", "b_tx"}
+    assert sorted(SpeechCacheManifest(cache_dir).names()) == ["bk_page01__aaaa.wav", "bk_page03__bbbb.wav"]
+
+
+def test_dry_run_removes_nothing(cache):
+    cache_dir, paths, refs = cache
+    result = collect_garbage([cache_dir], refs, budget_bytes=0, dry_run=True)
+    assert result["corrupt"] and result["orphan"] and result["evicted"]
+    assert remaining(paths) == set(paths)
+    assert len(SpeechCacheManifest(cache_dir).names()) == 4
+
+
+@pytest.mark.parametrize("keep, expected", [
+    (5, {"a", "a_tx", "a_base", "b", "b_tx"}),
+    (4, {"a", "a_base", "b", "b_tx"}),     # 転送用wavから、最終使用が古い順に
+    (3, {"a", "a_base", "b"}),
+    (2, {"a_base", "b"}),                  # 次にページ用wav（最終使用が古い a から）
+    (1, {"a_base"}),                       # _base/ のレンダリングは最後まで残す
+    (0, set()),
+])
+def test_budget_evicts_cheapest_tier_first(cache, keep, expected):
+    cache_dir, paths, refs = cache
+    size = os.path.getsize(paths["a"])
+    result = collect_garbage([cache_dir], refs, budget_bytes=keep * size)
+
+    assert remaining(paths) == expected
+    assert result["bytes_after"] == keep * size
+    assert len(result["evicted"]) == 5 - keep
+    # 消したページ用wavのエントリはマニフェストからも消える
+    names = set(SpeechCacheManifest(cache_dir).names())
+    assert ("bk_page01__aaaa.wav" in names) == ("a" in expected)
+    assert ("bk_page03__bbbb.wav" in names) == ("b" in expected)
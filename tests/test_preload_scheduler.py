@@ -0,0 +1,65 @@
+# PreloadScheduler がプランの先読み時刻（preload.start_ms）に従って送るか、実時間の短いプランで確かめる
+import time
+
+import pytest
+
+from preload_scheduler import PreloadScheduler
+
+
+class FakeRobotTools(object):
+    """PreloadScheduler が使う2つのメソッドだけのスタンドイン。送信した時刻（origin からの秒数）を記録する。"""
+
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.puts = []
+
+    def _page_upload_items(self, base_filename, cache_dir, book_id):
+        return [(f"{base_filename}__000", 1000, b"\0" * 1000)]
+
+    def _put_items(self, items, timeout):
+        self.puts.append((items[0][0].split("__")[0], time.monotonic() - self.origin))
+        return sum(len(data) for _, _, data in items)
+
+
+@pytest.fixture
+def rt():
+    return FakeRobotTools()
+
+
+def make_scheduler(rt, starts_ms):
+    schedule = {f"page{2 * i + 1:02d}": dict(start_ms=start, deadline_ms=start + 300, eta_ms=1)
+                for i, start in enumerate(starts_ms)}
+    return PreloadScheduler(rt, list(schedule), "cache", "test", horizon_sec=60.0,
+                            schedule=schedule, origin=rt.origin)
+
+
+def test_pages_are_sent_at_their_planned_start(rt):
+    scheduler = make_scheduler(rt, [0, 200, 400])
+    try:
+        assert scheduler.wait_resident("page01", 5)
+        scheduler.notify_playing("page01")
+        # 先のページは送信開始時刻までは送らない（horizon 60秒の範囲内でも）
+        time.sleep(0.1)
+        assert [base for base, _ in rt.puts] == ["page01"]
+        assert scheduler.wait_resident("page03", 5)
+        scheduler.notify_finished("page01")
+        scheduler.notify_playing("page03")
+        assert scheduler.wait_resident("page05", 5)
+    finally:
+        scheduler.stop()
+
+    sent = dict(rt.puts)
+    assert list(sent) == ["page01", "page03", "page05"]
+    assert sent["page03"] == pytest.approx(0.2, abs=0.1) and sent["page03"] >= 0.2
+    assert sent["page05"] == pytest.approx(0.4, abs=0.1) and sent["page05"] >= 0.4
+
+
+def test_waiting_does_not_pull_a_page_ahead_of_its_start(rt):
+    scheduler = make_scheduler(rt, [0, 5000, 5000])
+    try:
+        assert scheduler.wait_resident("page01", 5)
+        # 送信開始前のページを待っても最優先にはならない（プランの時刻まで送らない）
+        assert not scheduler.wait_resident("page05", 0.3)
+    finally:
+        scheduler.stop()
+    assert [base for base, _ in rt.puts] == ["page01"]
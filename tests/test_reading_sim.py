@@ -0,0 +1,159 @@
+# reading_sim.py の仮想時計シミュレーションで、読み聞かせの実行がプラン（session_plan.compile_plan）どおりに進むか確かめる
+import os
+import time
+
+import pytest
+
+from audio_protocol import MIN_WAIT_MS
+from reading_session import load_checkpoint, save_checkpoint
+from reading_sim import SimBrowser, SimRobot, run_simulation
+from session_plan import compile_plan
+
+
+class FakeRobotTools(object):
+    """compile_plan が使うキャッシュ検索だけのスタンドイン。チャンクの長さ [ms] をページごとに指定する。"""
+
+    def __init__(self, cache_dir: str, chunk_ms: dict):
+        self.cache_dir = cache_dir
+        self.chunk_ms = chunk_ms   # base_filename -> [ms, ...]
+        self.durations = {}
+
+    def _get_cached_chunk_files(self, base_filename, cache_dir, book_id=None):
+        paths = []
+        for i, ms in enumerate(self.chunk_ms.get(base_filename, [])):
+            path = os.path.join(cache_dir, f"{book_id}_{base_filename}_{i + 1}__test.wav")
+            with open(path, "wb") as f:
+                f.write(b"\0" * (ms * 32))   # 16kHz / 16bit 相当のバイト数
+            self.durations[path] = ms
+            paths.append(path)
+        return paths
+
+    def _get_transfer_file(self, wav_path):
+        return wav_path
+
+    def _calc_wav_duration_ms(self, wav_path):
+        return self.durations[wav_path]
+
+
+def make_plan(tmp_path, chunk_ms_per_page, flip_duration_ms=800, **kwargs):
+    story = [dict(page_number=n, text=f"page {n}", flip_duration=flip_duration_ms)
+             for n in range(1, 2 * len(chunk_ms_per_page) + 1)]
+    chunk_ms = {f"page{2 * i + 1:02d}": chunks for i, chunks in enumerate(chunk_ms_per_page)}
+    rt = FakeRobotTools(str(tmp_path), chunk_ms)
+    return compile_plan(rt, story, "test", str(tmp_path), startup_wait_sec=2.0, gestures=False, **kwargs)
+
+
+def page_gaps(session):
+    """ページごとの (前ページの audio_end から次ページの audio_start までの秒数)。"""
+    ends = {p: t for t, p, e in session.timeline if e == "audio_end"}
+    starts = {p: t for t, p, e in session.timeline if e == "audio_start"}
+    pages = sorted(starts)
+    return [starts[b] - ends[a] for a, b in zip(pages, pages[1:])]
+
+
+def test_runs_exactly_on_plan_without_latency(tmp_path):
+    plan = make_plan(tmp_path, [[2000, 1500], [3000], [1200, 800, 900]])
+    session = run_simulation(plan)
+    drift = session.drift()
+    assert drift
+    assert max(abs(d) for _, _, d in drift) < 1e-6
+    assert session.timeline[-1][0] == pytest.approx(plan["total_ms"] / 1000.0)
+
+
+def test_short_chunks_use_the_robot_min_wait(tmp_path):
+    # Sota は1チャンクを最低 MIN_WAIT_MS 待つので、プランも同じ長さで組まれていないとずれる
+    short = MIN_WAIT_MS // 3
+    plan = make_plan(tmp_path, [[short, short, 2000], [short], [1500]])
+    session = run_simulation(plan)
+    assert max(abs(d) for _, _, d in session.drift()) < 1e-6
+
+
+def test_gaps_stay_within_flip_bounds_with_latency(tmp_path):
+    flip_ms = 800
+    plan = make_plan(tmp_path, [[2500], [1800, 1200], [3000], [900]], flip_duration_ms=flip_ms)
+    robot = SimRobot(plan, bandwidth_bps=2e6, audio_latency_ms=20, motion_latency_ms=30)
+    browser = SimBrowser(command_latency_ms=5, ack_latency_ms=5)
+    session = run_simulation(plan, robot=robot, browser=browser)
+
+    planned = [b["audio_start_ms"] / 1000.0 - a["audio_end_ms"] / 1000.0
+               for a, b in zip(plan["pages"], plan["pages"][1:])]
+    for gap, expected in zip(page_gaps(session), planned):
+        assert expected - 0.05 <= gap <= expected + 0.1
+    assert max(d for _, _, d in session.drift()) < 0.2
+
+
+def test_preload_follows_the_planned_times(tmp_path):
+    plan = make_plan(tmp_path, [[2000], [2000], [2000], [2000]], preload_horizon_sec=1.0, throughput_bps=1e6)
+    link_free = 0
+    for page in plan["pages"]:
+        preload = page["preload"]
+        assert preload["deadline_ms"] == page["audio_start_ms"]
+        assert preload["eta_ms"] == 64            # 2000ms x 32 bytes/ms を 1MB/s で送る
+        assert preload["start_ms"] == max(0, page["audio_start_ms"] - 1000, link_free)
+        link_free = preload["start_ms"] + preload["eta_ms"]
+    assert plan["preload_horizon_ms"] == 1000
+
+    # 一括先読みなしでも、各ページはプランの送信開始より前には送られず、再生開始には間に合う
+    robot = SimRobot(plan, bandwidth_bps=1e6, bundle=False)
+    session = run_simulation(plan, robot=robot)
+    put_at = {base: t for t, kind, base in robot.events if kind == "put"}
+    for page in plan["pages"]:
+        preload = page["preload"]
+        assert (preload["start_ms"] + preload["eta_ms"]) / 1000.0 <= put_at[page["base"]] + 1e-6
+        assert put_at[page["base"]] <= preload["deadline_ms"] / 1000.0
+    assert max(abs(d) for _, _, d in session.drift()) < 1e-6
+
+
+def test_no_browser_does_not_wait_for_page_turned(tmp_path):
+    plan = make_plan(tmp_path, [[2000], [2000], [2000]])
+    session = run_simulation(plan, browser=SimBrowser(browsers=0))
+    assert max(abs(d) for _, _, d in session.drift()) < 1e-6
+
+
+def test_failed_page_does_not_end_the_session(tmp_path):
+    plan = make_plan(tmp_path, [[2000], [2000], [2000]])
+    failing = plan["pages"][1]["chunks"][0]["key"]
+
+    class FlakyRobot(SimRobot):
+        async def play_keys_with_events(self, items, on_event=None, timeout=300.0):
+            if items[0][0] == failing:
+                raise RuntimeError("playback failed at index 0")
+            return await super().play_keys_with_events(items, on_event, timeout)
+
+    session = run_simulation(plan, robot=FlakyRobot(plan))
+    events = [e for _, _, e in session.timeline]
+    assert events.count("audio_failed") == 1
+    assert events.count("audio_end") == len(plan["pages"])
+    assert events[-1] == "session_end"
+
+
+def test_checkpoint_resume_and_fresh_run(tmp_path):
+    plan = make_plan(tmp_path, [[2000], [2000], [2000]])
+    path = str(tmp_path / "_checkpoint.json")
+    second = plan["pages"][1]["page_number"]
+
+    def write_checkpoint(age_sec=0.0):
+        save_checkpoint(path, dict(book_id=plan["book_id"], next_page=second, last_read_page=1,
+                                   saved_at=time.time() - age_sec))
+
+    # 古いチェックポイントからは再開しない（次の回を途中から始めない）
+    write_checkpoint(age_sec=24 * 3600)
+    assert load_checkpoint(path, plan) is None
+
+    write_checkpoint()
+    assert load_checkpoint(path, plan)["next_page"] == second
+    session = run_simulation(plan, start_page=second, checkpoint_path=path)
+    assert session.pages[0].page_number == second
+    assert load_checkpoint(path, plan) is None   # 読み終えた
+
+    # 最初から読む回は、最初のページを読む前に前の回のチェックポイントを消す
+    write_checkpoint()
+    seen = []
+
+    class CheckingRobot(SimRobot):
+        async def play_keys_with_events(self, items, on_event=None, timeout=300.0):
+            seen.append(os.path.exists(path))
+            return await super().play_keys_with_events(items, on_event, timeout)
+
+    run_simulation(plan, robot=CheckingRobot(plan), checkpoint_path=path)
+    assert seen[0] is False
@@ -0,0 +1,41 @@
+# synth_planner.py の事前合成が、読み聞かせ側（session_plan.py）の読むキャッシュにジェスチャまで用意することを確かめる
+import json
+
+import synth_planner
+from gesture_track import GESTURE_VERSION
+from robottools3 import RobotTools
+from session_plan import compile_plan
+from speech_cache import SpeechCacheManifest
+from tts_engine import LocalEngine
+
+STORY = [
+    dict(page_number=1, text="むかし むかし、あるところに おじいさんが いました。", valence=0.4, intensity=0.6,
+         flip_duration=600),
+    dict(page_number=2, text="", flip_duration=600),
+    dict(page_number=3, text="おじいさんは まいにち やまへ いきました。", valence=-0.3, intensity=0.5,
+         flip_duration=900),
+]
+
+
+def test_execute_plan_builds_gestures_in_runtime_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / synth_planner.story_file_path("demo", "normal")).write_text(
+        json.dumps(STORY, ensure_ascii=False), encoding="utf-8")
+    rt = RobotTools('0.0.0.0', 0, tts_engine=LocalEngine())
+
+    tasks = synth_planner.build_plan(rt, ["demo"], ["normal"], ["1"])
+    synth_planner.execute_plan(rt, tasks)
+
+    cache_dir = synth_planner.cache_dir_for("demo", "normal", "1")
+    assert {t["cache_dir"] for t in tasks} == {cache_dir}
+    plan = compile_plan(rt, STORY, "demo", cache_dir)
+    read_pages = [p for p in plan["pages"] if p["page_number"] % 2 == 1]
+    assert len(read_pages) == 2
+    # LocalEngine の正弦波は抑揚がないのでキーフレームは空になりうる。compile_plan が引く項目があることを見る
+    manifest = SpeechCacheManifest(cache_dir)
+    for page, item in zip(read_pages, [STORY[0], STORY[2]]):
+        for chunk in page["chunks"]:
+            gesture = manifest.get(chunk["file"]).get("gesture")
+            assert gesture["version"] == GESTURE_VERSION
+            assert (gesture["valence"], gesture["intensity"]) == (item["valence"], item["intensity"])
+
@@ -0,0 +1,95 @@
+# text_chunker.py のチャンク分割（DP による詰め込み）と ChunkRegistry による重複排除を確かめる
+import os
+
+from robottools3 import RobotTools
+from text_chunker import ChunkRegistry, _pack, chunk_text, normalize_text
+from tts_engine import LocalEngine
+
+
+def test_pack_uses_fewest_chunks_then_balances():
+    pieces = ["a" * 6, "b" * 2, "c" * 2, "d" * 6]
+    # 先頭から貪欲に詰めると 10 + 6 になるが、同じ2チャンクなら 8 + 8 を選ぶ
+    assert _pack(pieces, 10, "") == ["a" * 6 + "bb", "cc" + "d" * 6]
+    assert _pack(["a" * 5, "b" * 5, "c" * 4, "d" * 4], 10, "") == ["a" * 5 + "b" * 5, "c" * 4 + "d" * 4]
+    assert _pack([], 10, "") == []
+
+
+def test_chunk_text_keeps_sentences_whole():
+    sentence = "あ" * 50 + "。"
+    chunks = chunk_text(sentence * 5, max_chars=140)
+    assert len(chunks) == 3
+    assert "".join(chunks) == sentence * 5
+    for chunk in chunks:
+        assert len(chunk) <= 140
+        assert len(chunk) % len(sentence) == 0
+
+
+def test_over_limit_sentence_is_split_at_clauses_then_by_length():
+    sentence = "い" * 90 + "、" + "う" * 90 + "。"
+    assert chunk_text(sentence, max_chars=140) == ["い" * 90 + "、", "う" * 90 + "。"]
+
+    unbroken = "え" * 300 + "。"
+    chunks = chunk_text(unbroken, max_chars=140)
+    assert len(chunks) == 3
+    assert all(len(c) <= 140 for c in chunks)
+    assert "".join(chunks) == unbroken
+
+
+def test_normalized_text_gives_same_chunks_and_key():
+    raw = "むかし　　むかし、 あるところに・・・。\nおじいさんが  いました。"
+    clean = "むかし むかし、 あるところに...。\nおじいさんが いました。"
+    assert chunk_text(raw) == chunk_text(clean)
+    assert normalize_text(raw) == normalize_text(clean)
+
+    rt = RobotTools('0.0.0.0', 0, tts_engine=LocalEngine())
+    assert rt._cache_hash(raw, 0.2, 0.3, "Japanese Female 1") == rt._cache_hash(clean, 0.2, 0.3, "Japanese Female 1")
+    assert rt._cache_hash(raw, 0.2, 0.3, "Japanese Female 1") != rt._cache_hash(raw + "ね", 0.2, 0.3, "Japanese Female 1")
+
+
+def test_registry_lookup_and_relocate(tmp_path):
+    chunk = tmp_path / "chunk.wav"
+    merged = tmp_path / "merged.wav"
+    chunk.write_bytes(b"x")
+    merged.write_bytes(b"xy")
+
+    registry = ChunkRegistry()
+    assert registry.lookup("k") is None
+    registry.register("k", str(chunk))
+    registry.register("k", str(merged))   # 最初のファイルを使い続ける
+    assert registry.lookup("k") == str(chunk) and registry.span("k") is None
+
+    registry.relocate(str(chunk), str(merged), (100, 50))
+    chunk.unlink()
+    assert registry.has("k")
+    assert registry.lookup("k") == str(merged) and registry.span("k") == (100, 50)
+    assert (registry.hits, registry.misses) == (2, 1)
+
+    merged.unlink()
+    assert not registry.has("k")
+    registry.register("k", str(chunk))   # ファイルが消えていれば置き換える
+    assert registry.span("k") is None
+
+
+def test_registry_dedups_chunks_across_pages(tmp_path):
+    engine = LocalEngine(ms_per_char=10.0)
+    rt = RobotTools('0.0.0.0', 0, tts_engine=engine)
+    registry = ChunkRegistry()
+    page01 = "むかしむかし、あるところに。" * 10 + "おじいさんがいました。"
+    page03 = "むかしむかし、あるところに。" * 10 + "おばあさんもいました。"
+    first, _ = chunk_text(page01)
+    assert chunk_text(page03)[0] == first
+    cache_dir = str(tmp_path)
+
+    for base_filename, text in (("page01", page01), ("page03", page03), ("page05", first)):
+        rt.synthesize_and_cache_text(text, 0.2, 0.3, cache_dir=cache_dir, book_id="bk",
+                                     base_filename=base_filename, registry=registry)
+
+    # 共通チャンクは1回だけ合成し、統合後も統合wav内の位置から再利用する
+    assert engine.calls == 3
+    assert registry.hits == 2
+    pages = {p: rt._get_cached_chunk_files(p, cache_dir, "bk") for p in ("page01", "page03", "page05")}
+    assert all(len(paths) == 1 for paths in pages.values())
+    assert not os.path.exists(os.path.join(cache_dir, "_base"))
+    # 統合wavから切り出したチャンクは、1チャンクのページとしてそのまま使える
+    assert rt._calc_wav_duration_ms(pages["page05"][0]) > 0
+    assert rt._calc_wav_duration_ms(pages["page01"][0]) > rt._calc_wav_duration_ms(pages["page05"][0])
@@ -0,0 +1,141 @@
+# text_chunker.py: 合成用テキストの正規化・チャンク分割・重複排除
+import os
+import re
+import typing
+
+# VOICEPEAK に1回で渡す最大文字数
+MAX_CHARS = 140
+
+# 文の区切り（区切り文字は前の文に含める）
+_SENTENCE_SPLIT = re.compile(r'(?<=[。！？\n])')
+# 文が長すぎる場合の副次的な区切り
+_CLAUSE_SPLIT = re.compile(r'(?<=[、，,　 ])')
+
+
+def normalize_text(text: str) -> str:
+    """合成前のテキストクリーンアップ（全角スペース・三点リーダ・連続空白）。キー計算の前に必ず通す。"""
+    clean = re.sub(r'　+', ' ', text).strip()
+    clean = clean.replace('・・・・・・', '...').replace('・・・', '...')
+    return re.sub(r'\s+', ' ', clean)
+
+
+def split_sentences(text: str) -> typing.List[str]:
+    """句点・感嘆符・疑問符・改行で文に分け、各文を正規化して返す（空文は除く）。"""
+    sentences = []
+    for segment in _SENTENCE_SPLIT.split(text):
+        clean = normalize_text(segment)
+        if clean:
+            sentences.append(clean)
+    return sentences
+
+
+def _pack(pieces: typing.List[str], max_chars: int, sep: str) -> typing.List[str]:
+    """
+    pieces を順序を保ったまま max_chars 以内のチャンクに詰める。
+    チャンク数を最小にし、同数なら各チャンクの余り（max_chars - 長さ）の二乗和が最小になる分け方を選ぶ
+    （後半だけ極端に短いチャンクができないように）。O(n^2) の動的計画法。
+    pieces の各要素は max_chars 以下である前提。
+    """
+    n = len(pieces)
+    if n == 0:
+        return []
+    INF = (float("inf"), float("inf"))
+    best: typing.List[typing.Tuple[float, float]] = [INF] * (n + 1)
+    prev = [0] * (n + 1)
+    best[0] = (0, 0)
+    for j in range(1, n + 1):
+        length = -len(sep)
+        for i in range(j - 1, -1, -1):
+            length += len(pieces[i]) + len(sep)
+            if length > max_chars:
+                break
+            count, slack = best[i]
+            cand = (count + 1, slack + (max_chars - length) ** 2)
+            if cand < best[j]:
+                best[j] = cand
+                prev[j] = i
+
+    chunks = []
+    j = n
+    while j > 0:
+        i = prev[j]
+        chunks.append(sep.join(pieces[i:j]))
+        j = i
+    chunks.reverse()
+    return chunks
+
+
+def _split_long_sentence(sentence: str, max_chars: int) -> typing.List[str]:
+    """max_chars を超える1文を読点・空白で分け、それでも長い部分だけ文字数で切る。"""
+    pieces: typing.List[str] = []
+    for clause in _CLAUSE_SPLIT.split(sentence):
+        if not clause:
+            continue
+        while len(clause) > max_chars:
+            pieces.append(clause[:max_chars])
+            clause = clause[max_chars:]
+        if clause:
+            pieces.append(clause)
+    return [p.strip() for p in _pack(pieces, max_chars, "") if p.strip()]
+
+
+def chunk_text(text: str, max_chars: int = MAX_CHARS) -> typing.List[str]:
+    """
+    テキストを合成用チャンクに分ける。
+    - 正規化してから文に分割する（同じ内容なら同じチャンク・同じキーになる）
+    - 文の途中では切らない（1文が max_chars を超える場合のみ読点等で分割）
+    - エンジン呼び出し回数（チャンク数）が最小になるように文を詰める
+    """
+    pieces: typing.List[str] = []
+    for sentence in split_sentences(text):
+        if len(sentence) > max_chars:
+            pieces.extend(_split_long_sentence(sentence, max_chars))
+        else:
+            pieces.append(sentence)
+    # 文末は句読点なので、文同士はそのまま連結する（間はエンジン側が句点で取る）
+    return _pack(pieces, max_chars, "")
+
+
+class ChunkRegistry(object):
+    """
+    1回の合成実行（複数ページ・複数絵本）の中で、同じ内容のチャンクを1回だけ合成するための台帳。
+    キーは正規化テキストと実効パラメータから作ったハッシュ（RobotTools._cache_hash）。
+    チャンクが統合wavに取り込まれた後は、統合wav内の位置 (開始フレーム, フレーム数) で参照する。
+    """
+
+    def __init__(self):
+        self._rendered: typing.Dict[str, typing.Tuple[str, typing.Optional[typing.Tuple[int, int]]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: str) -> typing.Optional[str]:
+        """合成済みならそのファイルパスを返す（ファイルが消えていれば None）。統合wav内の位置は span() で取る。"""
+        if self.has(key):
+            self.hits += 1
+            return self._rendered[key][0]
+        self.misses += 1
+        return None
+
+    def span(self, key: str) -> typing.Optional[typing.Tuple[int, int]]:
+        """統合wav内の (開始フレーム, フレーム数)。ファイル全体がそのチャンクなら None。"""
+        entry = self._rendered.get(key)
+        return entry[1] if entry is not None else None
+
+    def has(self, key: str) -> bool:
+        """登録済みで、ファイルが残っているか（統計には数えない）。"""
+        entry = self._rendered.get(key)
+        return entry is not None and os.path.exists(entry[0])
+
+    def register(self, key: str, path: str, span: typing.Optional[typing.Tuple[int, int]] = None) -> None:
+        """最初に登録したファイルを使い続ける（消えていれば新しいパスに置き換える）。"""
+        if not self.has(key):
+            self._rendered[key] = (path, span)
+
+    def relocate(self, old_path: str, new_path: str, span: typing.Tuple[int, int]) -> None:
+        """old_path（統合後に削除されるチャンク）を参照しているキーを、統合wav new_path 内の span に付け替える。"""
+        for key, (path, old_span) in self._rendered.items():
+            if path == old_path and old_span is None:
+                self._rendered[key] = (new_path, span)
+
+    def summary(self) -> str:
+        return f"重複排除: {self.hits} 件再利用 / {self.misses} 件合成対象 (ユニーク {len(self._rendered)} 件)"
@@ -0,0 +1,106 @@
+# tts_engine.py: 音声合成エンジンの抽象化（VOICEPEAK / ローカル代替エンジン）
+import abc
+import hashlib
+import os
+import time
+import typing
+import wave
+
+import numpy as np
+
+import voicepeak_cli_min
+from voicepeak_cli_min import engine_params
+
+
+class TTSEngine(abc.ABC):
+    """
+    synthesize_and_cache_text から呼ばれる音声合成エンジンの共通インターフェース。
+    synth() は out_path に wav を書き出し、実際に使ったパラメータを dict で返す。
+    """
+    name = "base"
+    # キャッシュキーに混ぜるタグ（空文字なら混ぜない = VOICEPEAK の既存キャッシュと互換）
+    cache_tag = ""
+
+    @abc.abstractmethod
+    def synth(self, text: str, narrator: str, valence: float = 0.0, intensity: float = 0.0,
+              speed: int = 100, out_path: str = "out.wav",
+              emotion_step: int = 1, pitch_step: int = 1) -> dict:
+        raise NotImplementedError
+
+
+class VoicepeakEngine(TTSEngine):
+    """VOICEPEAK CLI（voicepeak_cli_min.synth）を呼ぶエンジン。"""
+    name = "voicepeak"
+    cache_tag = ""
+
+    def synth(self, text, narrator, valence=0.0, intensity=0.0, speed=100, out_path="out.wav",
+              emotion_step=1, pitch_step=1):
+        return voicepeak_cli_min.synth(text=text, narrator=narrator, valence=valence, intensity=intensity,
+                                       speed=speed, out_path=out_path,
+                                       emotion_step=emotion_step, pitch_step=pitch_step)
+
+
+class LocalEngine(TTSEngine):
+    """
+    VOICEPEAK なしで動く決定的な代替エンジン（テスト・ベンチマーク用）。
+    - 長さ: 文字数 × ms_per_char × (100 / speed) + 前後の無音
+    - 内容: テキストのハッシュと pitch から決まる正弦波（同じ入力なら同じバイト列）
+    - フォーマット: VOICEPEAK 出力と同じ 48kHz / モノラル / 16bit
+    latency_sec を指定すると、エンジン呼び出しの所要時間を模擬する。
+    """
+    name = "local"
+    cache_tag = "local"
+
+    def __init__(self, framerate: int = 48000, ms_per_char: float = 130.0,
+                 lead_ms: int = 150, trail_ms: int = 250, latency_sec: float = 0.0):
+        self.framerate = framerate
+        self.ms_per_char = ms_per_char
+        self.lead_ms = lead_ms
+        self.trail_ms = trail_ms
+        self.latency_sec = latency_sec
+        self.calls = 0
+
+    def expected_duration_ms(self, text: str, speed: int = 100) -> int:
+        """synth が書き出す wav の長さ [ms]（前後の無音を含む）。"""
+        speed_int = engine_params(speed=speed)["speed"]
+        voiced_ms = int(len(text) * self.ms_per_char * 100.0 / speed_int)
+        return self.lead_ms + voiced_ms + self.trail_ms
+
+    def synth(self, text, narrator, valence=0.0, intensity=0.0, speed=100, out_path="out.wav",
+              emotion_step=1, pitch_step=1):
+        params = engine_params(valence, intensity, speed, emotion_step, pitch_step)
+        self.calls += 1
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+
+        fr = self.framerate
+        seed = int(hashlib.sha256(f"{text}|{narrator}".encode("utf-8")).hexdigest()[:8], 16)
+        freq = (180.0 + seed % 120) * (2.0 ** (params["pitch"] / 300.0))
+        amp = 8000 + 40 * (params["happy"] - params["sad"])
+
+        lead = int(fr * self.lead_ms / 1000)
+        trail = int(fr * self.trail_ms / 1000)
+        n_total = int(fr * self.expected_duration_ms(text, params["speed"]) / 1000)
+        n_voiced = max(0, n_total - lead - trail)
+
+        voiced = (amp * np.sin(2.0 * np.pi * freq * np.arange(n_voiced) / fr)).astype("<i2")
+        with wave.open(out_path, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(fr)
+            wf.writeframes(b"\x00\x00" * lead + voiced.tobytes() + b"\x00\x00" * trail)
+
+        return {"out_path": out_path, **params}
+
+
+def get_engine(name: typing.Optional[str] = None) -> TTSEngine:
+    """
+    名前からエンジンを作る。省略時は環境変数 TTS_ENGINE（既定: voicepeak）。
+    例: TTS_ENGINE=local python pre_synthesize.py
+    """
+    name = (name or os.environ.get("TTS_ENGINE", "voicepeak")).lower()
+    if name == "voicepeak":
+        return VoicepeakEngine()
+    if name == "local":
+        return LocalEngine()
+    raise ValueError(f"未知の音声合成エンジンです: {name}")
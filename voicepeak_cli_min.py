@@ -1,9 +1,23 @@
 # voicepeak_cli_min.py
 import subprocess, os, tempfile, shutil
 
-VP = "/Applications/voicepeak.app/Contents/MacOS/voicepeak"
+# 環境変数 VOICEPEAK_PATH で上書き可能（macOS 以外の環境やインストール先が異なる場合）
+VP = os.environ.get("VOICEPEAK_PATH", "/Applications/voicepeak.app/Contents/MacOS/voicepeak")
 
-def synth(text, narrator, valence=0.0, intensity=0.0, speed=100, out_path="out.wav"):
+def _bucket(value, step):
+    """value を step 刻みに丸める（step<=1 ならそのまま）。"""
+    step = int(step)
+    if step <= 1:
+        return int(value)
+    return int(round(value / step) * step)
+
+
+def engine_params(valence=0.0, intensity=0.0, speed=100, emotion_step=1, pitch_step=1):
+    """
+    valence / intensity / speed から VOICEPEAK に実際に渡す整数パラメータを求める。
+    キャッシュキーもこの値から作るので、同じ音声になる入力は同じキーになる。
+    emotion_step / pitch_step: happy・sad / pitch をさらに粗く丸める刻み（1 で丸めなし）
+    """
     # 1. V, I をクリップ
     v = max(-1.0, min(1.0, float(valence)))   # -1〜+1
     I = max(-1.0, min(1.0, float(intensity))) # -1〜+1（今は未使用）
@@ -33,18 +47,29 @@ def synth(text, narrator, valence=0.0, intensity=0.0, speed=100, out_path="out.w
     sad_norm   = max(0.0, min(1.0, sad_norm))
 
     # 5. Voicepeak の 0〜100 にスケーリング
-    happy = round(100 * happy_norm)
-    sad   = round(100 * sad_norm)
-
-    emo = f"happy={happy},sad={sad}"
+    happy = _bucket(round(100 * happy_norm), emotion_step)
+    sad   = _bucket(round(100 * sad_norm), emotion_step)
 
     # 6. valence からピッチ[%]を計算（0%が平均、-150〜+150%）
     PITCH_MAX = 150.0  # [%]
     pitch_percent = v * PITCH_MAX
-    pitch_int = int(round(pitch_percent))  # VOICEPEAK に渡す整数
+    pitch_int = _bucket(int(round(pitch_percent)), pitch_step)  # VOICEPEAK に渡す整数
 
     speed_int = max(50, min(150, int(speed)))
 
+    return {"happy": happy, "sad": sad, "pitch": pitch_int, "speed": speed_int}
+
+
+def synth(text, narrator, valence=0.0, intensity=0.0, speed=100, out_path="out.wav",
+          emotion_step=1, pitch_step=1):
+    params = engine_params(valence, intensity, speed, emotion_step, pitch_step)
+    happy = params["happy"]
+    sad = params["sad"]
+    pitch_int = params["pitch"]
+    speed_int = params["speed"]
+
+    emo = f"happy={happy},sad={sad}"
+
     tmpdir = tempfile.mkdtemp(prefix="vp_")
     try:
         tmp = os.path.join(tmpdir, "seg.wav")